@@ -1,23 +1,148 @@
 
 config = {
+    # code steps of completed tasks, keyed by the normalized task and the domain of the site the steps act on (that of their
+    # first navigation when they start by navigating, e.g. from the blank page of a new session). Only exact repeats
+    # of a task (up to case, whitespace and punctuation) are served, not the same task with different parameters. A repeated
+    # task is first replayed step by step in the browser, and handed to the planner with the progress so far if a step fails.
+    # With verify, the planner also checks the page after a full replay before the task is reported as finished, since a
+    # cached step can still run on a page that changed: this costs a planner turn (and its questions) on every hit.
+    # Set it to False to finish replayed tasks without any LLM call
+    "trajectory_cache": {
+        "enabled": False,
+        "verify": True,
+        "path": ".cache/trajectories", # directory to persist trajectories to, set to None to keep them in memory only
+    },
+    # LLM completions keyed by the model, the messages and the functions. Agents use it if their "completion_cache" is True.
+    # In "record" mode cached completions are returned and new ones are stored, so a rerun (e.g. after a crash) does not
+    # pay again for steps that were already completed. In "replay" mode a completion that was not recorded is an error,
+    # so a recorded session can be re-run offline, e.g. for performance regression runs.
+    # opt-in: a cached completion is returned for the same prompt, so a rerun of a task whose first planner turn went wrong
+    # gets the same wrong plan. Enable it for crash recovery and replay runs (the batch runner's --completion-cache-mode does)
+    "completion_cache": {
+        "enabled": False,
+        "mode": "record",
+        "path": ".cache/completions", # directory to persist completions to, set to None to keep them in memory only
+        "size_limit_mb": 1024, # least recently used completions are evicted beyond this size
+    },
+    # spans of every task (LLM calls of the agents, HTML fetches, chunking, indexing, retrieval, code executions, with the
+    # timings reported by the browser console), summarized per task and appended to path as JSONL if it is set
+    "tracing": {
+        "enabled": True,
+        "path": None, # e.g. "traces.jsonl"
+    },
+    "browser_console": {
+        "request_timeout": 120, # seconds after which a request (e.g. executing code) is aborted by the browser console
+        "heartbeat_interval": 20, # seconds between websocket pings, the connection is reopened if one is not answered
+        "heartbeat_timeout": 20,
+        "reconnect_attempts": 5,
+        "reconnect_delay": 1.0, # seconds before the first reconnection attempt, doubled after each failed attempt
+        # lease an isolated browser session (context and page) from the pool of the browser console, so that several
+        # AutoBrowse instances can run in parallel. If False the default page of the browser is used.
+        "lease_session": True,
+    },
     "html_assistant": {
         "model": "gpt-3.5-turbo-16k",
+        "completion_cache": True, # uses the completion cache when it is enabled
         "system_message": """You are a helpful AI Assistant. You will answer questions about HTML code. Respond only with HTML code from the HTML that is provided to you.
-            (i.e. find the answer only in the HTML that you are given, don't make up imaginary HTML) """,
+            (i.e. find the answer only in the HTML that you are given, don't make up imaginary HTML)
+            If you are given an outline of the page instead of HTML, respond only with lines of the outline, keeping their [ref=N] references. """,
+        # how the HTML of large pages is chunked: "tokens" cuts it on tag boundaries,
+        # "dom" packs whole subtrees (e.g. forms, result lists) into chunks and records their CSS/XPath path
+        "chunking": "dom",
+        # how chunks relevant to a question are retrieved: "faiss" (OpenAI embeddings), "bm25" (local lexical index over
+        # text and id/name/class/placeholder/type attributes, no network) or "hybrid" (bm25 re-ranked with cached embeddings)
+        "retrieval": "faiss",
+        # pages larger than context_token_budget tokens are split into fragments of fragment_size tokens,
+        # and the most relevant fragments are packed into the budget (it must fit in the context window of the model)
+        "context_token_budget": 4_000,
+        "fragment_size": 800,
+        # number of answers kept in the cache of answers to questions about unchanged pages
+        "answer_cache_size": 256,
+        # how the browser console extracts the HTML of the page: "inpage" prunes it inside the page in a single traversal
+        # and returns it compact, "jsdom" re-parses page.content() with JSDOM and pretty-prints it
+        "html_extraction": "inpage",
+        # parts of the page tried before retrieving from the full page, narrowest first: "subtree" (an element named
+        # in the question, e.g. #searchInput), "interactive" (inputs, buttons, links... with their labels, for
+        # questions about them) and "viewport" (what is on screen, for questions about popups, banners...)
+        "html_scopes": ["subtree", "interactive", "viewport"],
+        # "html" sends the cleaned HTML of the page as context, "outline" a compact outline of the page with one element
+        # per line (role, name, value and a reference like [ref=12]), which takes far fewer tokens
+        "page_format": "html",
+        # after code was executed successfully, fetch and index the new page in the background while the planner thinks,
+        # once its version stays the same for settle_delay seconds (or after max_settle_time seconds)
+        "prefetch": {
+            "enabled": True,
+            "settle_delay": 0.5,
+            "max_settle_time": 5.0,
+        },
+        # opt-in: questions go to the first model of the cascade their prompt (question and context) fits in, by max_prompt_tokens,
+        # and an empty answer is asked again to the next model. models must be in OAI_CONFIG_LIST.
+        # Disabled, every question goes to model
+        "cascade": {
+            "enabled": False,
+            "models": ["gpt-3.5-turbo", "gpt-3.5-turbo-16k"],
+            "max_prompt_tokens": {"gpt-3.5-turbo": 3_000},
+        },
+        # questions asked together with ask_html_assistant_batch are answered from one fetch of the page, packed
+        # into prompts of at most max_questions questions and token_budget tokens of context, answered concurrently
+        "batch": {
+            "max_questions": 8,
+            "token_budget": 8_000,
+        },
+        "embedding_cache": {
+            "max_entries": 10_000, # number of chunk embeddings kept in memory
+            "path": ".cache/embeddings", # directory to persist embeddings to, set to None to keep them in memory only
+        },
     },
     "code_generator": {
         "model": "gpt-4",
+        "completion_cache": True, # uses the completion cache when it is enabled
         "system_message": """You are a Javascript engineer. You generate puppeteer.js javascript code to fulfill
             a given task that has to do with web browsing. The output of this agent should only be code (inside codeblocks). You may also be
             asked to correct code.  You should assume that the puppeteer environment has already been initialized with the following code:
             const browser = await puppeteer.launch({ headless: false });
             const page = await browser.newPage();
-            Whenever you go to a new website you should use the  { waitUntil: 'networkidle0' } option to make sure the page is fully loaded.
+            Do not use the { waitUntil: 'networkidle0' } option, which can take seconds or time out on pages with ads and analytics. Instead, after going to a new website
+            or an action that loads new content, wait for the page to be ready with the waitUntilReady function of the environment:
+            await waitUntilReady({ selector: '#results' }) waits until the element you need next is visible (prefer this when you know it),
+            await waitUntilReady() waits until the page stops changing, and await waitUntilReady({ strategy: 'network-idle' }) waits until the page
+            has no requests in flight, apart from ads and analytics.
             Before typing text into an input field you should first click on it to make sure it is focused.
             If you get a 'Node is either not clickable or not an Element' error, you are probably trying to click on the wrong element, so if there is no other element
             that you can click, you should reply with NOT_CLICKABLE <element_name> .
+            The HTML context may also be an outline of the page, with one element per line and a reference like [ref=12]. You can select such an element with
+            the selector returned by ref(12), e.g. await page.click(ref(12)) .
             You may also be provided the execution result of the code. If you see success:true in the execution result, you should reply with TERMINATE .
-            """
+            """,
+        # stream the replies of the code generator, and execute each code block in the browser as soon as it is complete,
+        # while the rest of the reply is generated (the stream is cancelled if a block fails)
+        "streaming": True,
+        # the code executed so far is sent with every request: the last keep_last code blocks verbatim, and a summary
+        # of the older ones (visited URLs, filled fields, clicked elements), within token_budget tokens
+        "code_history": {
+            "keep_last": 3,
+            "token_budget": 1_000,
+        },
+        # models from the fastest to the strongest (they must be in OAI_CONFIG_LIST): a step starts at the model routed to
+        # for its type, guessed from the request of the planner (navigate, click, type, select, scroll, multi for several
+        # actions, other), skipping the models its prompt exceeds the max_prompt_tokens of. When its code fails to execute
+        # or the code generator does not finish with TERMINATE, the step is asked again to the next model.
+        # The success rate and latency of each model are reported by AutoBrowse.model_cascade_stats()
+        # opt-in: disabled, every step goes to model
+        "cascade": {
+            "enabled": False,
+            "models": ["gpt-3.5-turbo", "gpt-4"],
+            "routes": {
+                "navigate": "gpt-3.5-turbo",
+                "click": "gpt-3.5-turbo",
+                "type": "gpt-3.5-turbo",
+                "select": "gpt-3.5-turbo",
+                "scroll": "gpt-3.5-turbo",
+                "multi": "gpt-4",
+                "other": "gpt-4",
+            },
+            "max_prompt_tokens": {"gpt-3.5-turbo": 3_000},
+        },
     },
     "code_generator_user_proxy": {
         "max_consecutive_auto_reply" : 1,
@@ -25,8 +150,10 @@ config = {
 
     "planner": {
         "model": "gpt-4",
+        "completion_cache": True, # uses the completion cache when it is enabled
         "system_message": """You are a planner. You generate a plan to fulfill a web browsing task. This is done through the use of 2 other AI assistant agents. You can propose the usage of two functions : 1. ask_html_assistant (to ask questions about the current
             page in the browser - the result will be HTML code) Keep in mind that this agent is not able to make any modifications to the page, only respond to questions about it. 2. ask_code_generator (to generate and execute puppeteer.js code in the browser) .
+            To ask the html_assistant several questions about the same page (e.g. the fields and the submit button of a form), use ask_html_assistant_batch with the list of questions: it answers them all at once, faster than asking them one by one.
             The code_generator does not have the HTML context, so you may need to provide it with the HTML from the html_assistant.
             PLEASE MAKE SURE TO ASK THE HTML ASSISTANT FOR RELEVANT CONTEXT AND PROVIDE THE RETRIEVED HTML AS CONTEXT TO THE CODE GENERATOR!!!! If the context is not needed then pass an empty string as context_html.
             So you might want to first ask the html_assistant a question about the HTML content, and then use the result of that question as context input to the code_generator. 
@@ -41,6 +168,13 @@ config = {
             When the plan has been successfully completed reply with FINISHED.
             Take a deep breath and work on this problem step-by-step.
             """,
+        # the conversation sent to the planner: all but the keep_recent_html most recent HTML fragments (returned by the
+        # html_assistant or passed as context_html) are replaced by short references, and if the conversation still exceeds
+        # token_budget tokens the oldest turns of the task are left out
+        "memory": {
+            "token_budget": 6_000,
+            "keep_recent_html": 1,
+        },
     },
 
     "planner_user_proxy": {
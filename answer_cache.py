@@ -0,0 +1,70 @@
+import re
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+def normalize_question(question: str) -> str:
+    '''
+    Normalize a question so that near-identical questions (differing in case, punctuation or whitespace) share a key.
+    '''
+    return " ".join(re.findall(r"[a-z0-9#._-]+", question.lower()))
+
+
+class AnswerCache:
+    '''
+    An LRU cache of html_assistant answers keyed by the fingerprint of the page (URL and DOM version)
+    and the normalized question.
+    '''
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.answers: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, page_fingerprint: str, question: str) -> Tuple[str, str]:
+        return page_fingerprint, normalize_question(question)
+
+    def get(self, page_fingerprint: Optional[str], question: str) -> Optional[str]:
+        if page_fingerprint is None:
+            # the page version is unknown, so a cached answer can not be trusted
+            self.misses += 1
+            return None
+        key = self.key(page_fingerprint, question)
+        answer = self.answers.get(key)
+        if answer is None:
+            self.misses += 1
+            return None
+        self.answers.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    def put(self, page_fingerprint: Optional[str], question: str, answer: str):
+        if page_fingerprint is None:
+            return
+        key = self.key(page_fingerprint, question)
+        self.answers[key] = answer
+        self.answers.move_to_end(key)
+        while len(self.answers) > self.max_entries:
+            self.answers.popitem(last=False)
+
+    def invalidate(self):
+        '''
+        Drop all answers, e.g. after code was executed in the browser.
+        '''
+        if self.answers:
+            self.invalidations += 1
+        self.answers.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.answers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
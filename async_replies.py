@@ -0,0 +1,151 @@
+import asyncio
+import json
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from autogen import ConversableAgent, oai
+from autogen.agentchat.agent import Agent
+from termcolor import colored
+
+from completion_cache import CompletionCache, completion_key
+from tracing import span
+
+
+def register_async_reply(agent: ConversableAgent, reply_func: Callable, before: Callable):
+    '''
+    Register an async reply function right before the sync reply function it replaces.
+    autogen skips async reply functions in generate_reply, and a_generate_reply reaches the async one first,
+    so the sync and async chats behave the same.
+    '''
+    functions = [reply_func_tuple["reply_func"] for reply_func_tuple in agent._reply_func_list]
+    position = functions.index(before) if before in functions else 0
+    agent.register_reply([Agent, None], reply_func, position=position)
+
+
+def register_async_replies(agent: ConversableAgent, async_function_map: Optional[Dict[str, Callable]] = None, completion_cache: Optional[CompletionCache] = None):
+    '''
+    Make the LLM calls and function calls of an agent awaitable in async chats (a_initiate_chat):
+    LLM calls run in a worker thread, so that several can be in flight, and function calls
+    use the coroutine functions of async_function_map instead of the functions of the function map.
+    If a completion cache is given, LLM calls of the agent go through it.
+    '''
+    agent.async_function_map = async_function_map or {}
+    agent.completion_cache = completion_cache
+    # tokens used (and cost) of the LLM calls made in async chats
+    agent.token_usage = new_token_usage()
+    register_async_reply(agent, a_generate_oai_reply, ConversableAgent.generate_oai_reply)
+    register_async_reply(agent, a_generate_function_call_reply, ConversableAgent.generate_function_call_reply)
+
+
+def new_token_usage() -> Dict[str, float]:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+
+
+def _generate_oai_reply(
+    recipient: ConversableAgent,
+    messages: Optional[List[Dict]] = None,
+    sender: Optional[Agent] = None,
+    config: Optional[Any] = None,
+) -> Tuple[bool, Union[str, Dict, None]]:
+    '''
+    Same as ConversableAgent.generate_oai_reply, going through the completion cache of the agent if it has one,
+    and adding the token usage of the response to the agent.
+    '''
+    llm_config = recipient.llm_config if config is None else config
+    if llm_config is False:
+        return False, None
+    if messages is None:
+        messages = recipient._oai_messages[sender]
+    context = messages[-1].pop("context", None)
+    messages = recipient._oai_system_message + messages
+    models = [config.get("model") for config in llm_config.get("config_list", [])]
+    with span("llm", agent=recipient.name, model=models[0] if models else llm_config.get("model")) as llm_span:
+        completion_cache = getattr(recipient, "completion_cache", None)
+        if completion_cache is not None:
+            key = completion_key(llm_config, messages)
+            response = completion_cache.get(key)
+            if response is not None:
+                if llm_span is not None:
+                    llm_span.set(cached=True)
+                return True, oai.ChatCompletion.extract_text_or_function_call(response)[0]
+            # the completion cache replaces the cache of autogen for this agent
+            response = oai.ChatCompletion.create(context=context, messages=messages, use_cache=False, **llm_config)
+            completion_cache.put(key, response)
+        else:
+            response = oai.ChatCompletion.create(context=context, messages=messages, **llm_config)
+        usage = response.get("usage", {})
+        token_usage = recipient.token_usage
+        token_usage["calls"] += 1
+        for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            token_usage[name] += usage.get(name, 0)
+        token_usage["cost"] += response.get("cost", 0.0)
+        if llm_span is not None:
+            llm_span.set(
+                model=response.get("model", llm_span.attributes["model"]),
+                prompt_tokens=usage.get("prompt_tokens", 0),
+                completion_tokens=usage.get("completion_tokens", 0),
+                cost=response.get("cost", 0.0),
+            )
+        return True, oai.ChatCompletion.extract_text_or_function_call(response)[0]
+
+
+async def a_generate_oai_reply(
+    recipient: ConversableAgent,
+    messages: Optional[List[Dict]] = None,
+    sender: Optional[Agent] = None,
+    config: Optional[Any] = None,
+) -> Tuple[bool, Union[str, Dict, None]]:
+    # autogen's completion client is synchronous
+    return await asyncio.to_thread(_generate_oai_reply, recipient, messages, sender, config)
+
+
+async def a_generate_function_call_reply(
+    recipient: ConversableAgent,
+    messages: Optional[List[Dict]] = None,
+    sender: Optional[Agent] = None,
+    config: Optional[Any] = None,
+) -> Tuple[bool, Union[str, Dict, None]]:
+    if messages is None:
+        messages = recipient._oai_messages[sender]
+    message = messages[-1]
+    if "function_call" in message:
+        _, func_return = await a_execute_function(recipient, message["function_call"])
+        return True, func_return
+    return False, None
+
+
+async def a_execute_function(agent: ConversableAgent, func_call: Dict) -> Tuple[bool, Dict[str, str]]:
+    '''
+    Async counterpart of ConversableAgent.execute_function: coroutine functions of the async function map
+    of the agent are awaited, other functions of its function map run in a worker thread.
+    '''
+    func_name = func_call.get("name", "")
+    func = getattr(agent, "async_function_map", {}).get(func_name)
+    if func is None and agent._function_map.get(func_name) is not None:
+        sync_func = agent._function_map[func_name]
+        func = lambda **arguments: asyncio.to_thread(sync_func, **arguments)
+
+    is_exec_success = False
+    if func is not None:
+        # Extract arguments from a json-like string and put it into a dict.
+        input_string = agent._format_json_str(func_call.get("arguments", "{}"))
+        try:
+            arguments = json.loads(input_string)
+        except json.JSONDecodeError as e:
+            arguments = None
+            content = f"Error: {e}\n You argument should follow json format."
+
+        if arguments is not None:
+            print(colored(f"\n>>>>>>>> EXECUTING FUNCTION {func_name}...", "magenta"), flush=True)
+            try:
+                content = await func(**arguments)
+                is_exec_success = True
+            except Exception as e:
+                content = f"Error: {e}"
+    else:
+        content = f"Error: Function {func_name} not found."
+
+    return is_exec_success, {
+        "name": func_name,
+        "role": "function",
+        "content": str(content),
+    }
@@ -1,12 +1,29 @@
 
-from typing import Any, Dict, List
+import asyncio
+import contextlib
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 import autogen
 
+from autogen import ConversableAgent
 from autogen.agentchat.assistant_agent import AssistantAgent
 from autogen.code_utils import extract_code
 
 from browser_proxy_agent import BrowserProxyAgent
-from retrieve_html_proxy_agent import RetrieveHTMLProxyAgent
+from browser_console_client import BrowserConsoleClient
+from event_loop import EventLoopThread
+from async_replies import a_generate_oai_reply, register_async_replies
+from retrieve_html_proxy_agent import RetrieveHTMLProxyAgent, parse_batch_answers
+from answer_cache import AnswerCache
+from completion_cache import CompletionCache
+from code_history import CodeHistory
+from model_cascade import ModelCascade, is_failed_execution, step_type
+from planner_memory import PlannerMemory
+from streaming_code import StreamingCodeGenerator
+from token_count import num_tokens_from_string
+from tracing import span, start_trace
+from trajectory_cache import TrajectoryCache, page_domain
 import agent_config
 
 
@@ -37,17 +54,60 @@ def is_termination_message_for_planner(message):
 
 class AutoBrowse:
     
-    def __init__(self, config: Dict[str, Any], browser_console_uri: str = "ws://localhost:3000"):
+    def __init__(self, config: Dict[str, Any], browser_console_uri: str = "ws://localhost:3000", browser_console: Optional[BrowserConsoleClient] = None):
         # global variable tracking code blocks executed thus far
         self.code_executed_so_far = []
         # browser console uri to send puppeteer.js code to and fetch HTML from
         self.browser_console_uri = browser_console_uri
+        browser_console_config = dict(config.get("browser_console", {}))
+        lease_session = browser_console_config.pop("lease_session", True)
+        # a single connection to the browser console shared by all the agents (and by several AutoBrowse instances if it is given),
+        # on a long-lived event loop that the synchronous entry points also run on
+        if browser_console is None:
+            self.runtime = EventLoopThread()
+            browser_console = BrowserConsoleClient(browser_console_uri, runtime=self.runtime, **browser_console_config)
+        else:
+            self.runtime = browser_console.runtime
+        self.browser_console = browser_console
+        # an isolated browser session (context and page) leased from the pool of the browser console,
+        # so that several AutoBrowse instances can run tasks in parallel in the same browser
+        self.session = self.runtime.run(self.browser_console.acquire_session()) if lease_session else None
+        browser = self.session if self.session is not None else self.browser_console
+        # html_assistant answers keyed by page version and question
+        self.answer_cache = AnswerCache(config["html_assistant"].get("answer_cache_size", 256))
+        # history of the code executed so far sent to the code generator: the last blocks verbatim, older ones summarized
+        code_history_config = config["code_generator"].get("code_history", {})
+        self.code_history = CodeHistory(code_history_config.get("keep_last", 3), code_history_config.get("token_budget", 1_000))
+        # code steps of completed tasks, replayed when a task is repeated on the same site
+        trajectory_cache_config = config.get("trajectory_cache", {})
+        self.trajectory_cache = TrajectoryCache(trajectory_cache_config.get("path")) if trajectory_cache_config.get("enabled", False) else None
+        # after a full replay the planner checks that the task is done (and finishes it if needed) before it is reported as finished
+        self.verify_replays = trajectory_cache_config.get("verify", True)
+        # spans of every task (LLM calls, HTML fetches, indexing, code executions...), exported as JSONL if a path is given
+        tracing_config = config.get("tracing", {})
+        self.tracing = tracing_config.get("enabled", False)
+        self.trace_path = tracing_config.get("path")
+        self.last_trace_summary = None
+        # whether the planner reported that the last task was completed
+        self.last_task_finished = False
+        # "hit" (no LLM call), "verified_hit" (replayed, then checked by the planner), "fallback" or "miss"
+        # if the trajectory cache was used for the last task
+        self.last_trajectory_outcome = None
+        # LLM completions keyed by model, messages and functions, used by the agents that enable it
+        completion_cache_config = config.get("completion_cache", {})
+        self.completion_cache = None
+        if completion_cache_config.get("enabled", False):
+            self.completion_cache = CompletionCache(completion_cache_config.get("mode", "record"), completion_cache_config.get("path"), int(completion_cache_config.get("size_limit_mb", 1024) * 2**20))
+        completion_caches = {
+            name: self.completion_cache if config[name].get("completion_cache", False) else None
+            for name in ["planner", "html_assistant", "code_generator"]
+        }
         # initialize agents
-        self.init_html_assistant(config["html_assistant"].get("model"), config["html_assistant"].get("system_message"))
-        self.init_code_generator(config["code_generator"].get("model"), config["code_generator"].get("system_message"), config["code_generator_user_proxy"].get("max_consecutive_auto_reply", 0), browser_console_uri= self.browser_console_uri)
-        self.init_planner(config["planner"].get("model"), config["planner"].get("system_message"), config["planner_user_proxy"].get("max_consecutive_auto_reply", 0))
+        self.init_html_assistant(config["html_assistant"].get("model"), config["html_assistant"].get("system_message"), config["html_assistant"].get("embedding_cache"), config["html_assistant"].get("chunking", "tokens"), config["html_assistant"].get("retrieval", "faiss"), config["html_assistant"].get("context_token_budget", 4_000), config["html_assistant"].get("fragment_size", 800), config["html_assistant"].get("html_extraction", "inpage"), config["html_assistant"].get("html_scopes", []), config["html_assistant"].get("page_format", "html"), browser_console=browser, completion_cache=completion_caches["html_assistant"], prefetch_config=config["html_assistant"].get("prefetch"), cascade_config=config["html_assistant"].get("cascade"), batch_config=config["html_assistant"].get("batch"))
+        self.init_code_generator(config["code_generator"].get("model"), config["code_generator"].get("system_message"), config["code_generator_user_proxy"].get("max_consecutive_auto_reply", 0), browser_console_uri= self.browser_console_uri, browser_console=browser, completion_cache=completion_caches["code_generator"], streaming=config["code_generator"].get("streaming", False), cascade_config=config["code_generator"].get("cascade"))
+        self.init_planner(config["planner"].get("model"), config["planner"].get("system_message"), config["planner_user_proxy"].get("max_consecutive_auto_reply", 0), completion_cache=completion_caches["planner"], memory_config=config["planner"].get("memory"))
 
-    def init_planner(self, model_name = "gpt-4", system_message = "", max_consecutive_auto_reply = 0):
+    def init_planner(self, model_name = "gpt-4", system_message = "", max_consecutive_auto_reply = 0, completion_cache = None, memory_config = None):
         '''
         Initialize the planner agent, which generates a plan to fulfill a web browsing task.
         '''
@@ -79,6 +139,21 @@ class AutoBrowse:
                         "required": ["message"],
                     },
                 },
+                {
+                    "name": "ask_html_assistant_batch",
+                    "description": "ask several questions at once to the html_assistant about the current page, the answers are returned as a JSON list of {question, answer}",
+                    "parameters": {
+                        "type": "object",
+                        "properties": {
+                            "questions": {
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "description": "the questions to ask the html_assistant about the current page",
+                            },
+                        },
+                        "required": ["questions"],
+                    },
+                },
                 {
                     "name": "ask_code_generator",
                     "description": "ask a question to the code_generator",
@@ -118,11 +193,22 @@ class AutoBrowse:
             is_termination_msg=is_termination_message_for_planner,
             function_map={
                 "ask_html_assistant": self.ask_html_assistant,
+                "ask_html_assistant_batch": self.ask_html_assistant_batch,
                 "ask_code_generator": self.ask_code_generator,
             },
         )
-
-    def init_html_assistant(self, model_name = "gpt-3.5-turbo-16k", system_message = ""):
+        # LLM calls run in worker threads and functions are awaited in async chats
+        register_async_replies(self.planner, completion_cache=completion_cache)
+        # the prompts of the planner are kept within a token budget, with stale HTML replaced by references
+        self.planner_memory = PlannerMemory(**(memory_config or {}))
+        self.planner_memory.register(self.planner)
+        register_async_replies(self.planner_user_proxy, async_function_map={
+            "ask_html_assistant": self.ask_html_assistant_async,
+            "ask_html_assistant_batch": self.ask_html_assistant_batch_async,
+            "ask_code_generator": self.ask_code_generator_async,
+        })
+
+    def init_html_assistant(self, model_name = "gpt-3.5-turbo-16k", system_message = "", embedding_cache_config = None, chunking = "tokens", retrieval = "faiss", context_token_budget = 4_000, fragment_size = 800, html_extraction = "inpage", html_scopes = None, page_format = "html", browser_console = None, completion_cache = None, prefetch_config = None, cascade_config = None, batch_config = None):
         llm_config_list = autogen.config_list_from_json(
             "OAI_CONFIG_LIST",
             file_location=".",
@@ -138,15 +224,33 @@ class AutoBrowse:
             # the default system message of the AssistantAgent is overwritten here
             system_message=system_message,
         )
+        register_async_replies(self.html_assistant, completion_cache=completion_cache)
+        # questions go to the fastest model their prompt fits in, an empty answer is asked again to the next model
+        self.html_assistant_cascade = None
+        if cascade_config and cascade_config.get("enabled", False):
+            self.html_assistant_cascade = ModelCascade(cascade_config["models"], cascade_config.get("routes"), cascade_config.get("max_prompt_tokens"), escalate_on="reply")
+            self.html_assistant_cascade.register(self.html_assistant, a_generate_oai_reply)
 
         # create a UserProxyAgent instance to interact with html_assistant
         self.html_proxy = RetrieveHTMLProxyAgent(
             name="html_user_proxy",
             human_input_mode="NEVER",
             max_consecutive_auto_reply=0,
+            embedding_cache_config=embedding_cache_config,
+            chunking=chunking,
+            retrieval=retrieval,
+            context_token_budget=context_token_budget,
+            fragment_size=fragment_size,
+            html_extraction=html_extraction,
+            html_scopes=html_scopes,
+            page_format=page_format,
+            prefetch_config=prefetch_config,
+            batch_config=batch_config,
+            browser_console_uri=self.browser_console_uri,
+            browser_console=browser_console,
         )
 
-    def init_code_generator(self, model_name = "gpt-4", system_message = "", max_consecutive_auto_reply = 3, browser_console_uri = "ws://localhost:3000"):
+    def init_code_generator(self, model_name = "gpt-4", system_message = "", max_consecutive_auto_reply = 3, browser_console_uri = "ws://localhost:3000", browser_console = None, completion_cache = None, streaming = False, cascade_config = None):
         llm_config_list = autogen.config_list_from_json(
             "OAI_CONFIG_LIST",
             file_location=".",
@@ -164,6 +268,7 @@ class AutoBrowse:
             # the default system message of the AssistantAgent is overwritten here
             system_message=system_message,
         )
+        register_async_replies(self.code_generator, completion_cache=completion_cache)
 
         # create a UserProxyAgent instance to interact with the code_generator
         self.code_generator_user_proxy = BrowserProxyAgent(
@@ -173,35 +278,276 @@ class AutoBrowse:
             is_termination_msg=is_termination_message_for_code_generator,
             code_execution_config={"work_dir": "code_execution"},
             browser_console_uri= browser_console_uri,
+            browser_console=browser_console,
         )
+        # code blocks are executed in the browser as soon as they are streamed, while the rest of the reply is generated
+        self.streaming_code_generator = None
+        if streaming:
+            self.streaming_code_generator = StreamingCodeGenerator(self.code_generator_user_proxy)
+            self.streaming_code_generator.register(self.code_generator)
+        # steps start at the fastest model routed to for their type and prompt size, and are retried with the next model
+        # of the cascade when the code fails to execute or the code generator does not finish with TERMINATE
+        self.code_generator_cascade = None
+        if cascade_config and cascade_config.get("enabled", False):
+            self.code_generator_cascade = ModelCascade(cascade_config["models"], cascade_config.get("routes"), cascade_config.get("max_prompt_tokens"), escalate_on="execution")
+            self.code_generator_cascade.register(self.code_generator, self.streaming_code_generator.a_generate_reply if streaming else a_generate_oai_reply)
+
+    def close(self):
+        '''
+        Release the browser session of this instance back to the pool of the browser console
+        '''
+        self.runtime.run(self.close_async())
 
-    def ask_planner(self, question: str) -> str:
+    async def close_async(self):
+        self.html_proxy.cancel_prefetch()
+        if self.session is not None:
+            await self.runtime.run_async(self.session.release())
+            self.session = None
+
+    def ask_planner(self, question: str, return_trace_summary: bool = False) -> Union[str, Tuple[str, Dict[str, Any]]]:
         '''
         Entrypoint function to Autobrowse to fulfill  a web browsing task.
+        Runs ask_planner_async on the event loop of AutoBrowse.
+        '''
+        return self.runtime.run(self.ask_planner_async(question, return_trace_summary))
+
+    async def ask_planner_async(self, question: str, return_trace_summary: bool = False) -> Union[str, Tuple[str, Dict[str, Any]]]:
+        '''
+        (async) Entrypoint function to Autobrowse to fulfill a web browsing task.
+        LLM calls, HTML fetches and embedding calls are awaited, so this can run in the event loop of an async service.
+        One task runs at a time per AutoBrowse instance.
+        If return_trace_summary is True, the summary of the trace of the task (where its time, tokens and cost went)
+        is returned with the final code.
         '''
-        self.planner_user_proxy.initiate_chat(
+        trace = None
+        try:
+            with (start_trace(question, self.trace_path) if self.tracing else contextlib.nullcontext()) as trace:
+                final_code_executed = await self._run_task(question)
+        finally:
+            # also when the task failed or was cancelled, e.g. by a timeout
+            self.last_trace_summary = trace.summary() if trace is not None else None
+        if return_trace_summary:
+            return final_code_executed, self.last_trace_summary
+        return final_code_executed
+
+    async def _run_task(self, question: str) -> str:
+        self.reset_task_state()
+        message = question
+        self.last_trajectory_outcome = None
+        # domain of the page the task starts on: trajectories are looked up for it, and stored for the site their steps act on
+        domain = None
+        if self.trajectory_cache is not None:
+            page_version = await self.html_proxy.fetch_page_version()
+            domain = page_domain(page_version["url"] if page_version else None)
+        if domain is not None:
+            steps = self.trajectory_cache.get(question, domain)
+            self.last_trajectory_outcome = "miss"
+            if steps is not None:
+                failed_step, error = await self.replay_trajectory(steps)
+                if failed_step is None:
+                    self.last_trajectory_outcome = "verified_hit" if self.verify_replays else "hit"
+                    if not self.verify_replays:
+                        self.last_task_finished = True
+                        final_code_executed = "\n".join(self.code_executed_so_far)
+                        self.code_executed_so_far = []
+                        return final_code_executed
+                    # the steps may have run on a page that changed since they were cached
+                    message = self.augment_message_with_replay_verification(question)
+                else:
+                    self.last_trajectory_outcome = "fallback"
+                    message = self.augment_message_with_replay_progress(question, failed_step, error)
+
+        await self.planner_user_proxy.a_initiate_chat(
             self.planner,
-            message=question
+            clear_history=True,
+            message=message
         )
+        # whether the planner reported that the task was completed
+        self.last_task_finished = is_termination_message_for_planner(self.planner_user_proxy.last_message(self.planner))
+        if domain is not None and self.last_task_finished:
+            # the steps replayed before the planner took over are part of code_executed_so_far
+            self.trajectory_cache.put(question, domain, self.code_executed_so_far)
         final_code_executed = "\n".join(self.code_executed_so_far)
         self.code_executed_so_far = []
         return final_code_executed
 
+    def reset_task_state(self):
+        '''
+        Start a task from a clean state: no chat history in any of the agents (the previous task may have been
+        interrupted mid-chat, e.g. by a timeout) and no code executed so far
+        '''
+        for agent in [self.planner, self.planner_user_proxy, self.html_assistant, self.html_proxy, self.code_generator, self.code_generator_user_proxy]:
+            agent.reset()
+        self.code_executed_so_far = []
+
+    async def replay_trajectory(self, steps: List[str]) -> Tuple[Optional[str], Optional[str]]:
+        '''
+        Execute the code steps of a cached trajectory one by one in the browser, until one fails.
+        Returns the step that failed and its error, or (None, None) if all the steps succeeded.
+        '''
+        replayed = 0
+        failed_step, error = None, None
+        with span("replay_trajectory", steps=len(steps)):
+            for step in steps:
+                print(f"Replaying cached step {replayed + 1}/{len(steps)}:\n{step}")
+                exitcode, logs, _ = await self.code_generator_user_proxy.run_puppeteer_code(step)
+                if exitcode != 0:
+                    failed_step, error = step, logs
+                    break
+                self.code_executed_so_far.append(step)
+                replayed += 1
+        # the executed code may have changed the page
+        self.answer_cache.invalidate()
+        self.trajectory_cache.record_replay(replayed, completed=failed_step is None, verified=self.verify_replays)
+        return failed_step, error
+
+    def augment_message_with_replay_verification(self, question: str) -> str:
+        executed = "\n".join(self.code_executed_so_far)
+        return f"""{question}
+
+This task may already be done: this code, which completed the same task before, was just executed successfully:
+{executed}
+
+Check the current state of the page (e.g. with ask_html_assistant) before finishing. If the task is not done yet,
+continue it from the current state of the page."""
+
+    def augment_message_with_replay_progress(self, question: str, failed_step: str, error: str) -> str:
+        executed = "\n".join(self.code_executed_so_far) if self.code_executed_so_far else "(none)"
+        return f"""{question}
+
+Part of this task has already been done, by replaying code that completed the same task before.
+This code was executed successfully:
+{executed}
+
+This next step failed:
+{failed_step}
+Error message:
+{error}
+
+Continue the task from the current state of the page."""
+
 
 
     def ask_html_assistant(self, message: str) -> str:
         '''
         Function to ask the html assistant a question about the HTML content of the current page
         '''
-        self.html_proxy.initiate_chat(self.html_assistant, message=message)
-        last_message = self.html_proxy.last_message()["content"]
-        return last_message
+        return self.runtime.run(self.ask_html_assistant_async(message))
+
+    async def ask_html_assistant_async(self, message: str) -> str:
+        with span("ask_html_assistant") as step_span:
+            # the same question about an unchanged page is answered from the cache, without any LLM or embedding call
+            page_fingerprint = await self.html_proxy.fetch_page_fingerprint()
+            cached_answer = self.answer_cache.get(page_fingerprint, message)
+            if cached_answer is not None:
+                print("html_assistant answer cache hit")
+                if step_span is not None:
+                    step_span.set(cached=True)
+                return cached_answer
+            await self.html_proxy.a_initiate_chat(self.html_assistant, message=message)
+            last_message = self.html_proxy.last_message()["content"]
+            self.answer_cache.put(page_fingerprint, message, last_message)
+            return last_message
+
+    def ask_html_assistant_batch(self, questions: List[str]) -> str:
+        '''
+        Function to ask the html assistant several questions about the current page at once
+        '''
+        return self.runtime.run(self.ask_html_assistant_batch_async(questions))
+
+    async def ask_html_assistant_batch_async(self, questions: List[str]) -> str:
+        '''
+        Answer several questions about the current page with one fetch (and index) of the page, and one LLM call per batch
+        of questions that fit in a prompt, made concurrently. Returns a JSON list of {"question": ..., "answer": ...}.
+        '''
+        if isinstance(questions, str):
+            questions = [questions]
+        with span("ask_html_assistant_batch", questions=len(questions)) as step_span:
+            page_fingerprint = await self.html_proxy.fetch_page_fingerprint()
+            answers = {question: self.answer_cache.get(page_fingerprint, question) for question in questions}
+            pending = [question for question in answers if answers[question] is None]
+            if step_span is not None:
+                step_span.set(cached=len(answers) - len(pending))
+            if pending:
+                batches = await self.html_proxy.a_build_batch_messages(pending)
+                # the batches are independent of the chat of the html_assistant, so they are answered concurrently
+                replies = await asyncio.gather(*(
+                    self.html_assistant.a_generate_reply(
+                        messages=[{"role": "user", "content": message}],
+                        sender=self.html_proxy,
+                        exclude=[ConversableAgent.check_termination_and_human_reply],
+                    )
+                    for _, message in batches
+                ))
+                for (indices, _), reply in zip(batches, replies):
+                    content = reply.get("content") if isinstance(reply, dict) else reply
+                    for number, answer in parse_batch_answers(content or "", len(indices)).items():
+                        question = pending[indices[number - 1]]
+                        answers[question] = answer
+                        self.answer_cache.put(page_fingerprint, question, answer)
+                print(f"html_assistant answered {len(pending)} questions in {len(batches)} batched calls")
+            # the questions a batched reply left unanswered are asked one by one
+            for question in answers:
+                if answers[question] is None:
+                    answers[question] = await self.ask_html_assistant_async(question)
+            return json.dumps([{"question": question, "answer": answers[question]} for question in questions], indent=1)
+
+    def token_usage(self) -> Dict[str, Dict[str, float]]:
+        '''
+        Tokens used (and cost) by the LLM calls of each agent so far
+        '''
+        return {agent.name: dict(agent.token_usage) for agent in [self.planner, self.html_assistant, self.code_generator]}
+
+    def planner_memory_stats(self) -> Dict[str, float]:
+        '''
+        Prompt sizes of the planner per turn, and tokens saved by the planner memory
+        '''
+        return self.planner_memory.stats()
+
+    def prefetch_stats(self) -> Dict[str, int]:
+        '''
+        Background prefetches of the page started, completed, cancelled and used
+        '''
+        return self.html_proxy.prefetch_stats()
+
+    def code_history_stats(self) -> Dict[str, float]:
+        '''
+        Tokens of code history sent to the code generator, and tokens saved by summarizing older code blocks
+        '''
+        return self.code_history.stats()
+
+    def completion_cache_stats(self) -> Dict[str, float]:
+        '''
+        Hits and misses of the completion cache (empty if it is disabled)
+        '''
+        return self.completion_cache.stats() if self.completion_cache is not None else {}
+
+    def trajectory_cache_stats(self) -> Dict[str, float]:
+        '''
+        Hits (without any LLM call, and verified by the planner) and fallbacks of the trajectory cache (empty if it is disabled)
+        '''
+        return self.trajectory_cache.stats() if self.trajectory_cache is not None else {}
+
+    def answer_cache_stats(self) -> Dict[str, float]:
+        '''
+        Hit/miss counters of the html_assistant answer cache
+        '''
+        return self.answer_cache.stats()
+
+    def model_cascade_stats(self) -> Dict[str, Dict[str, Any]]:
+        '''
+        Attempts, success rate and latency per model of the cascades of the code generator and the html_assistant,
+        and escalations (empty for the agents without a cascade)
+        '''
+        cascades = {"code_generator": self.code_generator_cascade, "html_assistant": self.html_assistant_cascade}
+        return {name: cascade.stats() if cascade is not None else {} for name, cascade in cascades.items()}
 
     def augment_message_to_code_gen(self, message: str, context_html: str):
         '''
-        Augment the question to code_generator by appending the relevant HTML for it to complete the task, and the code executed so far.
+        Augment the question to code_generator by appending the relevant HTML for it to complete the task, and the code executed so far
+        (the most recent code blocks, and a summary of the older ones).
         '''
-        code_executed_so_far_str = "\n".join(self.code_executed_so_far)
+        code_executed_so_far_str = self.code_history.build(self.code_executed_so_far)
         if code_executed_so_far_str:
             if  context_html:
                 return f'''{message}\n\nThis is the relevant HTML from the current page:\n\n{context_html}\n\nThis is the code already executed so far:\n{code_executed_so_far_str}'''
@@ -218,7 +564,22 @@ class AutoBrowse:
             message (str): the question to ask code_generator
             context_html (str): the relevant HTML for code_generator to complete the task
         """
-        self.code_generator_user_proxy.initiate_chat(self.code_generator, message=self.augment_message_to_code_gen(message, context_html))
+        return self.runtime.run(self.ask_code_generator_async(message, context_html))
+
+    async def ask_code_generator_async(self, message: str, context_html = "") -> str:
+        with span("ask_code_generator"):
+            return await self._ask_code_generator(message, context_html)
+
+    async def _ask_code_generator(self, message: str, context_html = "") -> str:
+        # the page is about to change
+        self.html_proxy.cancel_prefetch()
+        request = self.augment_message_to_code_gen(message, context_html)
+        if self.code_generator_cascade is None:
+            await self.code_generator_user_proxy.a_initiate_chat(self.code_generator, message=request)
+        else:
+            await self.ask_code_generator_cascade(message, request)
+        # the executed code may have changed the page
+        self.answer_cache.invalidate()
         #  -2 is the execution result,
         #  -3 is the last message with a code block
         last_code_block_message =  self.code_generator_user_proxy.chat_messages[self.code_generator][-3]["content"]
@@ -229,19 +590,57 @@ class AutoBrowse:
         if is_termination_message_for_code_generator(self.code_generator_user_proxy.last_message()):
             # add code blocks to code_executed_so_far
             self.code_executed_so_far.extend(code_blocks)
+            # the planner usually asks about the new page next, it is fetched and indexed while the planner thinks
+            self.html_proxy.start_prefetch()
             return f''' Code execution successful. The following code was executed:\n{code_blocks_str}'''
         else:
             last_error_message = self.code_generator_user_proxy.chat_messages[self.code_generator][-2]["content"]
             return f"Code execution failed. Code execution:\n{code_blocks_str}\nError message:\n{last_error_message}"
 
+    async def ask_code_generator_cascade(self, message: str, request: str):
+        '''
+        Chat with the code generator using the models routed to for the step, from the fastest: when an attempt fails,
+        the step is asked again to the next model, with the code and error of the failed attempt
+        '''
+        cascade = self.code_generator_cascade
+        kind = step_type(message)
+        models = cascade.route(kind, num_tokens_from_string(request))
+        try:
+            for i, model in enumerate(models):
+                last_attempt = i == len(models) - 1
+                cascade.use(model, can_escalate=not last_attempt)
+                started = time.perf_counter()
+                with span("code_generator_attempt", model=model, step_type=kind):
+                    await self.code_generator_user_proxy.a_initiate_chat(self.code_generator, message=request)
+                succeeded = is_termination_message_for_code_generator(self.code_generator_user_proxy.last_message())
+                cascade.record(model, kind, succeeded, time.perf_counter() - started)
+                if succeeded or last_attempt:
+                    return
+                cascade.escalate(self.code_generator.name, model, models[i + 1])
+                request = self.augment_message_with_failed_attempt(request, self.code_generator_user_proxy.chat_messages[self.code_generator])
+        finally:
+            cascade.use(None)
+
+    def augment_message_with_failed_attempt(self, request: str, messages: List[Dict]) -> str:
+        code_messages = [message["content"] for message in messages[1:] if "```" in (message.get("content") or "")]
+        code = "\n".join(get_code_blocks(code_messages[-1])) if code_messages else "(no code)"
+        if is_failed_execution(messages[-1]):
+            error = messages[-1].get("content") or "The reply had no code and did not end with TERMINATE"
+        else:
+            error = "The code was executed, but the reply did not end with TERMINATE"
+        return f'''{request}\n\nA previous attempt at this step failed, and may have changed the page. Its code was:\n{code}\nError message:\n{error}'''
+
 
 if __name__ == "__main__":
     autobrowse = AutoBrowse(config = agent_config.config)
+    print(f"Using browser session {autobrowse.session.session_id if autobrowse.session else 'default'}")
     while True:
         question = input("Enter a question to ask Autobrowse: \n")
         final_code_executed = autobrowse.ask_planner(question)
         print("Final code executed: ")
         print(final_code_executed)
+        if autobrowse.last_trace_summary is not None:
+            print("Where the time went: ", autobrowse.last_trace_summary)
         print("=====================================")
         print("=====================================")
         print("=====================================")
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import agent_config
+from autobrowse import AutoBrowse
+from browser_console_client import BrowserConsoleClient
+
+# statuses of the tasks recorded in the results file
+FINISHED = "finished" # the planner reported that the task was completed
+UNFINISHED = "unfinished" # the chat ended without the planner reporting that the task was completed
+TIMEOUT = "timeout"
+ERROR = "error"
+
+
+def read_tasks(path: str, task_field: str = "task", id_field: str = "id") -> List[Dict[str, str]]:
+    '''
+    Read the tasks of a JSONL file: one JSON object per line, with the task in task_field (or "body")
+    and its id in id_field (or "request_id", or else the line number).
+    '''
+    tasks = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            task = record.get(task_field, record.get("body"))
+            if not task:
+                raise ValueError(f"Line {line_number} of {path} has no {task_field} field")
+            task_id = record.get(id_field, record.get("request_id", line_number))
+            tasks.append({"id": str(task_id), "task": task})
+    return tasks
+
+
+def read_results(path: str) -> Dict[str, Dict[str, Any]]:
+    '''
+    Read the results recorded so far in a results file, by task id (the last result of a task wins).
+    A line that was only partially written when the runner crashed is ignored.
+    '''
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[str(result["id"])] = result
+    return results
+
+
+def ids_to_skip(results: Dict[str, Dict[str, Any]], retry_failed: bool = False) -> Set[str]:
+    '''
+    Ids of the tasks not to run again: those with a recorded result, or with retry_failed only the finished ones
+    '''
+    return {task_id for task_id, result in results.items() if not retry_failed or result.get("status") == FINISHED}
+
+
+def ends_with_partial_line(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def subtract_token_usage(after: Dict[str, Dict[str, float]], before: Dict[str, Dict[str, float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        agent_name: {key: value - before.get(agent_name, {}).get(key, 0) for key, value in usage.items()}
+        for agent_name, usage in after.items()
+    }
+
+
+class BatchRunner:
+    '''
+    Runs the tasks of a JSONL file on several workers, each with its own AutoBrowse instance and browser session
+    (all sharing one connection to the browser console), and appends the result of every task to a results file
+    as soon as it completes.
+    Tasks that already have a result in the results file are skipped, so that a run can be resumed after a crash.
+    '''
+
+    def __init__(self, config: Dict[str, Any], browser_console_uri: str = "ws://localhost:3000", workers: int = 2, task_timeout: Optional[float] = 600.0):
+        self.config = config
+        self.workers = workers
+        # wall-clock limit of each task, in seconds
+        self.task_timeout = task_timeout
+        browser_console_config = dict(config.get("browser_console", {}))
+        browser_console_config.pop("lease_session", None)
+        self.browser_console = BrowserConsoleClient(browser_console_uri, **browser_console_config)
+
+    async def new_autobrowse(self) -> AutoBrowse:
+        # leasing the session blocks until the browser console replies
+        return await asyncio.to_thread(AutoBrowse, copy.deepcopy(self.config), browser_console=self.browser_console)
+
+    async def run(self, tasks: List[Dict[str, str]], results_path: str, skip_ids: Set[str]):
+        queue = asyncio.Queue()
+        for task in tasks:
+            if task["id"] not in skip_ids:
+                queue.put_nowait(task)
+        print(f"Running {queue.qsize()} tasks on {self.workers} workers ({len(tasks) - queue.qsize()} already done)")
+        with open(results_path, "a") as results_file:
+            if ends_with_partial_line(results_path):
+                # a line was only partially written when the runner crashed, the next result goes on a line of its own
+                results_file.write("\n")
+            await asyncio.gather(*(self.run_worker(worker, queue, results_file) for worker in range(self.workers)))
+        self.browser_console.close()
+
+    async def run_worker(self, worker: int, queue: asyncio.Queue, results_file):
+        autobrowse = None
+        try:
+            while not queue.empty():
+                task = queue.get_nowait()
+                if autobrowse is None:
+                    autobrowse = await self.new_autobrowse()
+                result = await self.run_task(autobrowse, task)
+                result["worker"] = worker
+                self.write_result(results_file, result)
+                if result["status"] in (TIMEOUT, ERROR):
+                    # the agents may have been interrupted mid-chat (and the page left in any state),
+                    # so the next task starts with a new instance and a fresh browser session
+                    await self.close_autobrowse(autobrowse)
+                    autobrowse = None
+        finally:
+            if autobrowse is not None:
+                await self.close_autobrowse(autobrowse)
+
+    async def run_task(self, autobrowse: AutoBrowse, task: Dict[str, str]) -> Dict[str, Any]:
+        print(f"Starting task {task['id']}: {task['task']}")
+        token_usage_before = autobrowse.token_usage()
+        started_at = time.time()
+        result = {"id": task["id"], "task": task["task"], "final_code": None, "error": None}
+        try:
+            result["final_code"] = await asyncio.wait_for(autobrowse.ask_planner_async(task["task"]), self.task_timeout)
+            result["status"] = FINISHED if autobrowse.last_task_finished else UNFINISHED
+        except asyncio.TimeoutError:
+            result["status"] = TIMEOUT
+            result["error"] = f"Task timed out after {self.task_timeout}s"
+            # the code executed until the deadline
+            result["final_code"] = "\n".join(autobrowse.code_executed_so_far)
+        except Exception as e:
+            result["status"] = ERROR
+            result["error"] = str(e)
+        result["started_at"] = started_at
+        result["duration_s"] = round(time.time() - started_at, 3)
+        result["trajectory"] = autobrowse.last_trajectory_outcome
+        result["trace"] = autobrowse.last_trace_summary
+        result["token_usage"] = subtract_token_usage(autobrowse.token_usage(), token_usage_before)
+        print(f"Task {task['id']} {result['status']} in {result['duration_s']}s")
+        return result
+
+    def write_result(self, results_file, result: Dict[str, Any]):
+        # one line per result, written in one go by the thread of the event loop, so lines of workers do not interleave
+        results_file.write(json.dumps(result) + "\n")
+        results_file.flush()
+        os.fsync(results_file.fileno())
+
+    async def close_autobrowse(self, autobrowse: AutoBrowse):
+        try:
+            await autobrowse.close_async()
+        except Exception as e:
+            print(f"Failed to release browser session: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the AutoBrowse tasks of a JSONL file and write their results to a JSONL file")
+    parser.add_argument("tasks", help="JSONL file with one task per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file the results are appended to")
+    parser.add_argument("--workers", type=int, default=2, help="number of tasks run in parallel, each in its own browser session")
+    parser.add_argument("--timeout", type=float, default=600.0, help="wall-clock limit of each task, in seconds (0 for none)")
+    parser.add_argument("--task-field", default="task", help="field of the task in the tasks file")
+    parser.add_argument("--id-field", default="id", help="field of the task id in the tasks file")
+    parser.add_argument("--retry-failed", action="store_true", help="run again the tasks whose recorded result is not finished")
+    parser.add_argument("--completion-cache-mode", choices=["record", "replay"], help="enable the completion cache in this mode: record so that a rerun after a crash does not pay again for completed steps, replay to re-run a recorded batch offline")
+    parser.add_argument("--browser-console-uri", default="ws://localhost:3000")
+    args = parser.parse_args()
+
+    config = agent_config.config
+    if args.completion_cache_mode:
+        config = copy.deepcopy(config)
+        config["completion_cache"]["enabled"] = True
+        config["completion_cache"]["mode"] = args.completion_cache_mode
+
+    tasks = read_tasks(args.tasks, args.task_field, args.id_field)
+    results = read_results(args.output)
+    skip_ids = ids_to_skip(results, args.retry_failed)
+    runner = BatchRunner(config, args.browser_console_uri, args.workers, args.timeout or None)
+    asyncio.run(runner.run(tasks, args.output, skip_ids))
+
+
+if __name__ == "__main__":
+    main()
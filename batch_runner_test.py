@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from batch_runner import ERROR, FINISHED, TIMEOUT, UNFINISHED, BatchRunner, ids_to_skip, read_results, read_tasks
+
+# checks the resume path of the batch runner without a browser or an LLM: the results of a run are appended to the
+# results file (also after a timeout or an error), a run resumed after a crash skips the tasks that have a result
+# and writes past a partially written line, and --retry-failed runs only the tasks that did not finish again
+# usage: python batch_runner_test.py
+
+
+class ScriptedAutoBrowse:
+    '''
+    Stands in for AutoBrowse: the first word of a task is its outcome, "finish", "unfinished", "timeout" or "error"
+    '''
+
+    def __init__(self):
+        self.code_executed_so_far = []
+        self.last_task_finished = False
+        self.last_trajectory_outcome = None
+        self.last_trace_summary = None
+        self.calls = 0
+        self.tasks = []
+        self.closed = False
+
+    def token_usage(self):
+        return {"planner": {"calls": self.calls}}
+
+    async def ask_planner_async(self, task: str) -> str:
+        self.calls += 1
+        self.tasks.append(task)
+        self.code_executed_so_far = [f"await page.goto('https://example.com/{task.split()[-1]}');"]
+        outcome = task.split()[0]
+        if outcome == "timeout":
+            await asyncio.sleep(60)
+        if outcome == "error":
+            raise RuntimeError("the browser console went away")
+        self.last_task_finished = outcome == "finish"
+        final_code = "\n".join(self.code_executed_so_far)
+        self.code_executed_so_far = []
+        return final_code
+
+    async def close_async(self):
+        self.closed = True
+
+
+class ScriptedBatchRunner(BatchRunner):
+    def __init__(self):
+        super().__init__({}, workers=2, task_timeout=0.2)
+        self.instances = []
+        self.ran = []
+
+    async def new_autobrowse(self):
+        self.instances.append(ScriptedAutoBrowse())
+        return self.instances[-1]
+
+    async def run_task(self, autobrowse, task):
+        self.ran.append(task["id"])
+        return await super().run_task(autobrowse, task)
+
+
+def write_tasks(path: str, tasks):
+    with open(path, "w") as f:
+        for task_id, task in tasks:
+            f.write(json.dumps({"id": task_id, "task": task}) + "\n")
+
+
+def resume(tasks_path: str, results_path: str, retry_failed: bool = False) -> ScriptedBatchRunner:
+    # as batch_runner.main does
+    runner = ScriptedBatchRunner()
+    skip_ids = ids_to_skip(read_results(results_path), retry_failed)
+    asyncio.run(runner.run(read_tasks(tasks_path), results_path, skip_ids))
+    return runner
+
+
+def result_lines(path: str):
+    with open(path, "r") as f:
+        return f.read().split("\n")[:-1]
+
+
+def check_resume(directory: str):
+    tasks_path = os.path.join(directory, "tasks.jsonl")
+    results_path = os.path.join(directory, "results.jsonl")
+    tasks = [("1", "finish 1"), ("2", "finish 2"), ("3", "timeout 3"), ("4", "error 4"), ("5", "unfinished 5")]
+    write_tasks(tasks_path, tasks)
+
+    runner = resume(tasks_path, results_path)
+    results = read_results(results_path)
+    assert sorted(runner.ran) == ["1", "2", "3", "4", "5"], runner.ran
+    assert {task_id: result["status"] for task_id, result in results.items()} == {"1": FINISHED, "2": FINISHED, "3": TIMEOUT, "4": ERROR, "5": UNFINISHED}, results
+    # the code executed until the deadline is kept
+    assert results["3"]["final_code"] == "await page.goto('https://example.com/3');", results["3"]
+    assert results["4"]["error"] == "the browser console went away", results["4"]
+    assert all(result["token_usage"]["planner"]["calls"] == 1 for result in results.values()), results
+    # an instance runs no task after a timeout or an error, and every instance is closed
+    assert all(autobrowse.tasks[-1].split()[0] in ("timeout", "error") for autobrowse in runner.instances
+               if any(task.split()[0] in ("timeout", "error") for task in autobrowse.tasks)), [autobrowse.tasks for autobrowse in runner.instances]
+    assert all(autobrowse.closed for autobrowse in runner.instances)
+    assert len(result_lines(results_path)) == 5
+    print("first run: every result appended")
+
+    # the runner crashed while writing the result of task 6
+    write_tasks(tasks_path, tasks + [("6", "finish 6")])
+    with open(results_path, "a") as f:
+        f.write('{"id": "6", "status": "fini')
+    runner = resume(tasks_path, results_path)
+    assert runner.ran == ["6"], runner.ran
+    lines = result_lines(results_path)
+    assert lines[5] == '{"id": "6", "status": "fini', lines
+    assert sorted(json.loads(line)["id"] for line in lines[:5] + lines[6:]) == ["1", "2", "3", "4", "5", "6"]
+    assert read_results(results_path)["6"]["status"] == FINISHED
+    print("resumed run: only the task without a result run, its result written past the partial line")
+
+    # the tasks that did not finish now do
+    write_tasks(tasks_path, [(task_id, f"finish {task_id}") for task_id, _ in tasks + [("6", "finish 6")]])
+    runner = resume(tasks_path, results_path)
+    assert runner.ran == [], runner.ran
+    runner = resume(tasks_path, results_path, retry_failed=True)
+    assert sorted(runner.ran) == ["3", "4", "5"], runner.ran
+    results = read_results(results_path)
+    assert all(result["status"] == FINISHED for result in results.values()), results
+    assert len(result_lines(results_path)) == 10
+    print("--retry-failed: only the tasks that did not finish run again, their last result wins")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        check_resume(directory)
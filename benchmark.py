@@ -0,0 +1,562 @@
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import math
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import openai
+import tiktoken
+from autogen import oai
+from langchain.embeddings.base import Embeddings
+
+import agent_config
+from autobrowse import AutoBrowse
+from browser_console_client import BrowserConsoleClient
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from fake_console import FIXTURES_DIR, FakeBrowserConsole, FixtureServer
+from token_count import get_encoding, num_tokens_from_string, use_local_encoding
+from tracing import start_trace
+
+# Offline benchmark of AutoBrowse: the saved fixture pages are served by a stand-in browser console (fake_console.py),
+# LLM calls are answered by a scripted mock (or replayed from a recording), and embeddings are computed locally,
+# so runs need no Node or API key and are comparable from one commit to the next. Tokens are counted with cl100k_base if
+# tiktoken has it (it downloads it on first use, or finds it under TIKTOKEN_CACHE_DIR), and otherwise with a local
+# stand-in (see local_encoding), so that runs also need no network. The tokenizer is recorded in the report.
+# usage: python benchmark.py [-o report.json] [--compare baseline.json] [--runs 3] [--page-formats html,outline] ...
+# The "pipeline" suite times fetching, chunking, indexing and retrieving each fixture page,
+# the "tasks" suite times full ask_planner runs of the scenarios of fixtures/benchmark_tasks.json.
+
+SCENARIOS_PATH = os.path.join(FIXTURES_DIR, "benchmark_tasks.json")
+PIPELINE_QUESTION = "Which buttons, links and form fields are on the page?"
+AGENTS = ["planner", "html_assistant", "code_generator"]
+# lines of the context the scripted html_assistant answers with
+ANSWER_LINES = 8
+# timings that changed by less than this are not regressions, whatever the percentage
+MIN_REGRESSION_MS = 1.0
+# pre-tokenization pattern of cl100k_base
+CL100K_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+
+
+def local_encoding() -> tiktoken.Encoding:
+    '''
+    A stand-in for cl100k_base that needs no download: a byte-level BPE with the pre-tokenization of cl100k_base
+    that merges pairs of printable ASCII characters, so it counts about 2 characters of HTML per token
+    (cl100k_base about 3 to 4). Its counts are the same on every machine, but not those of the OpenAI models.
+    '''
+    ranks = {bytes([i]): i for i in range(256)}
+    printable = [bytes([i]) for i in range(32, 127)]
+    for first in printable:
+        for second in printable:
+            ranks[first + second] = len(ranks)
+    return tiktoken.Encoding(name="local-byte-pairs", pat_str=CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={"<|endoftext|>": len(ranks)})
+
+
+def use_tokenizer(tokenizer: str) -> str:
+    '''
+    Count tokens with "cl100k_base", the "local" stand-in, or ("auto") cl100k_base if tiktoken can load it
+    and the stand-in otherwise. Returns the name of the tokenizer used.
+    '''
+    if tokenizer == "local":
+        use_local_encoding("cl100k_base", local_encoding())
+        return "local"
+    try:
+        get_encoding("cl100k_base")
+        return "cl100k_base"
+    except Exception as e:
+        if tokenizer != "auto":
+            raise
+        print(f"The cl100k_base encoding could not be loaded ({e.__class__.__name__}), tokens are counted with a local stand-in")
+        use_local_encoding("cl100k_base", local_encoding())
+        return "local"
+
+
+class HashingEmbeddings(Embeddings):
+    '''
+    A deterministic stand-in for an embedding model: a text is embedded as the normalized counts of its hashed words,
+    so texts sharing words are similar. Vectors are the same on every machine and need no network.
+    latency (seconds) is added to each call, to model the round trip to a real embedding model.
+    '''
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model = f"hashing-{dimensions}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little") % self.dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def message_text(message: Dict) -> str:
+    function_call = message.get("function_call")
+    return (message.get("content") or "") + (json.dumps(function_call) if function_call else "")
+
+
+class ScriptedLLM:
+    '''
+    A mock of the LLM calls of the agents that plays the steps of the benchmark scenarios:
+    the planner asks the html_assistant and the code_generator the questions of the steps in turn, then says FINISHED,
+    the code_generator replies with the code of the step (and TERMINATE once it was executed), and the html_assistant
+    answers with the lines of its context that share the most words with the question.
+    Responses report their token usage and cost like the API. latency (seconds) is added to each call,
+    and token_latency per completion token, streamed replies being sent in chunks over that time.
+    '''
+
+    def __init__(self, scenarios: List[Dict[str, Any]], config: Dict[str, Any], latency: float = 0.0, token_latency: float = 0.0):
+        self.scenarios = scenarios
+        # agents are told apart by their system message
+        self.agents = {config[name]["system_message"]: name for name in AGENTS}
+        self.latency = latency
+        self.token_latency = token_latency
+        # planner turns taken so far, by scenario
+        self.planner_turns = Counter()
+        self.calls = Counter()
+        self.originals = None
+
+    def install(self):
+        '''
+        Answer the completions requested through autogen (and the streamed ones requested from openai) instead of the API
+        '''
+        # create may be inherited (e.g. autogen's ChatCompletion from Completion), in which case there is nothing to restore
+        self.originals = {cls: cls.__dict__.get("create") for cls in (oai.ChatCompletion, openai.ChatCompletion)}
+        for cls in self.originals:
+            cls.create = staticmethod(self.create)
+
+    def uninstall(self):
+        for cls, create in (self.originals or {}).items():
+            if create is None:
+                del cls.create
+            else:
+                cls.create = create
+        self.originals = None
+
+    def reset(self):
+        self.planner_turns.clear()
+
+    def create(self, context: Optional[Dict] = None, messages: Optional[List[Dict]] = None, stream: bool = False, **config):
+        agent = self.agents.get(messages[0].get("content")) if messages and messages[0].get("role") == "system" else None
+        if agent is None:
+            raise Exception("The scripted LLM does not know the agent of this request (its system message changed?)")
+        self.calls[agent] += 1
+        message = getattr(self, f"reply_{agent}")(messages)
+        # as with the API, the model of the config list wins over the default model autogen adds to the llm_config
+        model = (config.get("config_list") or [{}])[0].get("model") or config.get("model")
+        prompt_tokens = sum(num_tokens_from_string(message_text(m)) for m in messages)
+        completion_tokens = num_tokens_from_string(message_text(message))
+        if stream:
+            return self.stream(message.get("content") or "", completion_tokens)
+        time.sleep(self.latency + self.token_latency * completion_tokens)
+        response = {
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", **message}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+        response["cost"] = oai.ChatCompletion.cost(response)
+        return response
+
+    def stream(self, content: str, completion_tokens: int) -> Iterator[Dict]:
+        time.sleep(self.latency)
+        chunks = re.findall(r"\S*\s*", content)
+        for chunk in chunks:
+            time.sleep(self.token_latency * completion_tokens / max(len(chunks), 1))
+            yield {"choices": [{"delta": {"content": chunk}}]}
+
+    def scenario_of(self, messages: List[Dict]) -> Dict[str, Any]:
+        task = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        for scenario in self.scenarios:
+            if scenario["task"] in task:
+                return scenario
+        raise Exception(f"No benchmark scenario for the task: {task[:100]}")
+
+    def reply_planner(self, messages: List[Dict]) -> Dict:
+        scenario = self.scenario_of(messages)
+        turn = self.planner_turns[scenario["name"]]
+        self.planner_turns[scenario["name"]] += 1
+        if turn >= len(scenario["steps"]):
+            return {"content": "The task is complete. FINISHED"}
+        step = scenario["steps"][turn]
+        if "ask_html_assistant" in step:
+            return {"content": None, "function_call": {"name": "ask_html_assistant", "arguments": json.dumps({"message": step["ask_html_assistant"]})}}
+        if "ask_html_assistant_batch" in step:
+            return {"content": None, "function_call": {"name": "ask_html_assistant_batch", "arguments": json.dumps({"questions": step["ask_html_assistant_batch"]})}}
+        # the HTML of the last answer of the html_assistant is passed on, as the planner is told to
+        html_answers = [m.get("content") or "" for m in messages if m.get("role") == "function" and m.get("name") in ("ask_html_assistant", "ask_html_assistant_batch")]
+        arguments = {"message": step["ask_code_generator"], "context_html": html_answers[-1] if html_answers else ""}
+        return {"content": None, "function_call": {"name": "ask_code_generator", "arguments": json.dumps(arguments)}}
+
+    def reply_code_generator(self, messages: List[Dict]) -> Dict:
+        request = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        step = next((step for scenario in self.scenarios for step in scenario["steps"] if "code" in step and request.startswith(step["ask_code_generator"])), None)
+        if step is None:
+            raise Exception(f"No benchmark step for the code generator request: {request[:100]}")
+        if "exitcode: 0" in (messages[-1].get("content") or ""):
+            return {"content": "TERMINATE"}
+        return {"content": f"```javascript\n{step['code']}\n```"}
+
+    def reply_html_assistant(self, messages: List[Dict]) -> Dict:
+        prompt = messages[-1].get("content") or ""
+        if "User's questions are:" in prompt:
+            return {"content": self.answer_batch(prompt)}
+        question, _, context = prompt.partition("Context is:")
+        return {"content": self.answer(question.split("User's question is:")[-1], context)}
+
+    def answer_batch(self, prompt: str) -> str:
+        contexts_text, _, questions_text = prompt.partition("User's questions are:")
+        contexts = re.split(r"^Context \d+ is: ", contexts_text, flags=re.MULTILINE)[1:]
+        answers = []
+        for match in re.finditer(r"^(\d+)\. (.*) \(from context (\d+)\)$", questions_text, flags=re.MULTILINE):
+            answers.append(f"ANSWER {match.group(1)}:\n{self.answer(match.group(2), contexts[int(match.group(3)) - 1])}")
+        return "\n\n".join(answers)
+
+    def answer(self, question: str, context: str) -> str:
+        question_words = set(re.findall(r"\w{3,}", question.lower()))
+        lines = [line for line in context.strip().splitlines() if line.strip()]
+        # the most relevant lines, in the order of the page
+        ranked = sorted(range(len(lines)), key=lambda i: -len(question_words & set(re.findall(r"\w{3,}", lines[i].lower()))))
+        return "\n".join(lines[i] for i in sorted(ranked[:ANSWER_LINES]))
+
+
+def benchmark_config(page_format: str, retrieval: str, llm: str, recording: Optional[str]) -> Dict[str, Any]:
+    '''
+    The agent config, with the page format and retrieval mode under test, tracing on, and the caches that would
+    make later runs skip work off (except the completion cache, which holds the recording in record and replay modes)
+    '''
+    config = copy.deepcopy(agent_config.config)
+    config["html_assistant"]["page_format"] = page_format
+    config["html_assistant"]["retrieval"] = retrieval
+    config["html_assistant"]["embedding_cache"] = {}
+    config["trajectory_cache"] = {"enabled": False}
+    config["tracing"] = {"enabled": True, "path": None}
+    if llm == "scripted":
+        config["completion_cache"] = {"enabled": False}
+    else:
+        config["completion_cache"] = {"enabled": True, "mode": llm, "path": recording}
+    return config
+
+
+def use_offline_config_list(config: Dict[str, Any]):
+    # the mocked (and replayed) completions need no API key, but the agents need a config list with their models
+    if not os.environ.get("OAI_CONFIG_LIST"):
+        models = sorted({config[name]["model"] for name in AGENTS} | {model for name in AGENTS for model in config[name].get("cascade", {}).get("models", [])})
+        os.environ["OAI_CONFIG_LIST"] = json.dumps([{"model": model, "api_key": "offline"} for model in models])
+
+
+def use_embeddings(autobrowse: AutoBrowse, embeddings: Optional[Embeddings]):
+    if embeddings is not None:
+        autobrowse.html_proxy.embeddings = CachedEmbeddings(embeddings, autobrowse.html_proxy.embedding_cache)
+
+
+def navigate(autobrowse: AutoBrowse, url: str):
+    browser = autobrowse.session if autobrowse.session is not None else autobrowse.browser_console
+    response_data = browser.request_sync("executeCode", code=f"await page.goto({json.dumps(url)});")
+    if not response_data.get("success"):
+        raise Exception(f"Failed to open {url}: {response_data.get('error')}")
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {"median": round(statistics.median(values), 3), "min": round(min(values), 3), "max": round(max(values), 3)} if values else {}
+
+
+async def measure_pipeline(autobrowse: AutoBrowse, question: str) -> Tuple[Any, str, str]:
+    '''
+    Fetch, chunk, index and retrieve from the current page, from scratch, in a trace
+    '''
+    proxy = autobrowse.html_proxy
+    proxy.page_html_version = None
+    proxy.html = ""
+    proxy.html_chunks = []
+    proxy.page_html_change = None
+    proxy.embedding_cache = EmbeddingCache()
+    if proxy.embeddings is not None:
+        proxy.embeddings.cache = proxy.embedding_cache
+    with start_trace(f"pipeline: {question}") as trace:
+        html = await proxy.fetch_html()
+        await asyncio.to_thread(proxy._index_html, html)
+        context = await asyncio.to_thread(proxy._retrieve_context, proxy.html, proxy.vectorstore, question)
+    return trace, html, context
+
+
+def run_pipeline_suite(args, client: BrowserConsoleClient, base_url: str, page_format: str, embeddings: Optional[Embeddings]) -> List[Dict[str, Any]]:
+    config = benchmark_config(page_format, args.retrieval, args.llm, args.recording)
+    autobrowse = AutoBrowse(config, browser_console=client)
+    use_embeddings(autobrowse, embeddings)
+    rows = []
+    try:
+        for fixture in sorted(name for name in os.listdir(FIXTURES_DIR) if name.endswith(".html")):
+            navigate(autobrowse, f"{base_url}/{fixture}")
+            durations: Dict[str, List[float]] = {}
+            for run in range(args.warmup + args.runs):
+                trace, html, context = autobrowse.runtime.run(measure_pipeline(autobrowse, PIPELINE_QUESTION))
+                if run < args.warmup:
+                    continue
+                for span in trace.spans:
+                    durations.setdefault(span.name, []).append(span.duration_ms)
+                    if span.name == "console.fetchHTML" and span.attributes.get("server_timing"):
+                        durations.setdefault("console_extract", []).append(span.attributes["server_timing"].get("extractMs", 0.0))
+            rows.append({
+                "fixture": fixture,
+                "page_format": page_format,
+                "retrieval": args.retrieval,
+                "page_tokens": num_tokens_from_string(html),
+                "chunks": len(autobrowse.html_proxy.html_chunks),
+                "context_tokens": num_tokens_from_string(context),
+                "ms": {name: summarize(durations.get(name, [])) for name in ("fetch_html", "console_extract", "chunk_html", "build_index", "similarity_search", "task")},
+            })
+            print(f"pipeline {fixture} ({page_format}): {rows[-1]['ms']['task'].get('median')} ms")
+    finally:
+        autobrowse.close()
+    return rows
+
+
+def run_tasks_suite(args, client: BrowserConsoleClient, base_url: str, page_format: str, scenarios: List[Dict[str, Any]], llm: Optional[ScriptedLLM], embeddings: Optional[Embeddings]) -> List[Dict[str, Any]]:
+    config = benchmark_config(page_format, args.retrieval, args.llm, args.recording)
+    rows = []
+    for scenario in scenarios:
+        runs = []
+        for run in range(args.warmup + args.runs):
+            if llm is not None:
+                llm.reset()
+            # a new instance (and browser session) per run, so that every run starts from the same state
+            autobrowse = AutoBrowse(config, browser_console=client)
+            use_embeddings(autobrowse, embeddings)
+            try:
+                navigate(autobrowse, f"{base_url}{scenario['start_url']}")
+                started = time.perf_counter()
+                error = None
+                try:
+                    _, summary = autobrowse.ask_planner(scenario["task"], return_trace_summary=True)
+                except Exception as e:
+                    error = repr(e)
+                    summary = autobrowse.last_trace_summary or {"steps": {}, "models": {}, "cost": 0.0}
+                duration_ms = (time.perf_counter() - started) * 1000
+                page = autobrowse.runtime.run(autobrowse.html_proxy.fetch_page_version()) or {}
+                expected_url = scenario.get("expect", {}).get("url")
+                steps = summary["steps"]
+                if run < args.warmup:
+                    continue
+                runs.append({
+                    "duration_ms": duration_ms,
+                    "completed": error is None and autobrowse.last_task_finished and (expected_url is None or expected_url in page.get("url", "")),
+                    "error": error,
+                    # steps to completion: the questions and code requests of the planner
+                    "steps": sum(steps.get(name, {}).get("count", 0) for name in ("ask_html_assistant", "ask_html_assistant_batch", "ask_code_generator")),
+                    "code_executions": steps.get("run_puppeteer_code", {}).get("count", 0),
+                    "llm_calls": steps.get("llm", {}).get("count", 0),
+                    "step_ms": {name: step["total_ms"] for name, step in steps.items()},
+                    "browser_wait_ms": summary.get("browser_wait_ms", 0.0),
+                    "tokens": {model: usage["prompt_tokens"] + usage["completion_tokens"] for model, usage in summary["models"].items()},
+                    "cost": summary["cost"],
+                    "html_context_tokens": autobrowse.html_proxy.context_token_stats()["total"],
+                    "escalations": sum(sum(stats.get("escalations", {}).values()) for stats in autobrowse.model_cascade_stats().values()),
+                })
+            finally:
+                autobrowse.close()
+        step_names = sorted({name for run in runs for name in run["step_ms"]})
+        rows.append({
+            "scenario": scenario["name"],
+            "page_format": page_format,
+            "retrieval": args.retrieval,
+            "runs": len(runs),
+            "completed": sum(run["completed"] for run in runs),
+            "errors": sorted({run["error"] for run in runs if run["error"]}),
+            "duration_ms": summarize([run["duration_ms"] for run in runs]),
+            "steps": summarize([run["steps"] for run in runs]),
+            "code_executions": summarize([run["code_executions"] for run in runs]),
+            "llm_calls": summarize([run["llm_calls"] for run in runs]),
+            "html_context_tokens": summarize([run["html_context_tokens"] for run in runs]),
+            "escalations": summarize([run["escalations"] for run in runs]),
+            "tokens": {model: summarize([run["tokens"].get(model, 0) for run in runs]) for model in sorted({model for run in runs for model in run["tokens"]})},
+            "cost": summarize([run["cost"] for run in runs]),
+            "browser_wait_ms": summarize([run["browser_wait_ms"] for run in runs]),
+            "step_ms": {name: summarize([run["step_ms"].get(name, 0.0) for run in runs]) for name in step_names},
+        })
+        print(f"task {scenario['name']} ({page_format}): {rows[-1]['completed']}/{len(runs)} completed, {rows[-1]['duration_ms']['median']} ms, {rows[-1]['steps']['median']} steps")
+    return rows
+
+
+def environment(tokenizer: str) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "tokenizer": tokenizer,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def flatten(row: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    '''
+    The medians (and other numbers) of a report row, by dotted name, e.g. {"ms.build_index": 12.5}
+    '''
+    values = {}
+    for name, value in row.items():
+        if isinstance(value, dict):
+            if "median" in value:
+                values[f"{prefix}{name}"] = value["median"]
+            else:
+                values.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{name}"] = value
+    return values
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], max_regression: Optional[float] = None) -> List[str]:
+    '''
+    Print the changes of the metrics of the report against a baseline report, and return the timings
+    that are more than max_regression percent slower
+    '''
+    regressions = []
+    tokenizers = [report.get("environment", {}).get("tokenizer"), baseline.get("environment", {}).get("tokenizer")]
+    if tokenizers[0] != tokenizers[1]:
+        print(f"Warning: tokens were counted with {tokenizers[1]} in the baseline and with {tokenizers[0]} now, so token counts and chunks differ")
+    keys = {"pipeline": ("fixture", "page_format", "retrieval"), "tasks": ("scenario", "page_format", "retrieval")}
+    for suite, key_fields in keys.items():
+        baseline_rows = {tuple(row[field] for field in key_fields): row for row in baseline.get(suite, [])}
+        for row in report.get(suite, []):
+            key = tuple(row[field] for field in key_fields)
+            if key not in baseline_rows:
+                continue
+            current, previous = flatten(row), flatten(baseline_rows[key])
+            print(f"\n{suite} {' / '.join(map(str, key))}")
+            print(f"{'metric':<36}{'baseline':>12}{'current':>12}{'change':>10}")
+            for name, value in current.items():
+                if name not in previous:
+                    continue
+                change = (value - previous[name]) / previous[name] * 100 if previous[name] else 0.0
+                print(f"{name:<36}{previous[name]:>12.3f}{value:>12.3f}{change:>9.1f}%")
+                is_timing = name.startswith(("ms.", "step_ms.")) or name == "duration_ms"
+                if is_timing and max_regression is not None and change > max_regression and value - previous[name] > MIN_REGRESSION_MS:
+                    regressions.append(f"{suite} {'/'.join(map(str, key))} {name}: {previous[name]:.1f} -> {value:.1f} ms ({change:+.1f}%)")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    if report.get("pipeline"):
+        print(f"\n{'page':<24}{'format':<9}{'tokens':>8}{'chunks':>8}{'fetch ms':>10}{'chunk ms':>10}{'index ms':>10}{'search ms':>10}{'total ms':>10}")
+        for row in report["pipeline"]:
+            ms = {name: value.get("median", 0.0) for name, value in row["ms"].items()}
+            print(f"{row['fixture']:<24}{row['page_format']:<9}{row['page_tokens']:>8}{row['chunks']:>8}{ms['fetch_html']:>10.1f}{ms['chunk_html']:>10.1f}{ms['build_index']:>10.1f}{ms['similarity_search']:>10.1f}{ms['task']:>10.1f}")
+    if report.get("tasks"):
+        print(f"\n{'scenario':<24}{'format':<9}{'completed':>10}{'steps':>7}{'llm':>5}{'ctx tokens':>12}{'cost $':>9}{'total ms':>10}")
+        for row in report["tasks"]:
+            print(f"{row['scenario']:<24}{row['page_format']:<9}{row['completed']:>6}/{row['runs']:<3}{row['steps'].get('median', 0):>7}{row['llm_calls'].get('median', 0):>5}{row['html_context_tokens'].get('median', 0):>12}{row['cost'].get('median', 0.0):>9.4f}{row['duration_ms'].get('median', 0.0):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HTML pipeline and full tasks of AutoBrowse offline, on the saved fixture pages")
+    parser.add_argument("-o", "--output", default="benchmark_report.json", help="JSON file the report is written to")
+    parser.add_argument("--suites", default="pipeline,tasks", help="comma separated suites to run: pipeline, tasks")
+    parser.add_argument("--runs", type=int, default=3, help="timed runs of each page and scenario (medians are reported)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs of each page and scenario before the timed ones")
+    parser.add_argument("--page-formats", default="html,outline", help="comma separated page formats to compare: html, outline")
+    parser.add_argument("--retrieval", default="faiss", choices=["faiss", "bm25", "hybrid"])
+    parser.add_argument("--scenarios", default=SCENARIOS_PATH, help="JSON file of the task scenarios")
+    parser.add_argument("--llm", default="scripted", choices=["scripted", "record", "replay"],
+                        help="scripted: the scenario steps are played by a mock, record: real completions are recorded to --recording, replay: they are replayed from it (a missing one is an error)")
+    parser.add_argument("--recording", default=".cache/benchmark_completions", help="completion cache of the record and replay modes")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds added to each scripted LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds added per completion token of each scripted LLM call")
+    parser.add_argument("--embeddings", default="hashing", choices=["hashing", "openai"], help="hashing: local deterministic embeddings, openai: the real embedding model")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="seconds added to each hashing embedding call")
+    parser.add_argument("--console-latency", action="append", default=[], metavar="ACTION=SECONDS", help="seconds added to the requests of an action by the stand-in console, e.g. executeCode=0.2")
+    parser.add_argument("--repeat", type=int, default=1, help="times the body of each page is duplicated by the stand-in console, to simulate large pages")
+    parser.add_argument("--browser-console-uri", help="run against this (real) browser console instead of the stand-in, with the fixtures served over HTTP")
+    parser.add_argument("--tokenizer", default="auto", choices=["auto", "cl100k_base", "local"],
+                        help="cl100k_base: the tokenizer of the OpenAI models (downloaded by tiktoken on first use), local: a stand-in that needs no download, auto: cl100k_base if it can be loaded, local otherwise")
+    parser.add_argument("--compare", help="baseline report to compare with")
+    parser.add_argument("--max-regression", type=float, help="exit with an error if a timing is more than this percent slower than in the baseline")
+    args = parser.parse_args()
+
+    tokenizer = use_tokenizer(args.tokenizer)
+    suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    page_formats = [page_format.strip() for page_format in args.page_formats.split(",") if page_format.strip()]
+    with open(args.scenarios, "r") as f:
+        scenarios = json.load(f)
+
+    console = None
+    fixture_server = None
+    if args.browser_console_uri:
+        fixture_server = FixtureServer()
+        base_url = fixture_server.start()
+        uri = args.browser_console_uri
+    else:
+        latency = {action: float(seconds) for action, seconds in (item.split("=", 1) for item in args.console_latency)}
+        console = FakeBrowserConsole(body_repeat=args.repeat, latency=latency)
+        uri = console.start()
+        base_url = "http://fixtures.test"
+    if args.llm != "record":
+        use_offline_config_list(agent_config.config)
+    llm = None
+    if args.llm == "scripted":
+        llm = ScriptedLLM(scenarios, agent_config.config, args.llm_latency, args.token_latency)
+        llm.install()
+    embeddings = HashingEmbeddings(latency=args.embedding_latency) if args.embeddings == "hashing" else None
+
+    browser_console_config = dict(agent_config.config.get("browser_console", {}))
+    browser_console_config.pop("lease_session", None)
+    client = BrowserConsoleClient(uri, **browser_console_config)
+    report = {
+        "environment": environment(tokenizer),
+        "settings": {name: value for name, value in vars(args).items() if name not in ("output", "compare", "max_regression")},
+        "pipeline": [],
+        "tasks": [],
+    }
+    try:
+        for page_format in page_formats:
+            if "pipeline" in suites:
+                report["pipeline"].extend(run_pipeline_suite(args, client, base_url, page_format, embeddings))
+            if "tasks" in suites:
+                report["tasks"].extend(run_tasks_suite(args, client, base_url, page_format, scenarios, llm, embeddings))
+    finally:
+        client.close()
+        if llm is not None:
+            llm.uninstall()
+        if console is not None:
+            console.stop()
+        if fixture_server is not None:
+            fixture_server.stop()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.max_regression)
+        if regressions:
+            print("\nTimings slower than the baseline by more than {}%:".format(args.max_regression))
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
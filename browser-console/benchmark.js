@@ -0,0 +1,74 @@
+// Benchmark of the HTML extraction modes on the saved fixture pages.
+// usage: node benchmark.js [repeat] [runs] [outDir]
+// repeat: number of times the body of each fixture is duplicated, to simulate large pages (default 1)
+// runs: number of timed runs of each extraction mode per page (default 5)
+// outDir: if given, the output of each mode is written there, e.g. to compare token counts with
+//   python token_count.py outDir/*
+const fs = require('fs');
+const path = require('path');
+const puppeteer = require('puppeteer');
+const { extractInPage, extractWithJSDOM, extractOutline } = require('./extract');
+
+const fixturesDir = path.join(__dirname, '..', 'fixtures');
+
+function median(values) {
+  const sorted = [...values].sort((a, b) => a - b);
+  return sorted[Math.floor(sorted.length / 2)];
+}
+
+async function time(extract, page, runs) {
+  const durations = [];
+  let html = '';
+  for (let i = 0; i < runs; i++) {
+    const start = process.hrtime.bigint();
+    html = await extract(page);
+    durations.push(Number(process.hrtime.bigint() - start) / 1e6);
+  }
+  return { ms: median(durations), bytes: Buffer.byteLength(html), html };
+}
+
+async function main() {
+  const repeat = parseInt(process.argv[2] || '1', 10);
+  const runs = parseInt(process.argv[3] || '5', 10);
+  const outDir = process.argv[4];
+  if (outDir) {
+    fs.mkdirSync(outDir, { recursive: true });
+  }
+  const browser = await puppeteer.launch({ headless: 'new' });
+  const page = await browser.newPage();
+  // block external requests made by the fixtures
+  await page.setRequestInterception(true);
+  page.on('request', (request) => request.abort());
+
+  console.log(['page', 'page KB', 'jsdom ms', 'jsdom KB', 'inpage ms', 'inpage KB', 'speedup', 'outline ms', 'outline KB'].join('\t'));
+  for (const file of fs.readdirSync(fixturesDir).filter((name) => name.endsWith('.html'))) {
+    await page.setContent(fs.readFileSync(path.join(fixturesDir, file), 'utf8'));
+    if (repeat > 1) {
+      await page.evaluate((n) => { document.body.innerHTML = document.body.innerHTML.repeat(n); }, repeat);
+    }
+    const pageBytes = Buffer.byteLength(await page.content());
+    const jsdom = await time(extractWithJSDOM, page, runs);
+    const inpage = await time(extractInPage, page, runs);
+    const outline = await time(extractOutline, page, runs);
+    if (outDir) {
+      const name = path.basename(file, '.html');
+      fs.writeFileSync(path.join(outDir, `${name}.jsdom.html`), jsdom.html);
+      fs.writeFileSync(path.join(outDir, `${name}.inpage.html`), inpage.html);
+      fs.writeFileSync(path.join(outDir, `${name}.outline.txt`), outline.html);
+    }
+    console.log([
+      file,
+      (pageBytes / 1024).toFixed(0),
+      jsdom.ms.toFixed(1),
+      (jsdom.bytes / 1024).toFixed(0),
+      inpage.ms.toFixed(1),
+      (inpage.bytes / 1024).toFixed(0),
+      `${(jsdom.ms / inpage.ms).toFixed(1)}x`,
+      outline.ms.toFixed(1),
+      (outline.bytes / 1024).toFixed(0),
+    ].join('\t'));
+  }
+  await browser.close();
+}
+
+main();
@@ -1,111 +1,328 @@
+const { performance } = require('perf_hooks');
 const { Server } = require('ws');
 const { VM } = require('vm2');
-const { JSDOM } = require('jsdom');
 const puppeteer = require('puppeteer');
-const beautifyHTML = require('js-beautify').html;
+const { extractHTML, extractSubtree, extractViewport, extractInteractive } = require('./extract');
+const { SessionPool } = require('./sessions');
+const { Readiness } = require('./readiness');
+const { diffLines } = require('./diff');
+
+// size of the pool of browser sessions, how long (ms) a session can stay idle before it is closed,
+// and how much JS heap (MB) the page of a session can use before it is closed
+const poolSize = parseInt(process.env.AUTOBROWSE_POOL_SIZE || '4', 10);
+const sessionIdleTimeout = parseInt(process.env.AUTOBROWSE_SESSION_IDLE_TIMEOUT || '600000', 10);
+const sessionMemoryLimit = parseInt(process.env.AUTOBROWSE_SESSION_MEMORY_LIMIT_MB || '512', 10) * 1024 * 1024;
+// interval (ms) at which idle sessions and sessions over the memory limit are closed
+const housekeepingInterval = 30000;
+
+// runs in every document loaded in the page: counts DOM mutations so that clients can tell
+// whether the page changed without fetching its HTML
+function trackDOMVersion() {
+  window.__autobrowseDOMVersion = 0;
+  new MutationObserver((records) => {
+    // the element references assigned by the outline extraction do not change the page
+    if (records.some((record) => record.attributeName !== 'data-ab-ref')) {
+      window.__autobrowseDOMVersion++;
+    }
+  })
+    .observe(document, { childList: true, subtree: true, attributes: true, characterData: true });
+}
 
 async function initializePuppeteer() {
   const browser = await puppeteer.launch({ headless: false });
-  const page = await browser.newPage();
-  return { browser, page };
+  const pool = new SessionPool(browser, {
+    size: poolSize,
+    idleTimeout: sessionIdleTimeout,
+    memoryLimit: sessionMemoryLimit,
+    preparePage: (page) => page.evaluateOnNewDocument(trackDOMVersion),
+  });
+  await pool.initializeDefault();
+  return { browser, pool };
 }
 
-// remove all attributes from the elements apart from 
-// name, type, id, class, href, src, title, etc.
-const allowedAttributes = ['name', 'type', 'id', 'class', 'href', 'src', 'title' ,'placeholder', 'value', 'checked', 'selected', 'disabled', 'readonly', 'multiple', 'required', 'min', 'max', 'step', 'pattern', 'accept', 'accept-charset', 'autocomplete', 'autofocus', 'form', 'formaction', 'formenctype', 'formmethod', 'formnovalidate', 'formtarget', 'height', 'width', 'alt', 'download', 'media', 'target',  'tabindex', 'accesskey', 'contenteditable', 'draggable', 'dropzone', 'hidden'];
+// number of HTML snapshots kept per session to compute diffs against
+const maxSnapshots = 4;
+// last HTML snapshot version handed out. Versions are unique across sessions, connections (and restarts of the console),
+// so that a client that reconnects can not be sent a diff against a version it does not hold.
+let lastHTMLVersion = Date.now();
 
-const unwantedTags = 'script, style, noscript, img, svg, link, meta';
+// interval at which clients are pinged, clients that did not answer the previous ping are disconnected
+const heartbeatInterval = 30000;
 
-// Recursive function to clean attributes of a node and its children
-function cleanAttributes(node) {
-  // If the node has attributes, inspect them
-  if (node.attributes) {
-    // Collect attributes in an array to avoid modification issues
-    const attributes = Array.from(node.attributes);
-    for (const attribute of attributes) {
-      // If the attribute is not in the allowed list, remove it
-      if (!allowedAttributes.includes(attribute.name)) {
-        node.removeAttribute(attribute.name);
+// Wraps the page (or its keyboard, mouse, ...) given to executed code, so that the code can not use it
+// any more once its request timed out or was cancelled.
+function abortable(target, signal) {
+  return new Proxy(target, {
+    get(object, property) {
+      const value = Reflect.get(object, property, object);
+      if (['keyboard', 'mouse', 'touchscreen'].includes(property)) {
+        return abortable(value, signal);
       }
-    }
-  }
-
-  // Recursive case: If the node has child nodes, inspect them
-  if (node.childNodes) {
-    node.childNodes.forEach(cleanAttributes);
-  }
+      if (typeof value !== 'function') {
+        return value;
+      }
+      return (...args) => {
+        if (signal.aborted) {
+          throw new Error('Request timed out or was cancelled');
+        }
+        return value.apply(object, args);
+      };
+    },
+  });
 }
 
+initializePuppeteer().then(({ browser, pool }) => {
+  // compress large messages (e.g. HTML snapshots) if the client supports it
+  const wss = new Server({ port: 3000, perMessageDeflate: { threshold: 1024 } });
+  console.log(`WebSocket Server is running on port 3000 (${poolSize} browser sessions)`);
 
-initializePuppeteer().then(({ browser, page }) => {
-  const vm = new VM({
-    sandbox: { browser, page },
-    require: { external: true },
+  // heartbeats: drop the connections of clients that stopped answering pings
+  const heartbeat = setInterval(() => {
+    wss.clients.forEach((ws) => {
+      if (ws.isAlive === false) {
+        console.log('Client stopped answering heartbeats, disconnecting');
+        ws.terminate();
+        return;
+      }
+      ws.isAlive = false;
+      ws.ping();
+    });
+  }, heartbeatInterval);
+  const housekeeping = setInterval(() => pool.housekeeping(), housekeepingInterval);
+  wss.on('close', () => {
+    clearInterval(heartbeat);
+    clearInterval(housekeeping);
   });
 
-
-  const wss = new Server({ port: 3000 });
-  console.log('WebSocket Server is running on port 3000');
-
   wss.on('connection', (ws) => {
     console.log('A user connected');
+    ws.isAlive = true;
+    ws.on('pong', () => { ws.isAlive = true; });
+    // abort controllers of the requests in flight, by request id
+    const inFlight = new Map();
 
-    async function executeCode(code) {
+    async function executeCode(reply, session, code, signal) {
+      session.executions++;
+      // requests of the page in flight, and time spent waiting for the page, during this execution
+      const readiness = new Readiness(session.page, signal);
+      readiness.start();
+      // a VM per execution, so that its page stops working once the request is aborted
+      const vm = new VM({
+        sandbox: {
+          browser: session.browser,
+          page: abortable(readiness.timed(session.page), signal),
+          // ref(12) is the selector of the element listed as [ref=12] in the page outline
+          ref: (id) => `[data-ab-ref="${id}"]`,
+          // waitUntilReady() waits until the DOM is stable, waitUntilReady({ selector }) until the element is visible,
+          // waitUntilReady({ strategy: 'network-idle', ignore: [...] }) until no request is in flight (see readiness.js)
+          waitUntilReady: (options) => readiness.waitUntilReady(options),
+        },
+        require: { external: true },
+      });
+      const started = performance.now();
       try {
         const result = await vm.run(`(async () => { ${code} })()`);
-        ws.send(JSON.stringify({ success: true, result }));
+        reply({ success: true, result, timing: { executeMs: performance.now() - started, ...readiness.timing() } });
       } catch (err) {
         console.error(`Error executing command: ${err}`);
-        ws.send(JSON.stringify({ success: false, error: err.message }));
+        reply({ success: false, error: err.message, timing: { executeMs: performance.now() - started, ...readiness.timing() } });
+      } finally {
+        readiness.stop();
       }
     }
 
-    async function fetchHTML() {
-      if (!page) {
-        ws.send(JSON.stringify({ success: false, error: 'Page not initialized' }));
+    // Reply with the HTML relative to the version the client holds:
+    // "unchanged", a diff against that version, or a full snapshot.
+    function sendHTMLDelta(reply, session, html, clientVersion, timing = {}) {
+      const { snapshots } = session;
+      const latest = snapshots.get(session.htmlVersion);
+      if (latest !== undefined && latest === html && clientVersion === session.htmlVersion) {
+        reply({ success: true, status: 'unchanged', version: session.htmlVersion, timing });
         return;
       }
-      try {
-        // get the raw HTML content of the page
-        const rawHTML = await page.content();        
-        // create a new JSDOM object
-        const dom = new JSDOM(rawHTML);
-        // parse the raw HTML into a new document object
-        const doc = dom.window.document;
-        // remove unwanted elements from the document
-        doc.querySelectorAll(unwantedTags).forEach(element => element.remove());
-        // get the clean HTML
-        // remove all attributes from the elements apart from 
-        // name, type, id, class, href, src, title
-        cleanAttributes(doc.documentElement);
-        const cleanHTML = doc.documentElement.outerHTML;
-        const formattedHTML = beautifyHTML(cleanHTML, { indent_size: 2 });
+      if (latest === undefined || latest !== html) {
+        session.htmlVersion = ++lastHTMLVersion;
+        snapshots.set(session.htmlVersion, html);
+        if (snapshots.size > maxSnapshots) {
+          snapshots.delete(snapshots.keys().next().value);
+        }
+      }
+      const base = snapshots.get(clientVersion);
+      if (base !== undefined) {
+        const started = performance.now();
+        const diff = diffLines(base.split('\n'), html.split('\n'));
+        const diffSize = diff.insert.reduce((size, line) => size + line.length + 1, 0);
+        timing = { ...timing, diffMs: performance.now() - started };
+        // only worth it if the diff is much smaller than the document
+        if (diffSize < html.length / 2) {
+          reply({ success: true, status: 'diff', base: clientVersion, version: session.htmlVersion, diff, timing });
+          return;
+        }
+      }
+      reply({ success: true, status: 'full', version: session.htmlVersion, result: html, timing });
+    }
 
+    async function fetchHTML(reply, session, message) {
+      const { page } = session;
+      try {
+        // "inpage" (default) cleans the HTML inside the page in one traversal,
+        // "jsdom" re-parses it with JSDOM and pretty-prints it
+        const started = performance.now();
+        const formattedHTML = await extractHTML(page, message.extraction || 'inpage');
+        const timing = { extractMs: performance.now() - started };
         console.log("Sending formatted HTML");
-        ws.send(JSON.stringify({ success: true, result: formattedHTML }));
+        if ('version' in message) {
+          sendHTMLDelta(reply, session, formattedHTML, message.version, timing);
+        } else {
+          reply({ success: true, result: formattedHTML, timing });
+        }
       } catch (err) {
         console.error(`Error fetching HTML: ${err}`);
-        ws.send(JSON.stringify({ success: false, error: err.message }));
+        reply({ success: false, error: err.message });
+      }
+    }
+
+    // Reply with a scoped part of the HTML of the page, e.g. a subtree or the elements in the viewport
+    async function fetchScopedHTML(reply, session, extract, ...args) {
+      try {
+        const result = await extract(session.page, ...args);
+        reply({ success: true, result });
+      } catch (err) {
+        console.error(`Error fetching scoped HTML: ${err}`);
+        reply({ success: false, error: err.message });
+      }
+    }
+
+    async function pageVersion(reply, session) {
+      try {
+        const domVersion = await session.page.evaluate(() => window.__autobrowseDOMVersion || 0);
+        const version = `${session.navigations}.${domVersion}.${session.executions}`;
+        reply({ success: true, result: { url: session.page.url(), version } });
+      } catch (err) {
+        console.error(`Error getting page version: ${err}`);
+        reply({ success: false, error: err.message });
       }
     }
 
-    ws.on('message', async (message) => {
-      console.log(`Received: ${message}`);
-      message = JSON.parse(message);
+    // session management requests
+    async function handleSession(reply, message) {
+      try {
+        switch (message.action) {
+          case 'acquireSession': {
+            const session = await pool.acquire();
+            reply({ success: true, result: { session: session.id } });
+            break;
+          }
+          case 'releaseSession':
+            await pool.release(message.session);
+            reply({ success: true });
+            break;
+          case 'sessionStats':
+            reply({ success: true, result: pool.stats() });
+            break;
+          default:
+            break;
+        }
+      } catch (err) {
+        console.error(`Error handling ${message.action}: ${err}`);
+        reply({ success: false, error: err.message });
+      }
+    }
+
+    async function handle(reply, message, signal) {
+      if (['acquireSession', 'releaseSession', 'sessionStats'].includes(message.action)) {
+        await handleSession(reply, message);
+        return;
+      }
+      if (message.action === 'ping') {
+        reply({ success: true, result: 'pong' });
+        return;
+      }
+      // the session the request is about, the default one if the message does not name one
+      let session;
+      try {
+        session = pool.get(message.session);
+      } catch (err) {
+        reply({ success: false, error: err.message });
+        return;
+      }
       switch (message.action) {
         case 'executeCode':
-          await executeCode(message.code);
+          await executeCode(reply, session, message.code, signal);
           break;
         case 'fetchHTML':
-          await fetchHTML();
+          await fetchHTML(reply, session, message);
+          break;
+        case 'fetchSubtreeHTML':
+          await fetchScopedHTML(reply, session, extractSubtree, message.selector, message.format);
+          break;
+        case 'fetchViewportHTML':
+          await fetchScopedHTML(reply, session, extractViewport, message.format);
+          break;
+        case 'fetchInteractiveHTML':
+          await fetchScopedHTML(reply, session, extractInteractive);
+          break;
+        case 'pageVersion':
+          await pageVersion(reply, session);
           break;
         default:
           console.error(`Unknown action: ${message.action}`);
+          reply({ success: false, error: `Unknown action: ${message.action}` });
+      }
+    }
+
+    // Requests are handled concurrently. The reply echoes the id of the request, if it has one.
+    // A request with a timeout (in ms) is aborted when it expires, and so is a request targeted by a cancel message.
+    ws.on('message', async (data) => {
+      console.log(`Received: ${data}`);
+      let message;
+      try {
+        message = JSON.parse(data);
+      } catch (err) {
+        ws.send(JSON.stringify({ success: false, error: `Invalid message: ${err.message}` }));
+        return;
+      }
+      if (message.action === 'cancel') {
+        const controller = inFlight.get(message.target);
+        if (controller) {
+          console.log(`Cancelling request ${message.target}`);
+          controller.abort();
+        }
+        return;
+      }
+      const controller = new AbortController();
+      const received = performance.now();
+      // once a request is aborted nothing else is sent for it.
+      // Replies report the time spent on the request by the console (totalMs), and by its steps if they are timed
+      const reply = (response) => {
+        if (!controller.signal.aborted) {
+          const timed = { ...response, timing: { ...response.timing, totalMs: performance.now() - received } };
+          ws.send(JSON.stringify(message.id !== undefined ? { id: message.id, ...timed } : timed));
+        }
+      };
+      let deadline;
+      if (message.timeout) {
+        deadline = setTimeout(() => {
+          console.error(`Request ${message.id} (${message.action}) timed out after ${message.timeout} ms`);
+          reply({ success: false, error: `Timed out after ${message.timeout} ms`, timedOut: true });
+          controller.abort();
+        }, message.timeout);
+      }
+      if (message.id !== undefined) {
+        inFlight.set(message.id, controller);
+      }
+      try {
+        await handle(reply, message, controller.signal);
+      } finally {
+        clearTimeout(deadline);
+        inFlight.delete(message.id);
       }
     });
 
     ws.on('close', () => {
       console.log('User disconnected');
+      // nothing can be sent for the requests in flight any more
+      inFlight.forEach((controller) => controller.abort());
     });
   });
-});
\ No newline at end of file
+});
@@ -0,0 +1,17 @@
+// Line-based diff of two documents as a single hunk: the lines between the common prefix
+// and the common suffix of the old document are replaced by the new ones.
+function diffLines(oldLines, newLines) {
+  let start = 0;
+  while (start < oldLines.length && start < newLines.length && oldLines[start] === newLines[start]) {
+    start++;
+  }
+  let oldEnd = oldLines.length;
+  let newEnd = newLines.length;
+  while (oldEnd > start && newEnd > start && oldLines[oldEnd - 1] === newLines[newEnd - 1]) {
+    oldEnd--;
+    newEnd--;
+  }
+  return { start, deleteCount: oldEnd - start, insert: newLines.slice(start, newEnd) };
+}
+
+module.exports = { diffLines };
@@ -0,0 +1,412 @@
+const { JSDOM } = require('jsdom');
+const beautifyHTML = require('js-beautify').html;
+
+// remove all attributes from the elements apart from
+// name, type, id, class, href, src, title, etc.
+const allowedAttributes = ['name', 'type', 'id', 'class', 'href', 'src', 'title' ,'placeholder', 'value', 'checked', 'selected', 'disabled', 'readonly', 'multiple', 'required', 'min', 'max', 'step', 'pattern', 'accept', 'accept-charset', 'autocomplete', 'autofocus', 'form', 'formaction', 'formenctype', 'formmethod', 'formnovalidate', 'formtarget', 'height', 'width', 'alt', 'download', 'media', 'target',  'tabindex', 'accesskey', 'contenteditable', 'draggable', 'dropzone', 'hidden'];
+const allowedAttributeSet = new Set(allowedAttributes);
+
+const unwantedTagNames = ['script', 'style', 'noscript', 'img', 'svg', 'link', 'meta'];
+const unwantedTags = unwantedTagNames.join(', ');
+
+// Recursive function to clean attributes of a node and its children
+function cleanAttributes(node) {
+  // If the node has attributes, inspect them
+  if (node.attributes) {
+    // Collect attributes in an array to avoid modification issues
+    const attributes = Array.from(node.attributes);
+    for (const attribute of attributes) {
+      // If the attribute is not in the allowed list, remove it
+      if (!allowedAttributeSet.has(attribute.name)) {
+        node.removeAttribute(attribute.name);
+      }
+    }
+  }
+
+  // Recursive case: If the node has child nodes, inspect them
+  if (node.childNodes) {
+    node.childNodes.forEach(cleanAttributes);
+  }
+}
+
+// Original extraction path: serialize the page, re-parse it with JSDOM, clean it and pretty-print it.
+async function extractWithJSDOM(page) {
+  // get the raw HTML content of the page
+  const rawHTML = await page.content();
+  // create a new JSDOM object
+  const dom = new JSDOM(rawHTML);
+  // parse the raw HTML into a new document object
+  const doc = dom.window.document;
+  // remove unwanted elements from the document
+  doc.querySelectorAll(unwantedTags).forEach(element => element.remove());
+  // get the clean HTML
+  // remove all attributes from the elements apart from
+  // name, type, id, class, href, src, title
+  cleanAttributes(doc.documentElement);
+  const cleanHTML = doc.documentElement.outerHTML;
+  return beautifyHTML(cleanHTML, { indent_size: 2 });
+}
+
+// Runs inside the page: serializes the document in a single traversal, skipping unwanted elements
+// and attributes. Every start tag goes on its own line (without indentation), so the output stays
+// compact but can still be diffed line by line.
+// The output can be scoped with options.selector (only the subtrees of the matching elements)
+// and options.viewport (only the elements that intersect the viewport).
+function serializeCleanHTML(allowedAttributes, unwantedTagNames, options = {}) {
+  const allowed = new Set(allowedAttributes);
+  const unwanted = new Set(unwantedTagNames);
+  const voidTags = new Set(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr']);
+  const escapeText = (text) => text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+  const escapeAttribute = (value) => value.replace(/&/g, '&amp;').replace(/"/g, '&quot;');
+  const out = [];
+
+  function inViewport(element) {
+    // elements that are not rendered (e.g. display: none) have no client rects
+    if (element.getClientRects().length === 0) {
+      return false;
+    }
+    const rect = element.getBoundingClientRect();
+    return rect.bottom > 0 && rect.right > 0 && rect.top < window.innerHeight && rect.left < window.innerWidth;
+  }
+
+  function walk(node, checkViewport) {
+    if (node.nodeType === Node.TEXT_NODE) {
+      const text = node.nodeValue.replace(/\s+/g, ' ');
+      if (text !== ' ') {
+        out.push(escapeText(text));
+      }
+      return;
+    }
+    if (node.nodeType !== Node.ELEMENT_NODE) {
+      return;
+    }
+    const tag = node.tagName.toLowerCase();
+    if (unwanted.has(tag) || (checkViewport && !inViewport(node))) {
+      return;
+    }
+    let startTag = `\n<${tag}`;
+    for (const attribute of node.attributes) {
+      if (allowed.has(attribute.name)) {
+        startTag += ` ${attribute.name}="${escapeAttribute(attribute.value)}"`;
+      }
+    }
+    out.push(startTag + '>');
+    if (voidTags.has(tag)) {
+      return;
+    }
+    // the options of a select are not rendered as boxes of their own
+    const checkChildren = checkViewport && tag !== 'select' && tag !== 'datalist';
+    for (let child = node.firstChild; child; child = child.nextSibling) {
+      walk(child, checkChildren);
+    }
+    out.push(`</${tag}>`);
+  }
+
+  const roots = options.selector ? document.querySelectorAll(options.selector) : [document.documentElement];
+  for (const root of roots) {
+    walk(root, Boolean(options.viewport));
+  }
+  return out.join('').trimStart();
+}
+
+// Runs inside the page: lists the rendered interactive elements (inputs, buttons, links, selects, ...)
+// one per line, each preceded by the text of its nearest label.
+function serializeInteractiveElements(allowedAttributes) {
+  const allowed = new Set(allowedAttributes);
+  const selector = 'input:not([type="hidden"]), button, a[href], select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="tab"], [role="menuitem"], [contenteditable="true"]';
+  const escapeText = (text) => text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;');
+  const escapeAttribute = (value) => value.replace(/&/g, '&amp;').replace(/"/g, '&quot;');
+  const squash = (text) => (text || '').replace(/\s+/g, ' ').trim();
+  const maxTextLength = 200;
+
+  function startTag(element, extraAttributes = []) {
+    let tag = `<${element.tagName.toLowerCase()}`;
+    for (const attribute of element.attributes) {
+      if (allowed.has(attribute.name) || extraAttributes.includes(attribute.name)) {
+        tag += ` ${attribute.name}="${escapeAttribute(attribute.value)}"`;
+      }
+    }
+    return tag + '>';
+  }
+
+  function labelOf(element) {
+    if (element.labels && element.labels.length > 0) {
+      return squash(Array.from(element.labels, (label) => label.textContent).join(' '));
+    }
+    const labelledBy = element.getAttribute('aria-labelledby');
+    if (labelledBy) {
+      return squash(labelledBy.split(/\s+/).map((id) => (document.getElementById(id) || {}).textContent).join(' '));
+    }
+    // otherwise the closest preceding text, e.g. <span>Email</span><input ...>
+    for (let node = element.previousSibling; node; node = node.previousSibling) {
+      const text = squash(node.textContent);
+      if (text) {
+        return text.slice(-maxTextLength);
+      }
+    }
+    return '';
+  }
+
+  const out = [];
+  for (const element of document.querySelectorAll(selector)) {
+    if (element.getClientRects().length === 0) {
+      continue; // not rendered
+    }
+    const tag = element.tagName.toLowerCase();
+    const label = labelOf(element);
+    if (label && !['a', 'button'].includes(tag)) {
+      out.push(`<label>${escapeText(label)}</label>`);
+    }
+    if (tag === 'input') {
+      out.push(startTag(element, ['aria-label']));
+    } else if (tag === 'select') {
+      const options = Array.from(element.options, (option) => `${startTag(option)}${escapeText(squash(option.textContent))}</option>`);
+      out.push(`${startTag(element, ['aria-label'])}${options.join('')}</select>`);
+    } else {
+      const text = squash(element.innerText || element.textContent).slice(0, maxTextLength);
+      out.push(`${startTag(element, ['aria-label', 'role'])}${escapeText(text)}</${tag}>`);
+    }
+  }
+  return out.join('\n');
+}
+
+// elements left out of the page outline
+const outlineUnwantedTagNames = ['script', 'style', 'noscript', 'svg', 'link', 'meta', 'template', 'head'];
+
+// Runs inside the page: a compact outline of the page, similar to its accessibility tree, with one line per node:
+// the role, name and value of the element and a reference to it, e.g. `textbox "Email" value="a@b.c" [ref=12]`,
+// and text lines, e.g. `text "Free delivery"`. Children are indented by one space per level.
+// The reference is stored in the data-ab-ref attribute of the element, so it stays the same as long as the element
+// is in the page, and the element can be selected with [data-ab-ref="12"].
+// Like serializeCleanHTML, the outline can be scoped with options.selector and options.viewport.
+function serializeOutline(unwantedTagNames, options = {}) {
+  const unwanted = new Set(unwantedTagNames);
+  const maxNameLength = 120;
+  const maxTextLength = 300;
+  const squash = (text) => (text || '').replace(/\s+/g, ' ').trim();
+  const quote = (text, maxLength) => JSON.stringify(text.length > maxLength ? `${text.slice(0, maxLength)}...` : text);
+  const inputRoles = {
+    button: 'button', submit: 'button', reset: 'button', image: 'button', checkbox: 'checkbox', radio: 'radio',
+    range: 'slider', number: 'spinbutton', search: 'searchbox',
+  };
+  const tagRoles = {
+    button: 'button', textarea: 'textbox', option: 'option', summary: 'button', dialog: 'dialog', form: 'form',
+    nav: 'navigation', main: 'main', header: 'banner', footer: 'contentinfo', aside: 'complementary',
+    ul: 'list', ol: 'list', li: 'listitem', table: 'table', tr: 'row', td: 'cell', th: 'columnheader',
+    h1: 'heading', h2: 'heading', h3: 'heading', h4: 'heading', h5: 'heading', h6: 'heading',
+    fieldset: 'group', iframe: 'iframe',
+  };
+  // roles named by their text content: their descendants are not listed
+  const namedByContent = new Set(['link', 'button', 'heading', 'option', 'tab', 'menuitem']);
+  // text inside these elements is merged into a single text line
+  const inlineTags = new Set(['a', 'abbr', 'b', 'bdi', 'br', 'cite', 'code', 'em', 'i', 'kbd', 'label', 'mark', 'q', 's', 'small', 'span', 'strong', 'sub', 'sup', 'time', 'u']);
+
+  const lines = [];
+  let text = [];
+  let textDepth = 0;
+
+  function flushText() {
+    const merged = squash(text.join(''));
+    if (merged) {
+      lines.push(`${' '.repeat(textDepth)}text ${quote(merged, maxTextLength)}`);
+    }
+    text = [];
+  }
+
+  function refOf(element) {
+    let ref = element.getAttribute('data-ab-ref');
+    if (!ref) {
+      window.__autobrowseRefCount = (window.__autobrowseRefCount || 0) + 1;
+      ref = String(window.__autobrowseRefCount);
+      element.setAttribute('data-ab-ref', ref);
+    }
+    return ref;
+  }
+
+  function roleOf(element, tag) {
+    const role = (element.getAttribute('role') || '').split(' ')[0];
+    if (role && role !== 'presentation' && role !== 'none') {
+      return role;
+    }
+    if (tag === 'a') {
+      return element.hasAttribute('href') ? 'link' : null;
+    }
+    if (tag === 'input') {
+      return inputRoles[element.type] || 'textbox';
+    }
+    if (tag === 'select') {
+      return element.multiple ? 'listbox' : 'combobox';
+    }
+    if (tag === 'img') {
+      return element.alt ? 'img' : null;
+    }
+    return tagRoles[tag] || null;
+  }
+
+  function nameOf(element, role) {
+    const label = element.getAttribute('aria-label');
+    if (label) {
+      return squash(label);
+    }
+    const labelledBy = element.getAttribute('aria-labelledby');
+    if (labelledBy) {
+      return squash(labelledBy.split(/\s+/).map((id) => (document.getElementById(id) || {}).textContent).join(' '));
+    }
+    if (element.labels && element.labels.length > 0) {
+      return squash(Array.from(element.labels, (label) => label.textContent).join(' '));
+    }
+    if (role === 'img') {
+      return squash(element.alt);
+    }
+    if (element.tagName === 'INPUT' && role === 'button') {
+      return squash(element.value);
+    }
+    if (namedByContent.has(role)) {
+      return squash(element.innerText || element.textContent);
+    }
+    return squash(element.getAttribute('placeholder') || element.getAttribute('title'));
+  }
+
+  function propertiesOf(element, role, tag) {
+    const properties = [];
+    if (role === 'heading' && /^h[1-6]$/.test(tag)) {
+      properties.push(`level=${tag[1]}`);
+    }
+    if (tag === 'input' || tag === 'textarea') {
+      if (role === 'checkbox' || role === 'radio') {
+        properties.push(element.checked ? 'checked' : 'unchecked');
+      } else if (element.value && role !== 'button') {
+        properties.push(`value=${quote(element.type === 'password' ? '********' : element.value, maxNameLength)}`);
+      }
+    }
+    if (tag === 'select' && element.selectedOptions.length > 0) {
+      properties.push(`value=${quote(squash(Array.from(element.selectedOptions, (option) => option.textContent).join(', ')), maxNameLength)}`);
+    }
+    if (element.disabled) {
+      properties.push('disabled');
+    }
+    if (element.required) {
+      properties.push('required');
+    }
+    const expanded = element.getAttribute('aria-expanded');
+    if (expanded) {
+      properties.push(expanded === 'true' ? 'expanded' : 'collapsed');
+    }
+    return properties;
+  }
+
+  function isRendered(element, tag) {
+    // options are not rendered as boxes of their own
+    return tag === 'option' || tag === 'optgroup' || element.getClientRects().length > 0;
+  }
+
+  function inViewport(element) {
+    const rect = element.getBoundingClientRect();
+    return rect.bottom > 0 && rect.right > 0 && rect.top < window.innerHeight && rect.left < window.innerWidth;
+  }
+
+  function walk(node, depth, checkViewport) {
+    if (node.nodeType === Node.TEXT_NODE) {
+      if (text.length === 0) {
+        textDepth = depth;
+      }
+      text.push(node.nodeValue);
+      return;
+    }
+    if (node.nodeType !== Node.ELEMENT_NODE) {
+      return;
+    }
+    const tag = node.tagName.toLowerCase();
+    if (unwanted.has(tag) || node.getAttribute('aria-hidden') === 'true' || !isRendered(node, tag)
+        || (checkViewport && tag !== 'option' && tag !== 'optgroup' && !inViewport(node))) {
+      return;
+    }
+    // labels of controls outside of them are already the names of the controls
+    if (tag === 'label' && node.control && !node.contains(node.control)) {
+      return;
+    }
+    const role = roleOf(node, tag);
+    if (!role) {
+      const block = !inlineTags.has(tag);
+      if (block) {
+        flushText();
+      }
+      for (let child = node.firstChild; child; child = child.nextSibling) {
+        walk(child, depth, checkViewport);
+      }
+      if (block) {
+        flushText();
+      }
+      return;
+    }
+    flushText();
+    const name = nameOf(node, role);
+    const properties = propertiesOf(node, role, tag);
+    lines.push(`${' '.repeat(depth)}${role}${name ? ` ${quote(name, maxNameLength)}` : ''}${properties.map((property) => ` ${property}`).join('')} [ref=${refOf(node)}]`);
+    if (namedByContent.has(role) || role === 'textbox' || role === 'searchbox') {
+      return;
+    }
+    for (let child = node.firstChild; child; child = child.nextSibling) {
+      walk(child, depth + 1, checkViewport);
+    }
+    flushText();
+  }
+
+  const roots = options.selector ? document.querySelectorAll(options.selector) : [document.body || document.documentElement];
+  for (const root of roots) {
+    walk(root, 0, Boolean(options.viewport));
+    flushText();
+  }
+  return lines.join('\n');
+}
+
+// the outline of the page (see serializeOutline), an alternative to its HTML that takes far fewer tokens
+async function extractOutline(page) {
+  return page.evaluate(serializeOutline, outlineUnwantedTagNames);
+}
+
+// Fast extraction path: prune and filter inside the page, without re-parsing or pretty-printing.
+async function extractInPage(page) {
+  return page.evaluate(serializeCleanHTML, allowedAttributes, unwantedTagNames);
+}
+
+// HTML (or outline, with format 'outline') of the subtrees of the elements matching a CSS selector (empty if nothing matches)
+async function extractSubtree(page, selector, format = 'html') {
+  if (format === 'outline') {
+    return page.evaluate(serializeOutline, outlineUnwantedTagNames, { selector });
+  }
+  return page.evaluate(serializeCleanHTML, allowedAttributes, unwantedTagNames, { selector });
+}
+
+// HTML (or outline, with format 'outline') of the elements that intersect the viewport
+async function extractViewport(page, format = 'html') {
+  if (format === 'outline') {
+    return page.evaluate(serializeOutline, outlineUnwantedTagNames, { viewport: true });
+  }
+  return page.evaluate(serializeCleanHTML, allowedAttributes, unwantedTagNames, { viewport: true });
+}
+
+// the interactive elements of the page with their labels
+async function extractInteractive(page) {
+  return page.evaluate(serializeInteractiveElements, allowedAttributes);
+}
+
+// extraction modes selectable with the "extraction" field of fetchHTML messages
+const extractors = {
+  inpage: extractInPage,
+  jsdom: extractWithJSDOM,
+  outline: extractOutline,
+};
+
+async function extractHTML(page, extraction = 'inpage') {
+  const extractor = extractors[extraction];
+  if (!extractor) {
+    throw new Error(`Unknown extraction mode: ${extraction}`);
+  }
+  return extractor(page);
+}
+
+module.exports = {
+  extractHTML, extractInPage, extractWithJSDOM, extractOutline, extractSubtree, extractViewport, extractInteractive,
+  serializeCleanHTML, serializeOutline, serializeInteractiveElements, allowedAttributes, unwantedTagNames,
+};
@@ -0,0 +1,201 @@
+const { performance } = require('perf_hooks');
+
+// how long (ms) waitUntilReady waits by default: the DOM-stable and network-idle strategies give up waiting
+// (and the code goes on) after it, the selector strategy fails
+const defaultTimeout = 10000;
+// interval (ms) at which the page is checked while waiting
+const pollInterval = 100;
+
+// requests ignored by the network-idle strategy: ad, analytics and tracking hosts, which keep pages busy long after
+// they are usable, and long-lived connections, which never finish
+const defaultIgnoredRequests = [
+  'google-analytics.com', 'googletagmanager.com', 'googlesyndication.com', 'googleadservices.com', 'doubleclick.net',
+  'adservice.google.', 'facebook.net', 'connect.facebook.com', 'amazon-adsystem.com', 'adnxs.com', 'criteo.',
+  'taboola.com', 'outbrain.com', 'hotjar.com', 'clarity.ms', 'segment.io', 'segment.com', 'mixpanel.com',
+  'optimizely.com', 'newrelic.com', 'nr-data.net', 'sentry.io', 'scorecardresearch.com', 'quantserve.com',
+];
+const ignoredResourceTypes = new Set(['websocket', 'eventsource', 'media']);
+
+// methods of the page that wait for the page (a navigation, an element, a delay...), timed as waits of the executed code
+const waitingMethods = new Set([
+  'goto', 'reload', 'goBack', 'goForward', 'waitForNavigation', 'waitForSelector', 'waitForXPath',
+  'waitForFunction', 'waitForTimeout', 'waitForNetworkIdle', 'waitForRequest', 'waitForResponse',
+]);
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+// runs in the page: the URL and DOM version of the document, or null while it is loading.
+// Pages not prepared by the session pool (e.g. opened by the executed code) do not count their mutations,
+// the number of elements and the length of the text stand in for the version.
+function domVersion() {
+  if (document.readyState === 'loading') {
+    return null;
+  }
+  const version = window.__autobrowseDOMVersion !== undefined
+    ? window.__autobrowseDOMVersion
+    : `${document.getElementsByTagName('*').length}/${document.body ? document.body.innerText.length : 0}`;
+  return `${location.href}#${version}`;
+}
+
+// The readiness of the page of a session while code is executed: tracks the requests in flight,
+// provides waitUntilReady to the executed code, and measures the time the code spends waiting.
+class Readiness {
+  constructor(page, signal) {
+    this.page = page;
+    this.signal = signal;
+    // requests in flight, and when the requests that finished did
+    this.inFlight = new Map();
+    this.finished = [];
+    // time spent in waitUntilReady and in the waiting methods of the page, and waits that gave up at their timeout
+    this.readyMs = 0;
+    this.navigationWaitMs = 0;
+    this.readyTimeouts = 0;
+    this.onRequest = (request) => {
+      this.inFlight.set(request, { url: request.url(), type: request.resourceType() });
+    };
+    this.onRequestDone = (request) => {
+      const entry = this.inFlight.get(request);
+      if (entry) {
+        this.inFlight.delete(request);
+        this.finished.push({ ...entry, at: performance.now() });
+      }
+    };
+  }
+
+  start() {
+    this.page.on('request', this.onRequest);
+    this.page.on('requestfinished', this.onRequestDone);
+    this.page.on('requestfailed', this.onRequestDone);
+  }
+
+  stop() {
+    this.page.off('request', this.onRequest);
+    this.page.off('requestfinished', this.onRequestDone);
+    this.page.off('requestfailed', this.onRequestDone);
+  }
+
+  // timings of the execution (in ms) reported to the client
+  timing() {
+    return {
+      waitMs: this.readyMs + this.navigationWaitMs,
+      readyMs: this.readyMs,
+      navigationWaitMs: this.navigationWaitMs,
+      readyTimeouts: this.readyTimeouts,
+    };
+  }
+
+  // the page given to the executed code, with its waiting methods timed
+  timed(page) {
+    const readiness = this;
+    return new Proxy(page, {
+      get(object, property) {
+        const value = Reflect.get(object, property, object);
+        if (typeof value !== 'function') {
+          return value;
+        }
+        if (!waitingMethods.has(property)) {
+          return value.bind(object);
+        }
+        return async (...args) => {
+          const started = performance.now();
+          try {
+            return await value.apply(object, args);
+          } finally {
+            readiness.navigationWaitMs += performance.now() - started;
+          }
+        };
+      },
+    });
+  }
+
+  checkAborted() {
+    if (this.signal.aborted) {
+      throw new Error('Request timed out or was cancelled');
+    }
+  }
+
+  // Wait until the page is ready for the next action, with one of the strategies:
+  // - "dom-stable" (the default): the DOM has not changed for quietMs ms (500)
+  // - "selector" (the default if a selector is given): the element is visible (or only present, with visible: false)
+  // - "network-idle": at most maxInflight requests (0) have been in flight for idleMs ms (500), not counting the
+  //   requests to ad and analytics hosts, nor those whose URL contains one of the strings of ignore
+  // Waits at most timeout ms (10000): the selector strategy then fails, the other ones return with timedOut: true.
+  async waitUntilReady(options = {}) {
+    const strategy = options.strategy || (options.selector ? 'selector' : 'dom-stable');
+    const timeout = options.timeout !== undefined ? options.timeout : defaultTimeout;
+    const started = performance.now();
+    let ready = true;
+    try {
+      switch (strategy) {
+        case 'dom-stable':
+          ready = await this.waitForDOMStable(options.quietMs !== undefined ? options.quietMs : 500, timeout);
+          break;
+        case 'selector':
+          if (!options.selector) {
+            throw new Error("waitUntilReady({ strategy: 'selector' }) needs a selector");
+          }
+          await this.page.waitForSelector(options.selector, { visible: options.visible !== false, timeout });
+          break;
+        case 'network-idle':
+          ready = await this.waitForNetworkIdle(
+            options.idleMs !== undefined ? options.idleMs : 500,
+            options.maxInflight || 0,
+            [...defaultIgnoredRequests, ...(options.ignore || [])],
+            timeout,
+          );
+          break;
+        default:
+          throw new Error(`Unknown readiness strategy: ${strategy}`);
+      }
+    } finally {
+      this.readyMs += performance.now() - started;
+    }
+    if (!ready) {
+      this.readyTimeouts++;
+    }
+    return { strategy, ms: Math.round(performance.now() - started), timedOut: !ready };
+  }
+
+  async waitForDOMStable(quietMs, timeout) {
+    const deadline = performance.now() + timeout;
+    let version = null;
+    let stableSince = performance.now();
+    while (performance.now() < deadline) {
+      this.checkAborted();
+      let current = null;
+      try {
+        current = await this.page.evaluate(domVersion);
+      } catch (err) {
+        // the document is being replaced by a navigation
+      }
+      if (current === null || current !== version) {
+        version = current;
+        stableSince = performance.now();
+      } else if (performance.now() - stableSince >= quietMs) {
+        return true;
+      }
+      await sleep(pollInterval);
+    }
+    return false;
+  }
+
+  async waitForNetworkIdle(idleMs, maxInflight, ignore, timeout) {
+    const started = performance.now();
+    const deadline = started + timeout;
+    const counted = (entry) => !ignoredResourceTypes.has(entry.type) && !ignore.some((pattern) => entry.url.includes(pattern));
+    while (performance.now() < deadline) {
+      this.checkAborted();
+      const busy = [...this.inFlight.values()].filter(counted).length;
+      const lastActivity = this.finished.filter(counted).reduce((last, entry) => Math.max(last, entry.at), started);
+      if (busy <= maxInflight && performance.now() - lastActivity >= idleMs) {
+        return true;
+      }
+      await sleep(pollInterval);
+    }
+    return false;
+  }
+}
+
+module.exports = { Readiness, defaultIgnoredRequests };
@@ -0,0 +1,153 @@
+const crypto = require('crypto');
+
+// id of the session used by messages that do not name one: the first page of the browser
+const defaultSessionId = 'default';
+
+// A browser session: an isolated browser context (cookies, storage, cache) with its page,
+// and the state kept about the page (navigations, code executions, HTML snapshots sent to the client).
+class Session {
+  constructor(id, browser, context, page) {
+    this.id = id;
+    // what executed code sees as `browser`: the browser context, which can also open new pages
+    this.browser = browser;
+    this.context = context;
+    this.page = page;
+    this.navigations = 0;
+    this.executions = 0;
+    // HTML snapshots sent for this session, by version
+    this.snapshots = new Map();
+    this.htmlVersion = 0;
+    this.createdAt = Date.now();
+    this.lastUsed = Date.now();
+    page.on('framenavigated', (frame) => {
+      if (frame === page.mainFrame()) {
+        this.navigations++;
+      }
+    });
+  }
+
+  touch() {
+    this.lastUsed = Date.now();
+  }
+
+  async memoryUsage() {
+    const metrics = await this.page.metrics();
+    return metrics.JSHeapUsedSize;
+  }
+
+  async close() {
+    if (this.context) {
+      await this.context.close();
+    }
+  }
+}
+
+// A pool of isolated browser sessions in a single browser process, leased by clients with acquire().
+// Sessions idle for longer than idleTimeout ms, or whose page uses more than memoryLimit bytes of JS heap,
+// are closed by the periodic housekeeping.
+class SessionPool {
+  constructor(browser, { size = 4, idleTimeout = 10 * 60 * 1000, memoryLimit = 512 * 1024 * 1024, preparePage = async () => {} } = {}) {
+    this.browser = browser;
+    this.size = size;
+    this.idleTimeout = idleTimeout;
+    this.memoryLimit = memoryLimit;
+    this.preparePage = preparePage;
+    this.sessions = new Map();
+    // why recently closed sessions were closed, to report it to their clients
+    this.closed = new Map();
+  }
+
+  // the session of messages without a session id, on the first page of the browser (not counted in the pool size)
+  async initializeDefault() {
+    const [page] = await this.browser.pages();
+    const defaultPage = page || await this.browser.newPage();
+    await this.preparePage(defaultPage);
+    this.sessions.set(defaultSessionId, new Session(defaultSessionId, this.browser, null, defaultPage));
+  }
+
+  leased() {
+    return this.sessions.size - (this.sessions.has(defaultSessionId) ? 1 : 0);
+  }
+
+  async acquire() {
+    if (this.leased() >= this.size) {
+      throw new Error(`Session pool exhausted (${this.size} sessions in use)`);
+    }
+    const id = crypto.randomUUID();
+    // reserve the slot before the first await, so that concurrent acquires can not exceed the pool size
+    this.sessions.set(id, null);
+    try {
+      const context = await this.browser.createIncognitoBrowserContext();
+      const page = await context.newPage();
+      await this.preparePage(page);
+      const session = new Session(id, context, context, page);
+      this.sessions.set(id, session);
+      console.log(`Session ${id} acquired (${this.leased()}/${this.size})`);
+      return session;
+    } catch (err) {
+      this.sessions.delete(id);
+      throw err;
+    }
+  }
+
+  get(id = defaultSessionId) {
+    const session = this.sessions.get(id);
+    if (!session) {
+      const reason = this.closed.get(id);
+      throw new Error(reason ? `Session ${id} was closed: ${reason}` : `Unknown session: ${id}`);
+    }
+    session.touch();
+    return session;
+  }
+
+  async release(id, reason = 'released') {
+    const session = this.sessions.get(id);
+    if (!session || id === defaultSessionId) {
+      return;
+    }
+    this.sessions.delete(id);
+    this.closed.set(id, reason);
+    // only remember the reasons of the last sessions
+    if (this.closed.size > 100) {
+      this.closed.delete(this.closed.keys().next().value);
+    }
+    console.log(`Session ${id} closed: ${reason}`);
+    await session.close();
+  }
+
+  // close the sessions that have been idle for too long or use too much memory
+  async housekeeping() {
+    const now = Date.now();
+    for (const [id, session] of this.sessions) {
+      if (!session || id === defaultSessionId) {
+        continue;
+      }
+      if (now - session.lastUsed > this.idleTimeout) {
+        await this.release(id, `idle for more than ${Math.round(this.idleTimeout / 1000)}s`);
+        continue;
+      }
+      try {
+        const memory = await session.memoryUsage();
+        if (memory > this.memoryLimit) {
+          await this.release(id, `page used ${Math.round(memory / 1024 / 1024)}MB of memory (limit ${Math.round(this.memoryLimit / 1024 / 1024)}MB)`);
+        }
+      } catch (err) {
+        console.error(`Error measuring the memory of session ${id}: ${err}`);
+      }
+    }
+  }
+
+  stats() {
+    return {
+      size: this.size,
+      leased: this.leased(),
+      sessions: Array.from(this.sessions.values()).filter(Boolean).map((session) => ({
+        id: session.id,
+        url: session.page.url(),
+        idle: Date.now() - session.lastUsed,
+      })),
+    };
+  }
+}
+
+module.exports = { SessionPool, Session, defaultSessionId };
@@ -0,0 +1,249 @@
+import asyncio
+import itertools
+import json
+from typing import Any, Dict, Optional
+
+import websockets
+
+from event_loop import EventLoopThread
+from tracing import span
+
+DEFAULT_REQUEST_TIMEOUT = 120.0 # seconds
+# time given to the console to report that a deadline expired, before the request is abandoned on this side
+DEADLINE_GRACE = 5.0 # seconds
+
+
+class BrowserConsoleTimeout(Exception):
+    '''
+    The deadline of a request to the browser console expired: the console reported it, or did not reply in time
+    '''
+
+
+class BrowserConsoleClient:
+    '''
+    A websocket client to the browser console, shared by all the agents.
+    Every request carries an id that the console echoes in its reply, so several requests can be in flight
+    on the same connection and replies are matched to requests regardless of their order.
+    Every request has a deadline. When it expires the console replies that the request timed out and stops handling it:
+    executed code can no longer use the page, although code that does not call it (e.g. a loop) is not interrupted.
+    The request then fails with a BrowserConsoleTimeout, as it does if the console does not reply at all.
+    The connection is kept alive with heartbeats (websocket pings), and reopened automatically when it is lost.
+
+    The connection lives on a long-lived event loop running in a background thread (its own, or the runtime
+    of AutoBrowse), so that heartbeats are answered and replies are received even while other code is blocked.
+    request() can be awaited from any event loop, and request_sync() called from synchronous code.
+    '''
+
+    def __init__(
+        self,
+        uri: str = "ws://localhost:3000",
+        request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        heartbeat_interval: Optional[float] = 20.0,
+        heartbeat_timeout: Optional[float] = 20.0,
+        reconnect_attempts: int = 5,
+        reconnect_delay: float = 1.0,
+        runtime: Optional[EventLoopThread] = None,
+    ):
+        self.uri = uri
+        self.request_timeout = request_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.websocket = None
+        # number of connections opened so far, e.g. to tell that state held by the console was lost
+        self.connections = 0
+        self.request_ids = itertools.count(1)
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.timeouts = 0
+        self.stray_messages = 0
+        self.owns_runtime = runtime is None
+        self.runtime = runtime if runtime is not None else EventLoopThread("browser-console-client")
+        self.loop = self.runtime.loop
+        # created on the event loop of the client thread
+        self.connect_lock = None
+
+    def connect(self):
+        '''
+        Open the connection to the browser console, if it is not open yet.
+        '''
+        self.runtime.run(self._ensure_connected())
+
+    async def request(self, action: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        '''
+        Send a request to the browser console and wait for its reply.
+        Raises a BrowserConsoleTimeout if the deadline (timeout seconds, request_timeout by default) expires,
+        and an exception if the connection is lost before the reply arrives.
+        '''
+        with span(f"console.{action}") as request_span:
+            response_data = await self.runtime.run_async(self._request(action, timeout, params))
+            self._record_timing(request_span, response_data)
+        return response_data
+
+    def request_sync(self, action: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        with span(f"console.{action}") as request_span:
+            response_data = self.runtime.run(self._request(action, timeout, params))
+            self._record_timing(request_span, response_data)
+        return response_data
+
+    def _record_timing(self, request_span, response_data: Dict[str, Any]):
+        # the time the console spent on the request (and on its steps, e.g. extractMs, diffMs, executeMs) in ms,
+        # kept out of the result, which ends up in prompts
+        timing = response_data.pop("timing", None)
+        if request_span is not None and timing:
+            request_span.set(server_timing={name: round(value, 3) for name, value in timing.items()})
+
+    def run(self, coroutine):
+        '''
+        Run a coroutine (e.g. one that makes requests) on the event loop of the client from synchronous code
+        '''
+        return self.runtime.run(coroutine)
+
+    def close(self):
+        async def close_websocket():
+            if self.websocket is not None:
+                await self.websocket.close()
+        self.runtime.run(close_websocket())
+        if self.owns_runtime:
+            self.runtime.stop()
+
+    async def acquire_session(self) -> "BrowserSession":
+        '''
+        Lease an isolated browser session (browser context and page) from the pool of the browser console.
+        Raises an exception if all the sessions of the pool are in use.
+        '''
+        response_data = await self.request("acquireSession")
+        if not response_data.get('success'):
+            raise Exception(f"Failed to acquire a browser session: {response_data.get('error')}")
+        return BrowserSession(self, response_data["result"]["session"])
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "connections": self.connections,
+            "in_flight": len(self.pending),
+            "timeouts": self.timeouts,
+            "stray_messages": self.stray_messages,
+        }
+
+    # the methods below run on the event loop of the client thread
+
+    async def _ensure_connected(self):
+        if self.connect_lock is None:
+            self.connect_lock = asyncio.Lock()
+        async with self.connect_lock:
+            if self.websocket is not None and not self.websocket.closed:
+                return
+            for attempt in range(self.reconnect_attempts + 1):
+                try:
+                    # HTML snapshots can be several MB, so the message size is not limited, and compressed when the console supports it
+                    self.websocket = await websockets.connect(
+                        self.uri,
+                        compression="deflate",
+                        max_size=None,
+                        ping_interval=self.heartbeat_interval,
+                        ping_timeout=self.heartbeat_timeout,
+                    )
+                    break
+                except (OSError, websockets.exceptions.WebSocketException) as e:
+                    if attempt == self.reconnect_attempts:
+                        raise Exception("Failed to connect to browser console websocket. Please make sure the browser console is running.") from e
+                    delay = self.reconnect_delay * 2 ** attempt
+                    print(f"Failed to connect to browser console ({e}), retrying in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            self.connections += 1
+            if self.connections > 1:
+                print("Reconnected to browser console")
+            self.loop.create_task(self._read_replies(self.websocket))
+
+    async def _request(self, action: str, timeout: Optional[float], params: Dict[str, Any]) -> Dict[str, Any]:
+        await self._ensure_connected()
+        timeout = timeout if timeout is not None else self.request_timeout
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        message = {'id': request_id, 'action': action, **params}
+        if timeout:
+            # when the deadline expires the console replies with timedOut, and executed code can no longer use the page
+            message['timeout'] = int(timeout * 1000)
+        try:
+            await self.websocket.send(json.dumps(message))
+            reply = await asyncio.wait_for(future, timeout + DEADLINE_GRACE if timeout else None)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            await self._cancel(request_id)
+            raise BrowserConsoleTimeout(f"Browser console request {action} timed out after {timeout}s (no reply)")
+        except asyncio.CancelledError:
+            # e.g. the task that made the request hit its wall-clock limit, the console can stop the work
+            await self._cancel(request_id)
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+        if reply.get("timedOut"):
+            self.timeouts += 1
+            raise BrowserConsoleTimeout(f"Browser console request {action} timed out after {timeout}s: {reply.get('error')}")
+        return reply
+
+    async def _cancel(self, request_id: int):
+        if self.websocket is None:
+            return
+        try:
+            await self.websocket.send(json.dumps({'action': "cancel", 'target': request_id}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def _read_replies(self, websocket):
+        try:
+            async for raw_message in websocket:
+                reply = json.loads(raw_message)
+                # the id only matches the reply to its request, it is not part of the result (which ends up in prompts)
+                request_id = reply.pop("id", None)
+                future = self.pending.get(request_id)
+                if future is None:
+                    # e.g. the reply to a request that already timed out
+                    self.stray_messages += 1
+                    print(f"Dropping browser console message without a pending request (id = {request_id})")
+                    continue
+                if not future.done():
+                    future.set_result(reply)
+        except websockets.exceptions.ConnectionClosed as e:
+            print(f"Browser console connection lost: {e}")
+        finally:
+            # requests in flight may have had side effects (e.g. executed code), so they fail rather than being resent
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(Exception("Browser console connection lost"))
+            if self.websocket is websocket:
+                self.websocket = None
+
+
+class BrowserSession:
+    '''
+    A browser session leased from the pool of the browser console.
+    Has the same interface as BrowserConsoleClient, and adds the id of the session to every request,
+    so that agents can be given either of them.
+    '''
+
+    def __init__(self, client: BrowserConsoleClient, session_id: str):
+        self.client = client
+        self.session_id = session_id
+
+    def connect(self):
+        self.client.connect()
+
+    async def request(self, action: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        return await self.client.request(action, timeout, session=self.session_id, **params)
+
+    def request_sync(self, action: str, timeout: Optional[float] = None, **params) -> Dict[str, Any]:
+        return self.client.request_sync(action, timeout, session=self.session_id, **params)
+
+    def run(self, coroutine):
+        return self.client.run(coroutine)
+
+    async def release(self):
+        '''
+        Close the session and return it to the pool
+        '''
+        await self.client.request("releaseSession", session=self.session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return self.client.stats()
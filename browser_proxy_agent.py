@@ -1,14 +1,16 @@
 import asyncio
-import json
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import autogen
 
 # load OPENAI_API_KEY from .env file
 from dotenv import load_dotenv
 from termcolor import colored
-import websockets
 
-from autogen.code_utils import infer_lang
+from autogen.agentchat.agent import Agent
+from autogen.code_utils import UNKNOWN, extract_code, infer_lang
+from async_replies import register_async_reply
+from browser_console_client import BrowserConsoleClient
+from tracing import span
 
 class BrowserProxyAgent(autogen.ConversableAgent):
     '''
@@ -27,6 +29,7 @@ class BrowserProxyAgent(autogen.ConversableAgent):
         llm_config: Optional[Union[Dict, bool]] = False,
         system_message: Optional[str] = "",
         browser_console_uri: Optional[str] = "ws://localhost:3000",
+        browser_console: Optional[BrowserConsoleClient] = None,
     ):
         super().__init__(
             name=name,
@@ -40,23 +43,24 @@ class BrowserProxyAgent(autogen.ConversableAgent):
             system_message=system_message,
         )
         self.browser_console_uri = browser_console_uri
-        self.connect_websocket()
+        # the connection to the browser console, shared with the other agents if it is given
+        self.browser_console = browser_console if browser_console is not None else BrowserConsoleClient(browser_console_uri)
+        self.browser_console.connect()
+        # execution results of the code blocks of replies that were executed while they were streamed, by reply
+        self.streamed_executions: Dict[str, Tuple[int, str]] = {}
+        # code blocks are executed without blocking the event loop in async chats
+        register_async_reply(self, BrowserProxyAgent.a_generate_code_execution_reply, autogen.ConversableAgent.generate_code_execution_reply)
 
-    def connect_websocket(self):
-        try :
-            self.websocket = asyncio.get_event_loop().run_until_complete(websockets.connect(self.browser_console_uri))
+    async def run_puppeteer_code(self, code: str, timeout: Optional[float] = None, **kwargs) -> Tuple[int, str, str]:
+        '''
+        Execute the code in the browser console. After timeout seconds (the timeout of the code execution config,
+        or the request timeout of the browser console client) the execution fails, and the code can no longer use the page.
+        '''
+        try:
+            with span("run_puppeteer_code"):
+                response_data = await self.browser_console.request("executeCode", timeout=timeout, code=code)
         except Exception as e:
-            raise Exception("Failed to connect to browser console websocket. Please make sure the browser console is running.")
-        
-    async def run_puppeteer_code(self, code: str, **kwargs) -> Tuple[int, str, str]:
-        if not self.websocket:
-            self.connect_websocket()
-        message = json.dumps({
-            'action': "executeCode",
-            'code': code,
-        })
-        await self.websocket.send(message)
-        response_data = json.loads(await self.websocket.recv())
+            return 1, str({"success": False, "error": str(e)}), None
 
         if response_data.get('success'):
             return 0, str(response_data), None
@@ -68,6 +72,13 @@ class BrowserProxyAgent(autogen.ConversableAgent):
         """Overriden  function Execute the code blocks and return the result.
         IF the language is Javascript, the code will be sent to the browser console to be executed.
         """
+        return self.browser_console.run(self.a_execute_code_blocks(code_blocks))
+
+    async def a_execute_code_blocks(self, code_blocks: List[str]) -> Tuple[int, str]:
+        '''
+        Execute the code blocks and return the result.
+        Javascript code is sent to the browser console, other code runs in a worker thread.
+        '''
         logs_all = ""
         for i, code_block in enumerate(code_blocks):
             lang, code = code_block
@@ -81,15 +92,16 @@ class BrowserProxyAgent(autogen.ConversableAgent):
                 flush=True,
             )
             if lang in ["javascript", "Javascript", "node", "Node", "js", "JS"]:
-               exitcode, logs, image =  asyncio.get_event_loop().run_until_complete(self.run_puppeteer_code(code, **self._code_execution_config))
+               exitcode, logs, image = await self.run_puppeteer_code(code, **self._code_execution_config)
             elif lang in ["bash", "shell", "sh"]:
-                exitcode, logs, image = self.run_code(code, lang=lang, **self._code_execution_config)
+                exitcode, logs, image = await asyncio.to_thread(self.run_code, code, lang=lang, **self._code_execution_config)
             elif lang in ["python", "Python"]:
                 if code.startswith("# filename: "):
                     filename = code[11 : code.find("\n")].strip()
                 else:
                     filename = None
-                exitcode, logs, image = self.run_code(
+                exitcode, logs, image = await asyncio.to_thread(
+                    self.run_code,
                     code,
                     lang="python",
                     filename=filename,
@@ -109,4 +121,36 @@ class BrowserProxyAgent(autogen.ConversableAgent):
             if exitcode != 0:
                 return exitcode, logs_all
         return exitcode, logs_all
-    
+
+    async def a_generate_code_execution_reply(
+        self,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[Any] = None,
+    ):
+        '''
+        Async counterpart of generate_code_execution_reply, awaiting the execution of the code blocks
+        '''
+        code_execution_config = config if config is not None else self._code_execution_config
+        if code_execution_config is False:
+            return False, None
+        if messages is None:
+            messages = self._oai_messages[sender]
+        last_n_messages = code_execution_config.pop("last_n_messages", 1)
+        for i in range(min(len(messages), last_n_messages)):
+            message = messages[-(i + 1)]
+            code_blocks = extract_code(message["content"])
+            if len(code_blocks) == 1 and code_blocks[0][0] == UNKNOWN:
+                # no code block is found, lang should be `UNKNOWN`
+                if i == last_n_messages - 1:
+                    code_execution_config["last_n_messages"] = last_n_messages
+                    return False, None
+                continue
+            if message["content"] in self.streamed_executions:
+                exitcode, logs = self.streamed_executions.pop(message["content"])
+            else:
+                exitcode, logs = await self.a_execute_code_blocks(code_blocks)
+            exitcode2str = "execution succeeded" if exitcode == 0 else "execution failed"
+            break
+        code_execution_config["last_n_messages"] = last_n_messages
+        return True, f"exitcode: {exitcode} ({exitcode2str})\nCode output: {logs}"
@@ -0,0 +1,74 @@
+import random
+import sys
+import time
+
+from langchain.text_splitter import CharacterTextSplitter
+
+from html_chunker import CHUNK_OVERLAP, CHUNK_SIZE, get_html_chunks
+from token_count import get_encoding, num_tokens_from_string
+
+# micro-benchmark of the single-pass chunker against the previous CharacterTextSplitter based one
+# usage: python chunk_benchmark.py [page.html ...]
+# without arguments synthetic pages of 1, 2 and 4 MB are generated
+# tiktoken downloads the cl100k_base encoding the first time it is used, so the first run needs network access
+# (or TIKTOKEN_CACHE_DIR pointing to a directory with a cached copy of the encoding)
+
+
+def synthetic_page(size_bytes: int, seed: int = 0) -> str:
+    '''
+    Generate a page that looks like the cleaned HTML returned by the browser console.
+    '''
+    rng = random.Random(seed)
+    words = ["search", "results", "hotel", "price", "sign", "up", "email", "password", "accept", "cookies", "Madrid", "night"]
+    parts = ["<html>\n  <body>\n"]
+    size = 0
+    i = 0
+    while size < size_bytes:
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        part = f'''    <div class="result item-{i % 17}" id="result-{i}">
+      <a href="/item/{i}" title="{text}">{text}</a>
+      <form id="form-{i}">
+        <input type="text" name="q{i}" placeholder="{text}">
+        <button type="submit" class="btn">Go {i}</button>
+      </form>
+    </div>
+'''
+        parts.append(part)
+        size += len(part)
+        i += 1
+    parts.append("  </body>\n</html>\n")
+    return "".join(parts)
+
+
+def character_text_splitter_chunks(html: str):
+    text_splitter = CharacterTextSplitter(
+        separator=">",
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=num_tokens_from_string,
+    )
+    return text_splitter.split_text(html)
+
+
+def timed(function, html: str):
+    start = time.perf_counter()
+    chunks = function(html)
+    return time.perf_counter() - start, chunks
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        pages = []
+        for filename in sys.argv[1:]:
+            with open(filename, "r") as f:
+                pages.append((filename, f.read()))
+    else:
+        pages = [(f"synthetic-{mb}MB", synthetic_page(mb * 2**20, seed=mb)) for mb in (1, 2, 4)]
+
+    get_encoding() # load the tokenizer outside of the timings
+    print(f"{'page':<24}{'size (MB)':>10}{'old (s)':>10}{'new (s)':>10}{'speedup':>10}{'old chunks':>12}{'new chunks':>12}")
+    for name, html in pages:
+        old_time, old_chunks = timed(character_text_splitter_chunks, html)
+        new_time, new_chunks = timed(get_html_chunks, html)
+        speedup = old_time / new_time if new_time else float("inf")
+        print(f"{name:<24}{len(html) / 2**20:>10.2f}{old_time:>10.3f}{new_time:>10.3f}{speedup:>9.1f}x{len(old_chunks):>12}{len(new_chunks):>12}")
@@ -0,0 +1,97 @@
+import glob
+import os
+import sys
+
+from langchain.text_splitter import CharacterTextSplitter
+
+from chunk_benchmark import synthetic_page
+from html_chunker import CHUNK_OVERLAP, get_html_chunk_spans
+from token_count import num_tokens_from_string
+
+# checks that get_html_chunk_spans reproduces the chunks of the CharacterTextSplitter it replaced,
+# but for the deviations listed in its docstring
+# usage: python chunker_test.py [page.html ...]
+# without arguments the fixture pages and a synthetic page of 1 MB are checked, at every size of CHUNK_SIZES
+# (tiktoken downloads the cl100k_base encoding the first time it is used, see chunk_benchmark.py)
+
+CHUNK_SIZES = [1000, 200, 100, 50]
+
+
+def splitter_chunks(html: str, chunk_size: int, chunk_overlap: int):
+    text_splitter = CharacterTextSplitter(
+        separator=">",
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=num_tokens_from_string,
+    )
+    return text_splitter.split_text(html)
+
+
+def chunks_without_separator(html: str, spans):
+    '''
+    The chunks of the spans as the splitter would return them: without the separator they end with, stripped
+    '''
+    chunks = []
+    for start, end in spans:
+        if html.endswith(">", start, end):
+            end -= 1
+        chunk = html[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+def check_same_chunks(name: str, html: str, chunk_size: int, chunk_overlap: int = CHUNK_OVERLAP):
+    pieces = [piece for piece in html.split(">") if piece]
+    if ">>" in html or html.startswith(">") or max(num_tokens_from_string(piece) for piece in pieces) > chunk_size:
+        # the chunks around such pieces differ as documented, see check_deviations
+        print(f"{name} ({chunk_size} tokens): skipped, the page has empty or oversized pieces")
+        return
+    expected = splitter_chunks(html, chunk_size, chunk_overlap)
+    actual = chunks_without_separator(html, get_html_chunk_spans(html, chunk_size, chunk_overlap))
+    different = sum(a != b for a, b in zip(expected, actual)) + abs(len(expected) - len(actual))
+    assert different == 0, f"{name} ({chunk_size} tokens): {different} of {len(expected)} chunks differ ({len(actual)} chunks)"
+    print(f"{name} ({chunk_size} tokens): {len(actual)} chunks, same as CharacterTextSplitter")
+
+
+def check_deviations():
+    # a span keeps the separator it ends with
+    html = "<p>one</p><p>two</p><p>three</p>"
+    spans = get_html_chunk_spans(html, 8, 0)
+    assert all(html[end - 1] == ">" for _, end in spans), spans
+    assert chunks_without_separator(html, spans) == splitter_chunks(html, 8, 0)
+
+    # consecutive separators are kept, the splitter joins the pieces around them with a single one
+    html = "<p>a>>b</p>"
+    spans = get_html_chunk_spans(html, 100, 0)
+    assert [html[start:end] for start, end in spans] == [html], spans
+    assert splitter_chunks(html, 100, 0) == ["<p>a>b</p"]
+
+    # an oversized piece is cut on token boundaries instead of making an oversized chunk
+    html = "<p>" + "word " * 500 + "</p>"
+    spans = get_html_chunk_spans(html, 100, 0)
+    assert spans[0][0] == 0 and spans[-1][1] == len(html)
+    assert all(previous_end == start for (_, previous_end), (start, _) in zip(spans, spans[1:])), spans
+    assert max(num_tokens_from_string(html[start:end]) for start, end in spans) <= 100 + 1
+    assert max(num_tokens_from_string(chunk) for chunk in splitter_chunks(html, 100, 0)) > 100
+    print("deviations: as documented")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        pages = []
+        for filename in sys.argv[1:]:
+            with open(filename, "r") as f:
+                pages.append((filename, f.read()))
+    else:
+        pages = []
+        for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "*.html"))):
+            with open(filename, "r") as f:
+                pages.append((os.path.basename(filename), f.read()))
+        html = synthetic_page(2**20)
+        pages.append((f"synthetic ({html.count('<div')} elements)", html))
+
+    for name, html in pages:
+        for chunk_size in CHUNK_SIZES:
+            check_same_chunks(name, html, chunk_size)
+    check_deviations()
@@ -0,0 +1,104 @@
+import re
+from typing import Dict, List, Tuple
+
+from token_count import num_tokens_from_string
+
+DEFAULT_KEEP_LAST = 3 # code blocks sent verbatim
+DEFAULT_TOKEN_BUDGET = 1_000 # tokens of the code history sent to the code generator
+
+# puppeteer calls summarized in the compact history of older code blocks
+ACTION_PATTERNS = [
+    (re.compile(r"\.goto\(\s*(['\"`])(.+?)\1"), "visited {1}"),
+    (re.compile(r"\.type\(\s*(['\"`])(.+?)\1\s*,\s*(['\"`])(.*?)\3"), "typed \"{3}\" into {1}"),
+    (re.compile(r"\.type\(\s*(ref\(\d+\))\s*,\s*(['\"`])(.*?)\2"), "typed \"{2}\" into {0}"),
+    (re.compile(r"\.click\(\s*(['\"`])(.+?)\1"), "clicked {1}"),
+    (re.compile(r"\.click\(\s*(ref\(\d+\))"), "clicked {0}"),
+    (re.compile(r"\.select\(\s*(['\"`])(.+?)\1\s*,\s*(['\"`])(.*?)\3"), "selected \"{3}\" in {1}"),
+    (re.compile(r"\.select\(\s*(ref\(\d+\))\s*,\s*(['\"`])(.*?)\2"), "selected \"{2}\" in {0}"),
+    (re.compile(r"keyboard\.press\(\s*(['\"`])(.+?)\1"), "pressed {1}"),
+]
+
+
+def summarize_code(code: str) -> List[str]:
+    '''
+    Summarize the browser actions of a puppeteer code block: visited URLs, filled fields, clicked elements...,
+    in the order they appear in the code.
+    '''
+    actions = []
+    for pattern, template in ACTION_PATTERNS:
+        for match in pattern.finditer(code):
+            actions.append((match.start(), template.format(*match.groups())))
+    return [action for _, action in sorted(actions)]
+
+
+class CodeHistory:
+    '''
+    Builds the history of the code executed so far that is sent to the code generator: the last keep_last code blocks
+    verbatim, and a compact summary of the browser actions of the older ones, within token_budget tokens,
+    so that the prompts do not grow with every step of a long task.
+    '''
+
+    def __init__(self, keep_last: int = DEFAULT_KEEP_LAST, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.keep_last = keep_last
+        self.token_budget = token_budget
+        # tokens of the full history and of the history sent, per code generator request
+        self.full_tokens: List[int] = []
+        self.sent_tokens: List[int] = []
+
+    def build(self, code_blocks: List[str]) -> str:
+        full_history = "\n".join(code_blocks)
+        if not full_history:
+            return ""
+        history, sent_tokens = self._compact(code_blocks)
+        full_tokens = num_tokens_from_string(full_history)
+        if full_tokens <= sent_tokens:
+            history, sent_tokens = full_history, full_tokens
+        self.full_tokens.append(full_tokens)
+        self.sent_tokens.append(sent_tokens)
+        return history
+
+    def _compact(self, code_blocks: List[str]) -> Tuple[str, int]:
+        n_verbatim = min(self.keep_last, len(code_blocks))
+        block_tokens = [num_tokens_from_string(code_block) for code_block in code_blocks]
+        # the most recent blocks are kept verbatim as long as they fit in the budget (at least the last one is)
+        while n_verbatim > 1 and sum(block_tokens[-n_verbatim:]) > self.token_budget:
+            n_verbatim -= 1
+        recent = code_blocks[len(code_blocks) - n_verbatim:]
+        older = code_blocks[:len(code_blocks) - n_verbatim]
+        recent_str = "\n".join(recent)
+        remaining_budget = self.token_budget - sum(block_tokens[-n_verbatim:])
+
+        summary_lines = [f"- {action}" for code_block in older for action in summarize_code(code_block)]
+        # the most recent actions are kept when the summary does not fit in the rest of the budget
+        kept_lines = []
+        for line in reversed(summary_lines):
+            line_tokens = num_tokens_from_string(line) + 1
+            if line_tokens > remaining_budget:
+                break
+            kept_lines.insert(0, line)
+            remaining_budget -= line_tokens
+        omitted = len(summary_lines) - len(kept_lines)
+        if omitted:
+            kept_lines.insert(0, f"- ({omitted} earlier actions omitted)")
+
+        if not older:
+            history = recent_str
+        elif kept_lines:
+            summary = "\n".join(kept_lines)
+            history = f"Summary of the actions of the earlier code:\n{summary}\n\nMost recent code:\n{recent_str}"
+        else:
+            history = f"({len(older)} earlier code blocks omitted)\n\nMost recent code:\n{recent_str}"
+        return history, num_tokens_from_string(history)
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Tokens of code history sent to the code generator, and tokens saved compared to sending all the code executed so far
+        '''
+        steps = len(self.sent_tokens)
+        return {
+            "steps": steps,
+            "full_tokens": sum(self.full_tokens),
+            "sent_tokens": sum(self.sent_tokens),
+            "saved_tokens": sum(self.full_tokens) - sum(self.sent_tokens),
+            "last_saved_tokens": self.full_tokens[-1] - self.sent_tokens[-1] if steps else 0,
+        }
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MAX_ENTRIES = 1_000 # number of completions kept in memory when they are not persisted to disk
+# modes of the cache: "record" returns cached completions and stores new ones,
+# "replay" only returns cached completions and fails on a miss (to re-run a recorded session offline)
+RECORD = "record"
+REPLAY = "replay"
+
+
+def completion_key(llm_config: Dict[str, Any], messages: List[Dict]) -> str:
+    '''
+    Key of a completion in the cache: the hash of the models, the other completion parameters (e.g. functions, temperature)
+    and the messages sent. API keys and endpoints are left out, so the same completions are found with other credentials.
+    '''
+    models = [config.get("model") for config in llm_config.get("config_list", [])]
+    params = {name: value for name, value in llm_config.items() if name != "config_list"}
+    content = json.dumps({"models": models, "params": params, "messages": messages}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class CompletionCachingError(Exception):
+    pass
+
+
+class CompletionCache:
+    '''
+    A cache of LLM completions keyed by the hash of the model, the completion parameters and the messages.
+    If a path is given, completions are persisted to disk (least recently used ones are evicted beyond size_limit bytes),
+    so that a rerun (e.g. after a crash) does not pay again for the steps that were already completed.
+    '''
+
+    def __init__(self, mode: str = RECORD, path: Optional[str] = None, size_limit: int = 2**30, max_entries: int = DEFAULT_MAX_ENTRIES):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown completion cache mode: {mode}")
+        self.mode = mode
+        self.max_entries = max_entries
+        self.completions: OrderedDict = OrderedDict()
+        # completions are looked up from the worker threads that make the LLM calls
+        self.lock = threading.Lock()
+        self.disk = None
+        if path:
+            # diskcache is a dependency of autogen, so it is always available
+            import diskcache
+            self.disk = diskcache.Cache(path, size_limit=size_limit, eviction_policy="least-recently-used")
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        if self.disk is not None:
+            response = self.disk.get(key)
+        else:
+            with self.lock:
+                response = self.completions.get(key)
+                if response is not None:
+                    self.completions.move_to_end(key)
+        with self.lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if response is None and self.mode == REPLAY:
+            raise CompletionCachingError(f"No recorded completion for this request (key {key[:12]}) in replay mode")
+        return response
+
+    def put(self, key: str, response: Dict):
+        if self.mode == REPLAY:
+            return
+        if self.disk is not None:
+            self.disk.set(key, response)
+            return
+        with self.lock:
+            self.completions[key] = response
+            self.completions.move_to_end(key)
+            while len(self.completions) > self.max_entries:
+                self.completions.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "entries": len(self.disk) if self.disk is not None else len(self.completions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,134 @@
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+DEFAULT_MAX_ENTRIES = 10_000 # number of vectors kept in memory
+DEFAULT_BATCH_SIZE = 256 # number of texts sent to the embedding model per request
+
+
+def content_key(text: str, model_name: str) -> str:
+    '''
+    Key of an embedding in the cache: the hash of the text content and the embedding model that produced it.
+    '''
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    '''
+    An LRU cache of embedding vectors keyed by content hash.
+    If a path is given, vectors are also persisted to disk so that warm restarts do not need to re-embed chunks.
+    '''
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, path: Optional[str] = None, size_limit: int = 2**30):
+        self.max_entries = max_entries
+        self.vectors: OrderedDict = OrderedDict()
+        self.disk = None
+        if path:
+            # diskcache is a dependency of autogen, so it is always available
+            import diskcache
+            self.disk = diskcache.Cache(path, size_limit=size_limit)
+        self.hits = 0
+        self.misses = 0
+        self.embedding_calls = 0
+
+    def get(self, key: str) -> Optional[List[float]]:
+        vector = self.vectors.get(key)
+        if vector is not None:
+            self.vectors.move_to_end(key)
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._put_in_memory(key, vector)
+        return vector
+
+    def put(self, key: str, vector: List[float]):
+        self._put_in_memory(key, vector)
+        if self.disk is not None:
+            self.disk.set(key, vector)
+
+    def _put_in_memory(self, key: str, vector: List[float]):
+        self.vectors[key] = vector
+        self.vectors.move_to_end(key)
+        while len(self.vectors) > self.max_entries:
+            self.vectors.popitem(last=False)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.vectors or (self.disk is not None and key in self.disk)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Hit rate of the cache and the number of texts that did not have to be sent for embedding.
+        '''
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.vectors),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "embedding_calls": self.embedding_calls,
+            "embedding_calls_saved": self.hits,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+class CachedEmbeddings(Embeddings):
+    '''
+    Wraps an embedding model so that only texts missing from the cache are sent for embedding, in batches.
+    '''
+
+    def __init__(self, embeddings: Embeddings, cache: Optional[EmbeddingCache] = None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.batch_size = batch_size
+        self.model_name = getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [content_key(text, self.model_name) for text in texts]
+        vectors = {}
+        missing = OrderedDict() # key -> text, deduplicated
+        for key, text in zip(keys, texts):
+            if key in vectors or key in missing:
+                continue
+            vector = self.cache.get(key)
+            if vector is not None:
+                vectors[key] = vector
+                self.cache.hits += 1
+            else:
+                missing[key] = text
+                self.cache.misses += 1
+        missing_keys = list(missing.keys())
+        for start in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[start:start + self.batch_size]
+            batch_vectors = self.embeddings.embed_documents([missing[key] for key in batch_keys])
+            self.cache.embedding_calls += 1
+            for key, vector in zip(batch_keys, batch_vectors):
+                self.cache.put(key, vector)
+                vectors[key] = vector
+        return [vectors[key] for key in keys]
+
+    def cached_vector(self, text: str) -> Optional[List[float]]:
+        '''
+        The embedding of a text if it is in the cache, without sending anything for embedding.
+        '''
+        return self.cache.get(content_key(text, self.model_name))
+
+    def embed_query(self, text: str) -> List[float]:
+        key = content_key(f"query:{text}", self.model_name)
+        vector = self.cache.get(key)
+        if vector is not None:
+            self.cache.hits += 1
+            return vector
+        self.cache.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self.cache.embedding_calls += 1
+        self.cache.put(key, vector)
+        return vector
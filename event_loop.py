@@ -0,0 +1,41 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine
+
+
+class EventLoopThread:
+    '''
+    A long-lived event loop running in a daemon thread.
+    Coroutines can be submitted to it from any thread, and synchronous code can run a coroutine
+    on it with run(), which blocks until the coroutine completes.
+    '''
+
+    def __init__(self, name: str = "autobrowse-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine) -> Any:
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise Exception("Can not block the event loop thread waiting for a coroutine, await it instead")
+        return self.submit(coroutine).result()
+
+    async def run_async(self, coroutine: Coroutine) -> Any:
+        '''
+        Await a coroutine on this event loop from any other event loop (or from this one).
+        '''
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            return await coroutine
+        return await asyncio.wrap_future(self.submit(coroutine))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,919 @@
+import asyncio
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from html import escape
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urljoin, urlparse
+
+import websockets
+
+from event_loop import EventLoopThread
+
+# A stand-in for the browser console (browser-console/console.js) that runs without Node or a browser,
+# e.g. to benchmark AutoBrowse offline: pages are the saved fixtures, parsed into a minimal DOM, and executed code
+# is interpreted by recognizing the puppeteer calls it makes (goto, click, type, select, keyboard.press, ...).
+# It speaks the same websocket protocol (request ids, sessions, deadlines, cancellation, timing) and extracts the
+# page the same ways (clean HTML, outline, interactive elements), so the Python side can not tell the difference.
+# Scripts of the pages do not run, and HTML is always sent in full (or "unchanged"), never as a diff.
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+DEFAULT_URL = "about:blank"
+
+# same as browser-console/extract.js
+ALLOWED_ATTRIBUTES = ['name', 'type', 'id', 'class', 'href', 'src', 'title', 'placeholder', 'value', 'checked', 'selected', 'disabled', 'readonly', 'multiple', 'required', 'min', 'max', 'step', 'pattern', 'accept', 'accept-charset', 'autocomplete', 'autofocus', 'form', 'formaction', 'formenctype', 'formmethod', 'formnovalidate', 'formtarget', 'height', 'width', 'alt', 'download', 'media', 'target', 'tabindex', 'accesskey', 'contenteditable', 'draggable', 'dropzone', 'hidden']
+UNWANTED_TAGS = {'script', 'style', 'noscript', 'img', 'svg', 'link', 'meta'}
+OUTLINE_UNWANTED_TAGS = {'script', 'style', 'noscript', 'svg', 'link', 'meta', 'template', 'head'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'}
+# start tags that close an open element of the same kind, as in <li>a<li>b
+IMPLICITLY_CLOSED = {'li', 'p', 'option', 'tr', 'td', 'th', 'dt', 'dd'}
+
+NOT_FOUND_PAGE = '''<!DOCTYPE html>
+<html><head><title>404 Not Found</title></head>
+<body><h1>Not Found</h1><p>The requested URL {path} was not found on this server.</p></body></html>
+'''
+
+
+def fixture_path(path: str, fixtures_dir: str = FIXTURES_DIR) -> Optional[str]:
+    '''
+    The fixture file served at a URL path, e.g. /login and /login.html are fixtures/login.html (None if there is none)
+    '''
+    name = path.strip("/") or "index.html"
+    for candidate in (name, f"{name}.html"):
+        filename = os.path.normpath(os.path.join(fixtures_dir, candidate))
+        if filename.startswith(os.path.abspath(fixtures_dir)) and os.path.isfile(filename):
+            return filename
+    return None
+
+
+def load_page(url: str, fixtures_dir: str = FIXTURES_DIR) -> Tuple[int, str]:
+    '''
+    Status and HTML of the page at a URL: the fixture at its path, whatever the host, or a 404 page
+    '''
+    path = urlparse(url).path
+    filename = fixture_path(path, fixtures_dir)
+    if filename is None:
+        return 404, NOT_FOUND_PAGE.format(path=escape(path))
+    with open(filename, "r") as f:
+        return 200, f.read()
+
+
+class Element:
+    '''
+    An element of the minimal DOM the stand-in pages are parsed into. Children are elements and strings (text nodes).
+    The value and checked state are properties, as in a browser: typing does not change the value attribute.
+    '''
+
+    def __init__(self, tag: str, attributes: Dict[str, str], parent: Optional["Element"] = None):
+        self.tag = tag
+        self.attributes = attributes
+        self.parent = parent
+        self.children: List[Union["Element", str]] = []
+        self.value = attributes.get("value", "")
+        self.checked = "checked" in attributes
+        self.selected = "selected" in attributes
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self.attributes.get(name, default)
+
+    def iter(self) -> Iterator["Element"]:
+        '''
+        The element and its descendant elements, in document order
+        '''
+        yield self
+        for child in self.children:
+            if isinstance(child, Element):
+                yield from child.iter()
+
+    def ancestors(self) -> Iterator["Element"]:
+        parent = self.parent
+        while parent is not None:
+            yield parent
+            parent = parent.parent
+
+    def text_content(self) -> str:
+        return "".join(child if isinstance(child, str) else child.text_content() for child in self.children)
+
+    def element_children(self) -> List["Element"]:
+        return [child for child in self.children if isinstance(child, Element)]
+
+    def contains(self, other: "Element") -> bool:
+        return other is self or self in other.ancestors()
+
+    def is_rendered(self) -> bool:
+        # there is no layout: hidden elements are the ones hidden by attribute or inline style,
+        # and options are not rendered as boxes of their own
+        if self.tag in ("option", "optgroup"):
+            return True
+        for element in itertools.chain([self], self.ancestors()):
+            style = (element.get("style") or "").replace(" ", "")
+            if "hidden" in element.attributes or "display:none" in style:
+                return False
+        return True
+
+
+class DOMParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.document = Element("#document", {})
+        self.current = self.document
+
+    def handle_starttag(self, tag, attrs):
+        if tag in IMPLICITLY_CLOSED and self.current.tag == tag:
+            self.current = self.current.parent
+        element = Element(tag, {name: value if value is not None else "" for name, value in attrs}, self.current)
+        self.current.children.append(element)
+        if tag not in VOID_TAGS:
+            self.current = element
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.current = self.current.parent
+
+    def handle_endtag(self, tag):
+        # close up to the matching open element, if there is one
+        for element in itertools.chain([self.current], self.current.ancestors()):
+            if element.tag == tag:
+                self.current = element.parent
+                return
+
+    def handle_data(self, data):
+        self.current.children.append(data)
+
+
+def parse_html(html: str) -> Element:
+    parser = DOMParser()
+    parser.feed(html)
+    parser.close()
+    return parser.document
+
+
+class SelectorError(Exception):
+    pass
+
+
+COMPOUND_PART_PATTERN = re.compile(r'''#(?P<id>[\w-]+)|\.(?P<cls>[\w-]+)|\[\s*(?P<attr>[\w:-]+)\s*(?:(?P<op>[~^$*|]?=)\s*(?P<value>"[^"]*"|'[^']*'|[^\]\s]+)\s*)?\]|:(?P<pseudo>[\w-]+)(?:\((?P<arg>[^)]*)\))?''')
+TAG_PATTERN = re.compile(r"\*|[a-zA-Z][\w-]*")
+
+
+def split_outside_brackets(selector: str, separators: str) -> List[Tuple[str, str]]:
+    '''
+    Split a selector on separator characters that are not inside brackets, parentheses or quotes,
+    returning (separator before, part) pairs
+    '''
+    parts = []
+    depth = 0
+    quote = None
+    current = ""
+    separator = ""
+    for char in selector:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "\"'":
+            quote = char
+        elif char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+        elif depth == 0 and char in separators:
+            if current.strip():
+                parts.append((separator, current.strip()))
+                current = ""
+                separator = char
+            elif char.strip():
+                separator = char
+            continue
+        current += char
+    if current.strip():
+        parts.append((separator, current.strip()))
+    return parts
+
+
+def parse_compound(compound: str, selector: str) -> Tuple[Optional[str], List[Tuple]]:
+    tag = None
+    match = TAG_PATTERN.match(compound)
+    position = 0
+    if match:
+        tag = None if match.group() == "*" else match.group().lower()
+        position = match.end()
+    conditions = []
+    while position < len(compound):
+        match = COMPOUND_PART_PATTERN.match(compound, position)
+        if match is None:
+            raise SelectorError(f"'{selector}' is not a valid selector.")
+        if match.group("id"):
+            conditions.append(("attr", "id", "=", match.group("id")))
+        elif match.group("cls"):
+            conditions.append(("attr", "class", "~=", match.group("cls")))
+        elif match.group("attr"):
+            value = match.group("value")
+            if value is not None and value[0] in "\"'":
+                value = value[1:-1]
+            conditions.append(("attr", match.group("attr").lower(), match.group("op"), value))
+        elif match.group("pseudo") in ("first-child", "last-child", "nth-child", "checked", "disabled"):
+            conditions.append(("pseudo", match.group("pseudo"), match.group("arg")))
+        elif match.group("pseudo") == "not" and match.group("arg"):
+            conditions.append(("not", parse_compound(match.group("arg").strip(), selector)))
+        else:
+            raise SelectorError(f"'{selector}' is not a valid selector.")
+        position = match.end()
+    return tag, conditions
+
+
+def parse_selector(selector: str) -> List[List[Tuple[str, Tuple]]]:
+    '''
+    Parse a group of CSS selectors made of compound selectors (tag, #id, .class, [attribute], [attribute="value"],
+    :first-child, :nth-child(n), :checked, :not(...)) and descendant or child combinators
+    '''
+    group = []
+    for _, complex_selector in split_outside_brackets(selector, ","):
+        chain = [(combinator or " ", parse_compound(compound, selector)) for combinator, compound in split_outside_brackets(complex_selector.replace(">", " > "), " >")]
+        if not chain:
+            raise SelectorError(f"'{selector}' is not a valid selector.")
+        group.append(chain)
+    if not group:
+        raise SelectorError(f"'{selector}' is not a valid selector.")
+    return group
+
+
+def matches_compound(element: Element, compound: Tuple[Optional[str], List[Tuple]]) -> bool:
+    tag, conditions = compound
+    if tag is not None and element.tag != tag:
+        return False
+    for condition in conditions:
+        if condition[0] == "attr":
+            _, name, operator, expected = condition
+            value = element.get(name)
+            if value is None:
+                return False
+            if operator is None:
+                continue
+            if operator == "=" and value != expected:
+                return False
+            if operator == "~=" and expected not in value.split():
+                return False
+            if operator == "^=" and not value.startswith(expected):
+                return False
+            if operator == "$=" and not value.endswith(expected):
+                return False
+            if operator == "*=" and expected not in value:
+                return False
+            if operator == "|=" and value != expected and not value.startswith(f"{expected}-"):
+                return False
+        elif condition[0] == "not":
+            if matches_compound(element, condition[1]):
+                return False
+        else:
+            _, pseudo, argument = condition
+            siblings = element.parent.element_children() if element.parent is not None else [element]
+            if pseudo == "first-child" and siblings[0] is not element:
+                return False
+            if pseudo == "last-child" and siblings[-1] is not element:
+                return False
+            if pseudo == "nth-child" and (not (argument or "").strip().isdigit() or siblings.index(element) + 1 != int(argument)):
+                return False
+            if pseudo == "checked" and not (element.checked or element.selected):
+                return False
+            if pseudo == "disabled" and "disabled" not in element.attributes:
+                return False
+    return True
+
+
+def matches_chain(element: Element, chain: List[Tuple[str, Tuple]]) -> bool:
+    combinator, compound = chain[-1]
+    if not matches_compound(element, compound):
+        return False
+    if len(chain) == 1:
+        return True
+    if combinator == ">":
+        return element.parent is not None and matches_chain(element.parent, chain[:-1])
+    return any(matches_chain(ancestor, chain[:-1]) for ancestor in element.ancestors())
+
+
+def query_selector_all(root: Element, selector: str) -> List[Element]:
+    group = parse_selector(selector)
+    return [element for element in root.iter() if element.tag != "#document" and any(matches_chain(element, chain) for chain in group)]
+
+
+def query_selector(root: Element, selector: str) -> Optional[Element]:
+    elements = query_selector_all(root, selector)
+    return elements[0] if elements else None
+
+
+def squash(text: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def escape_text(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def escape_attribute(value: str) -> str:
+    return value.replace("&", "&amp;").replace('"', "&quot;")
+
+
+class FakePage:
+    '''
+    A page of a stand-in browser session: the parsed fixture at the current URL, with the state the console
+    keeps about it (navigations, code executions, outline references, HTML snapshots sent to the client).
+    '''
+
+    def __init__(self, fixtures_dir: str = FIXTURES_DIR, body_repeat: int = 1):
+        self.fixtures_dir = fixtures_dir
+        # number of times the body of each page is duplicated, to simulate large pages
+        self.body_repeat = body_repeat
+        self.url = DEFAULT_URL
+        self.set_document(parse_html("<html><head></head><body></body></html>"))
+        self.navigations = 0
+        self.executions = 0
+        self.ref_count = 0
+        self.focused: Optional[Element] = None
+        # HTML sent to the client, by version
+        self.html_version = None
+        self.html_snapshot = None
+        # submitted forms: URL and fields
+        self.submissions: List[Dict[str, Any]] = []
+
+    def version(self) -> str:
+        # there are no scripts to mutate the DOM, so its version only changes with navigations and code executions
+        return f"{self.navigations}.0.{self.executions}"
+
+    def goto(self, url: str) -> int:
+        if urlparse(url).scheme not in ("http", "https", "file"):
+            raise Exception(f"net::ERR_NAME_NOT_RESOLVED at {url}")
+        status, html = load_page(url, self.fixtures_dir)
+        if self.body_repeat > 1:
+            html = re.sub(r"(<body[^>]*>)(.*)(</body>)", lambda match: match.group(1) + match.group(2) * self.body_repeat + match.group(3), html, count=1, flags=re.DOTALL | re.IGNORECASE)
+        self.url = url
+        self.set_document(parse_html(html))
+        self.navigations += 1
+        self.ref_count = 0
+        self.focused = None
+        return status
+
+    def set_document(self, document: Element):
+        self.document = document
+        # there are no scripts to change the ids of the elements, so labels and controls are looked up once
+        self.elements_by_id: Dict[str, Element] = {}
+        self.labels_by_control_id: Dict[str, List[Element]] = {}
+        for element in document.iter():
+            if element.get("id") and element.get("id") not in self.elements_by_id:
+                self.elements_by_id[element.get("id")] = element
+            if element.tag == "label" and element.get("for"):
+                self.labels_by_control_id.setdefault(element.get("for"), []).append(element)
+
+    def body(self) -> Element:
+        return query_selector(self.document, "body") or self.document
+
+    def find(self, selector: str) -> Element:
+        element = query_selector(self.document, selector)
+        if element is None:
+            raise Exception(f"No element found for selector: {selector}")
+        return element
+
+    def click(self, selector: str):
+        element = self.find(selector)
+        self.focused = element
+        if element.tag == "input" and element.get("type") in ("checkbox", "radio"):
+            if element.get("type") == "radio":
+                for other in query_selector_all(self.document, f'input[type="radio"][name="{element.get("name", "")}"]'):
+                    other.checked = False
+            element.checked = not element.checked or element.get("type") == "radio"
+            return
+        link = next((ancestor for ancestor in itertools.chain([element], element.ancestors()) if ancestor.tag == "a" and ancestor.get("href") is not None), None)
+        if link is not None:
+            self.goto(urljoin(self.url, link.get("href")))
+            return
+        if (element.tag == "button" and element.get("type", "submit") == "submit") or (element.tag == "input" and element.get("type") in ("submit", "image")):
+            form = self.form_of(element)
+            if form is not None:
+                self.submit(form)
+
+    def type(self, selector: str, text: str):
+        element = self.find(selector)
+        self.focused = element
+        element.value += text
+
+    def select(self, selector: str, values: List[str]) -> List[str]:
+        element = self.find(selector)
+        if element.tag != "select":
+            raise Exception("Element is not a <select> element.")
+        selected = []
+        for option in query_selector_all(element, "option"):
+            option.selected = option.get("value", squash(option.text_content())) in values
+            if option.selected:
+                selected.append(option.get("value", squash(option.text_content())))
+        return selected
+
+    def press(self, key: str):
+        if key == "Enter" and self.focused is not None:
+            form = self.form_of(self.focused)
+            if form is not None:
+                self.submit(form)
+
+    def form_of(self, element: Element) -> Optional[Element]:
+        form_id = element.get("form")
+        if form_id:
+            return query_selector(self.document, f'form[id="{form_id}"]')
+        return next((ancestor for ancestor in element.ancestors() if ancestor.tag == "form"), None)
+
+    def submit(self, form: Element):
+        fields = []
+        for element in query_selector_all(form, "input, select, textarea"):
+            name = element.get("name")
+            if not name or "disabled" in element.attributes:
+                continue
+            if element.tag == "select":
+                fields.extend((name, option.get("value", squash(option.text_content()))) for option in query_selector_all(element, "option") if option.selected)
+            elif element.get("type") in ("checkbox", "radio"):
+                if element.checked:
+                    fields.append((name, element.value or "on"))
+            elif element.get("type") not in ("submit", "button", "reset", "image"):
+                fields.append((name, element.value))
+        action = urljoin(self.url, form.get("action") or self.url)
+        self.submissions.append({"url": action, "fields": dict(fields)})
+        if (form.get("method") or "get").lower() == "get":
+            action = f"{action.split('?')[0]}?{urlencode(fields)}"
+        self.goto(action)
+
+    def labels_of(self, element: Element) -> List[Element]:
+        labels = list(self.labels_by_control_id.get(element.get("id") or "", []))
+        labels.extend(ancestor for ancestor in element.ancestors() if ancestor.tag == "label" and ancestor not in labels)
+        return labels
+
+    def control_of(self, label: Element) -> Optional[Element]:
+        target = label.get("for")
+        if target:
+            return self.elements_by_id.get(target)
+        return next((element for element in label.iter() if element.tag in ("input", "select", "textarea", "button")), None)
+
+    def ref_of(self, element: Element) -> str:
+        ref = element.get("data-ab-ref")
+        if not ref:
+            self.ref_count += 1
+            ref = str(self.ref_count)
+            element.attributes["data-ab-ref"] = ref
+        return ref
+
+    def roots(self, selector: Optional[str], default: Element) -> List[Element]:
+        return query_selector_all(self.document, selector) if selector else [default]
+
+    def clean_html(self, selector: Optional[str] = None) -> str:
+        '''
+        Same as serializeCleanHTML: one start tag per line, without unwanted elements and attributes
+        '''
+        html_element = query_selector(self.document, "html") or self.document
+        out = []
+
+        def walk(node):
+            if isinstance(node, str):
+                text = re.sub(r"\s+", " ", node)
+                if text != " ":
+                    out.append(escape_text(text))
+                return
+            if node.tag in UNWANTED_TAGS:
+                return
+            start_tag = f"\n<{node.tag}" + "".join(f' {name}="{escape_attribute(value)}"' for name, value in node.attributes.items() if name in ALLOWED_ATTRIBUTES)
+            out.append(start_tag + ">")
+            if node.tag in VOID_TAGS:
+                return
+            for child in node.children:
+                walk(child)
+            out.append(f"</{node.tag}>")
+
+        for root in self.roots(selector, html_element):
+            walk(root)
+        return "".join(out).lstrip()
+
+    def interactive_html(self) -> str:
+        '''
+        Same as serializeInteractiveElements: the interactive elements, each preceded by its label
+        '''
+        selector = 'input:not([type="hidden"]), button, a[href], select, textarea, [role="button"], [role="link"], [role="checkbox"], [role="tab"], [role="menuitem"], [contenteditable="true"]'
+        max_text_length = 200
+
+        def start_tag(element, extra_attributes=()):
+            return f"<{element.tag}" + "".join(f' {name}="{escape_attribute(value)}"' for name, value in element.attributes.items() if name in ALLOWED_ATTRIBUTES or name in extra_attributes) + ">"
+
+        def label_of(element):
+            labels = self.labels_of(element)
+            if labels:
+                return squash(" ".join(label.text_content() for label in labels))
+            siblings = element.parent.children if element.parent is not None else []
+            for node in reversed(siblings[:siblings.index(element)]):
+                text = squash(node if isinstance(node, str) else node.text_content())
+                if text:
+                    return text[-max_text_length:]
+            return ""
+
+        out = []
+        for element in query_selector_all(self.document, selector):
+            if not element.is_rendered():
+                continue
+            label = label_of(element)
+            if label and element.tag not in ("a", "button"):
+                out.append(f"<label>{escape_text(label)}</label>")
+            if element.tag == "input":
+                out.append(start_tag(element, ["aria-label"]))
+            elif element.tag == "select":
+                options = "".join(f"{start_tag(option)}{escape_text(squash(option.text_content()))}</option>" for option in query_selector_all(element, "option"))
+                out.append(f"{start_tag(element, ['aria-label'])}{options}</select>")
+            else:
+                text = squash(element.text_content())[:max_text_length]
+                out.append(f"{start_tag(element, ['aria-label', 'role'])}{escape_text(text)}</{element.tag}>")
+        return "\n".join(out)
+
+    def outline(self, selector: Optional[str] = None) -> str:
+        '''
+        Same as serializeOutline: one line per element with its role, name, value and a [ref=N] reference, and text lines
+        '''
+        max_name_length = 120
+        max_text_length = 300
+        quote = lambda text, max_length: json.dumps(f"{text[:max_length]}..." if len(text) > max_length else text, ensure_ascii=False)
+        input_roles = {
+            "button": "button", "submit": "button", "reset": "button", "image": "button", "checkbox": "checkbox", "radio": "radio",
+            "range": "slider", "number": "spinbutton", "search": "searchbox",
+        }
+        tag_roles = {
+            "button": "button", "textarea": "textbox", "option": "option", "summary": "button", "dialog": "dialog", "form": "form",
+            "nav": "navigation", "main": "main", "header": "banner", "footer": "contentinfo", "aside": "complementary",
+            "ul": "list", "ol": "list", "li": "listitem", "table": "table", "tr": "row", "td": "cell", "th": "columnheader",
+            "h1": "heading", "h2": "heading", "h3": "heading", "h4": "heading", "h5": "heading", "h6": "heading",
+            "fieldset": "group", "iframe": "iframe",
+        }
+        named_by_content = {"link", "button", "heading", "option", "tab", "menuitem"}
+        inline_tags = {"a", "abbr", "b", "bdi", "br", "cite", "code", "em", "i", "kbd", "label", "mark", "q", "s", "small", "span", "strong", "sub", "sup", "time", "u"}
+        lines = []
+        text = []
+        text_depth = 0
+
+        def flush_text():
+            nonlocal text
+            merged = squash("".join(text))
+            if merged:
+                lines.append(f"{' ' * text_depth}text {quote(merged, max_text_length)}")
+            text = []
+
+        def role_of(element):
+            role = (element.get("role") or "").split(" ")[0]
+            if role and role not in ("presentation", "none"):
+                return role
+            if element.tag == "a":
+                return "link" if element.get("href") is not None else None
+            if element.tag == "input":
+                return input_roles.get(element.get("type", "text"), "textbox")
+            if element.tag == "select":
+                return "listbox" if "multiple" in element.attributes else "combobox"
+            if element.tag == "img":
+                return "img" if element.get("alt") else None
+            return tag_roles.get(element.tag)
+
+        def name_of(element, role):
+            if element.get("aria-label"):
+                return squash(element.get("aria-label"))
+            labelled_by = element.get("aria-labelledby")
+            if labelled_by:
+                return squash(" ".join(self.elements_by_id[id].text_content() for id in labelled_by.split() if id in self.elements_by_id))
+            if element.tag in ("input", "select", "textarea", "button"):
+                labels = self.labels_of(element)
+                if labels:
+                    return squash(" ".join(label.text_content() for label in labels))
+            if role == "img":
+                return squash(element.get("alt"))
+            if element.tag == "input" and role == "button":
+                return squash(element.value)
+            if role in named_by_content:
+                return squash(element.text_content())
+            return squash(element.get("placeholder") or element.get("title"))
+
+        def properties_of(element, role):
+            properties = []
+            if role == "heading" and re.fullmatch(r"h[1-6]", element.tag):
+                properties.append(f"level={element.tag[1]}")
+            if element.tag in ("input", "textarea"):
+                if role in ("checkbox", "radio"):
+                    properties.append("checked" if element.checked else "unchecked")
+                elif element.value and role != "button":
+                    properties.append(f"value={quote('********' if element.get('type') == 'password' else element.value, max_name_length)}")
+            if element.tag == "select":
+                options = query_selector_all(element, "option")
+                selected = [option for option in options if option.selected] or options[:1]
+                if selected:
+                    properties.append(f"value={quote(squash(', '.join(option.text_content() for option in selected)), max_name_length)}")
+            if "disabled" in element.attributes:
+                properties.append("disabled")
+            if "required" in element.attributes:
+                properties.append("required")
+            expanded = element.get("aria-expanded")
+            if expanded:
+                properties.append("expanded" if expanded == "true" else "collapsed")
+            return properties
+
+        def walk(node, depth):
+            nonlocal text_depth
+            if isinstance(node, str):
+                if not text:
+                    text_depth = depth
+                text.append(node)
+                return
+            if node.tag in OUTLINE_UNWANTED_TAGS or node.get("aria-hidden") == "true" or not node.is_rendered():
+                return
+            if node.tag == "label":
+                control = self.control_of(node)
+                if control is not None and not node.contains(control):
+                    return
+            role = role_of(node)
+            if not role:
+                block = node.tag not in inline_tags
+                if block:
+                    flush_text()
+                for child in node.children:
+                    walk(child, depth)
+                if block:
+                    flush_text()
+                return
+            flush_text()
+            name = name_of(node, role)
+            properties = "".join(f" {prop}" for prop in properties_of(node, role))
+            lines.append(f"{' ' * depth}{role}{f' {quote(name, max_name_length)}' if name else ''}{properties} [ref={self.ref_of(node)}]")
+            if role in named_by_content or role in ("textbox", "searchbox"):
+                return
+            for child in node.children:
+                walk(child, depth + 1)
+            flush_text()
+
+        for root in self.roots(selector, self.body()):
+            walk(root, 0)
+            flush_text()
+        return "\n".join(lines)
+
+
+# puppeteer calls recognized in executed code: the pattern of the call, the method of FakePage, and its arguments,
+# strings (in any of the three quote styles) or selectors (strings or ref(N))
+STRING = r'''(?:'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|`([^`]*)`)'''
+SELECTOR = rf"(?:{STRING}|ref\(\s*(\d+)\s*\))"
+PUPPETEER_CALLS = [
+    (re.compile(rf"\bpage\.goto\(\s*{STRING}"), "goto", ["string"]),
+    (re.compile(rf"\bpage\.click\(\s*{SELECTOR}"), "click", ["selector"]),
+    (re.compile(rf"\bpage\.type\(\s*{SELECTOR}\s*,\s*{STRING}"), "type", ["selector", "string"]),
+    (re.compile(rf"\bpage\.select\(\s*{SELECTOR}\s*,\s*{STRING}"), "select", ["selector", "string"]),
+    (re.compile(rf"\bpage\.focus\(\s*{SELECTOR}"), "focus", ["selector"]),
+    (re.compile(rf"\bpage\.keyboard\.press\(\s*{STRING}"), "press", ["string"]),
+    (re.compile(rf"\bpage\.waitForSelector\(\s*{SELECTOR}"), "wait_for_selector", ["selector"]),
+    # the pages are static, so only waitUntilReady({ selector }) can fail (the other strategies return at once)
+    (re.compile(rf"\bwaitUntilReady\(\s*\{{[^}}]*?\bselector\s*:\s*{SELECTOR}"), "wait_for_selector", ["selector"]),
+]
+
+
+def call_arguments(match: re.Match, kinds: List[str]) -> List[str]:
+    groups = match.groups()
+    arguments = []
+    for kind in kinds:
+        string = next((re.sub(r"\\(.)", r"\1", group) for group in groups[:3] if group is not None), None)
+        if kind == "selector":
+            # ref(12) is the selector of the element listed as [ref=12] in the page outline
+            arguments.append(string if string is not None else f'[data-ab-ref="{groups[3]}"]')
+            groups = groups[4:]
+        else:
+            arguments.append(string)
+            groups = groups[3:]
+    return arguments
+
+
+def execute_code(page: FakePage, code: str):
+    '''
+    Interpret the puppeteer calls of the code, in the order they appear. Other statements are ignored.
+    Raises an exception with the message puppeteer would give, e.g. when no element matches a selector.
+    '''
+    calls = []
+    for pattern, method, kinds in PUPPETEER_CALLS:
+        for match in pattern.finditer(code):
+            calls.append((match.start(), method, call_arguments(match, kinds)))
+    for _, method, arguments in sorted(calls, key=lambda call: call[0]):
+        if method == "goto":
+            page.goto(urljoin(page.url, arguments[0]) if page.url != DEFAULT_URL else arguments[0])
+        elif method == "click":
+            page.click(arguments[0])
+        elif method == "type":
+            page.type(arguments[0], arguments[1])
+        elif method == "select":
+            page.select(arguments[0], [arguments[1]])
+        elif method == "focus":
+            page.focused = page.find(arguments[0])
+        elif method == "press":
+            page.press(arguments[0])
+        elif method == "wait_for_selector" and query_selector(page.document, arguments[0]) is None:
+            raise Exception(f"Waiting for selector `{arguments[0]}` failed: Waiting failed: 30000ms exceeded")
+
+
+class FakeBrowserConsole:
+    '''
+    A websocket server speaking the protocol of the browser console, running on its own event loop thread.
+    latency optionally adds a fixed delay (in seconds) to the requests of some actions, e.g. {"executeCode": 0.2},
+    to model the time a real browser takes.
+    '''
+
+    def __init__(self, host: str = "localhost", port: int = 0, fixtures_dir: str = FIXTURES_DIR, body_repeat: int = 1, latency: Optional[Dict[str, float]] = None):
+        self.host = host
+        self.port = port
+        self.fixtures_dir = fixtures_dir
+        self.body_repeat = body_repeat
+        self.latency = latency or {}
+        self.default_session = FakePage(fixtures_dir, body_repeat)
+        self.sessions: Dict[str, FakePage] = {}
+        self.html_versions = itertools.count(1)
+        self.requests = 0
+        self.runtime = None
+        self.server = None
+
+    @property
+    def uri(self) -> str:
+        return f"ws://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        '''
+        Start serving (on a free port if port is 0), returns the URI to connect to
+        '''
+        self.runtime = EventLoopThread("fake-browser-console")
+        self.server = self.runtime.run(self._serve())
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.uri
+
+    async def _serve(self):
+        return await websockets.serve(self._handle_connection, self.host, self.port, max_size=None)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.runtime.run(self.server.wait_closed())
+            self.runtime.stop()
+            self.server = None
+
+    def page(self, session_id: Optional[str] = None) -> FakePage:
+        if session_id is None:
+            return self.default_session
+        if session_id not in self.sessions:
+            raise Exception(f"Unknown session: {session_id}")
+        return self.sessions[session_id]
+
+    async def _handle_connection(self, websocket):
+        # requests in flight, by id
+        in_flight: Dict[Any, asyncio.Task] = {}
+        try:
+            async for data in websocket:
+                try:
+                    message = json.loads(data)
+                except json.JSONDecodeError as e:
+                    await websocket.send(json.dumps({"success": False, "error": f"Invalid message: {e}"}))
+                    continue
+                if message.get("action") == "cancel":
+                    task = in_flight.get(message.get("target"))
+                    if task is not None:
+                        task.cancel()
+                    continue
+                task = asyncio.ensure_future(self._handle_request(websocket, message))
+                if message.get("id") is not None:
+                    in_flight[message["id"]] = task
+                    task.add_done_callback(lambda _, request_id=message["id"]: in_flight.pop(request_id, None))
+        finally:
+            for task in in_flight.values():
+                task.cancel()
+
+    async def _handle_request(self, websocket, message: Dict[str, Any]):
+        received = time.perf_counter()
+        self.requests += 1
+        timeout = message.get("timeout")
+        try:
+            response = await asyncio.wait_for(self._handle(message), timeout / 1000 if timeout else None)
+        except asyncio.TimeoutError:
+            response = {"success": False, "error": f"Timed out after {timeout} ms", "timedOut": True}
+        except asyncio.CancelledError:
+            # nothing is sent for a cancelled request
+            return
+        response["timing"] = {**response.get("timing", {}), "totalMs": (time.perf_counter() - received) * 1000}
+        if message.get("id") is not None:
+            response = {"id": message["id"], **response}
+        try:
+            await websocket.send(json.dumps(response))
+        except websockets.ConnectionClosed:
+            pass
+
+    async def _handle(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        action = message.get("action")
+        if self.latency.get(action):
+            await asyncio.sleep(self.latency[action])
+        if action == "ping":
+            return {"success": True, "result": "pong"}
+        if action == "acquireSession":
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = FakePage(self.fixtures_dir, self.body_repeat)
+            return {"success": True, "result": {"session": session_id}}
+        if action == "releaseSession":
+            self.sessions.pop(message.get("session"), None)
+            return {"success": True}
+        if action == "sessionStats":
+            return {"success": True, "result": {"inUse": len(self.sessions)}}
+        try:
+            page = self.page(message.get("session"))
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        try:
+            started = time.perf_counter()
+            if action == "executeCode":
+                page.executions += 1
+                # nothing to wait for on a static page, the wait timings are reported as by the console
+                waits = {"waitMs": 0.0, "readyMs": 0.0, "navigationWaitMs": 0.0, "readyTimeouts": 0}
+                try:
+                    execute_code(page, message.get("code", ""))
+                except Exception as e:
+                    return {"success": False, "error": str(e), "timing": {"executeMs": (time.perf_counter() - started) * 1000, **waits}}
+                return {"success": True, "result": None, "timing": {"executeMs": (time.perf_counter() - started) * 1000, **waits}}
+            if action == "fetchHTML":
+                html = page.outline() if message.get("extraction") == "outline" else page.clean_html()
+                timing = {"extractMs": (time.perf_counter() - started) * 1000}
+                if "version" not in message:
+                    return {"success": True, "result": html, "timing": timing}
+                return self._html_delta(page, html, message["version"], timing)
+            if action == "fetchSubtreeHTML":
+                selector = message.get("selector")
+                return {"success": True, "result": page.outline(selector) if message.get("format") == "outline" else page.clean_html(selector)}
+            if action == "fetchViewportHTML":
+                # there is no layout: the whole page is in the viewport
+                return {"success": True, "result": page.outline() if message.get("format") == "outline" else page.clean_html()}
+            if action == "fetchInteractiveHTML":
+                return {"success": True, "result": page.interactive_html()}
+            if action == "pageVersion":
+                return {"success": True, "result": {"url": page.url, "version": page.version()}}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+        return {"success": False, "error": f"Unknown action: {action}"}
+
+    def _html_delta(self, page: FakePage, html: str, client_version: Optional[int], timing: Dict[str, float]) -> Dict[str, Any]:
+        if page.html_snapshot == html and client_version == page.html_version:
+            return {"success": True, "status": "unchanged", "version": page.html_version, "timing": timing}
+        if page.html_snapshot != html:
+            page.html_version = next(self.html_versions)
+            page.html_snapshot = html
+        return {"success": True, "status": "full", "version": page.html_version, "result": html, "timing": timing}
+
+
+class FixtureServer:
+    '''
+    Serves the fixtures over HTTP, e.g. to run the benchmark against the real browser console.
+    Like the stand-in console, /login and /login.html are fixtures/login.html, and other paths are a 404 page.
+    '''
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fixtures_dir: str = FIXTURES_DIR):
+        fixtures = fixtures_dir
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, html = load_page(self.path, fixtures)
+                body = html.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fixture-server", daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    # serve the fixtures with the stand-in console, e.g. to try AutoBrowse without Node:
+    # python fake_console.py [port]
+    import sys
+    console = FakeBrowserConsole(port=int(sys.argv[1]) if len(sys.argv) > 1 else 3000)
+    print(f"Stand-in browser console listening on {console.start()}, pages are served from {console.fixtures_dir}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        console.stop()
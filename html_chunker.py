@@ -0,0 +1,306 @@
+from bisect import bisect_left, bisect_right
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from token_count import num_tokens_from_string, num_tokens_from_strings, token_offsets
+
+CHUNK_SIZE = 15_000 # use a chunk size of 15_000 tokens so that it comfortably fits in the OpenAI API limit of 16_000 tokens
+CHUNK_OVERLAP = 10
+
+
+def _split_boundaries(text: str, chunk_size: int, separator: str) -> Tuple[List[int], List[int], int]:
+    '''
+    Character positions right after every separator (plus the start and end of the text), together with the number of tokens before them,
+    and the number of tokens of the separator.
+    A piece is counted as CharacterTextSplitter counts it: the tokens of its text without the separator, plus those of the separator.
+    Every piece is encoded once on its own, so the count of a span is the sum of the counts of its pieces, which can differ
+    by a few tokens from the count of the span encoded as a whole (e.g. when ">\\n" is a single token).
+    Pieces that are longer than the chunk size get extra boundaries every chunk_size tokens.
+    '''
+    positions = [0]
+    start = text.find(separator)
+    while start != -1:
+        positions.append(start + len(separator))
+        start = text.find(separator, start + len(separator))
+    if positions[-1] != len(text):
+        positions.append(len(text))
+    pieces = [text[start:end - len(separator)] if text.endswith(separator, start, end) else text[start:end]
+              for start, end in zip(positions, positions[1:])]
+    counts = num_tokens_from_strings(pieces)
+    separator_tokens = num_tokens_from_string(separator)
+
+    boundaries = [0]
+    tokens = [0]
+    for piece, start, end, count in zip(pieces, positions, positions[1:], counts):
+        base = tokens[-1]
+        if count > chunk_size:
+            # cut oversized pieces on token boundaries
+            offsets = token_offsets(piece)
+            for cut in range(chunk_size, count, chunk_size):
+                if start + offsets[cut] > boundaries[-1]:
+                    boundaries.append(start + offsets[cut])
+                    tokens.append(base + cut)
+        boundaries.append(end)
+        tokens.append(base + count + separator_tokens)
+    return boundaries, tokens, separator_tokens
+
+
+def get_html_chunk_spans(html: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP,
+                         separator: str = ">") -> List[Tuple[int, int]]:
+    '''
+    Split the HTML into (start, end) character spans cut right after a separator, packed and overlapped as
+    langchain's CharacterTextSplitter(separator, chunk_size, chunk_overlap) packs its chunks, with the same token counts.
+    The spans differ from its chunks only in that (see chunker_test.py):
+    - a span keeps the separator it ends with (not counted in its size, as the splitter drops it),
+    - consecutive separators are kept, where the splitter drops the empty piece between them,
+    - a piece longer than chunk_size is cut on token boundaries, where the splitter makes an oversized chunk of it.
+    Every piece is counted once, so chunking is linear in the size of the document.
+    '''
+    if not html:
+        return []
+    boundaries, tokens, separator_tokens = _split_boundaries(html, chunk_size, separator)
+
+    def size(i: int, j: int) -> int:
+        # tokens of the pieces between boundaries i and j, joined by separators, as counted by the splitter
+        return tokens[j] - tokens[i] - separator_tokens
+
+    last = len(boundaries) - 1
+    spans = []
+    i = 0 # index of the boundary the current chunk starts at
+    j = 1 # index of the boundary the current chunk ends at
+    while i < last:
+        j = max(j, i + 1)
+        while j < last and size(i, j + 1) <= chunk_size:
+            j += 1
+        spans.append((boundaries[i], boundaries[j]))
+        if j == last:
+            break
+        # start the next chunk with the trailing pieces of this one that fit in the overlap,
+        # and leave room for the next piece
+        i += 1
+        while i < j and (size(i, j) > chunk_overlap or size(i, j + 1) > chunk_size):
+            i += 1
+    return spans
+
+
+def get_html_chunks(html: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[str]:
+    '''
+    Split the HTML into chunks of at most chunk_size tokens, cut on tag boundaries.
+    '''
+    chunks = []
+    for start, end in get_html_chunk_spans(html, chunk_size, chunk_overlap):
+        chunk = html[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+
+class _Element:
+    '''
+    An element of the parsed HTML, with the character span it covers in the document.
+    '''
+    __slots__ = ("tag", "attrs", "start", "end", "children", "parent", "nth", "tag_counts")
+
+    def __init__(self, tag: str, attrs: Dict[str, str], start: int, parent: Optional["_Element"] = None):
+        self.tag = tag
+        self.attrs = attrs
+        self.start = start
+        self.end = start
+        self.children = []
+        self.parent = parent
+        self.tag_counts = {} # number of children with a given tag
+        self.nth = 1
+        if parent is not None:
+            parent.children.append(self)
+            self.nth = parent.tag_counts.get(tag, 0) + 1
+            parent.tag_counts[tag] = self.nth
+
+    def css_path(self) -> str:
+        if self.parent is None:
+            return ""
+        element_id = self.attrs.get("id")
+        if element_id:
+            # ids are (supposed to be) unique, so there is no need to go further up the tree
+            return f"{self.tag}#{element_id}"
+        step = self.tag
+        if self.parent.tag_counts[self.tag] > 1:
+            step += f":nth-of-type({self.nth})"
+        parent_path = self.parent.css_path()
+        return f"{parent_path} > {step}" if parent_path else step
+
+    def xpath(self) -> str:
+        if self.parent is None:
+            return ""
+        return f"{self.parent.xpath()}/{self.tag}[{self.nth}]"
+
+
+class _DOMParser(HTMLParser):
+    '''
+    Parses HTML into a tree of _Element, recording where every element starts and ends in the document.
+    '''
+
+    def __init__(self, html: str):
+        super().__init__(convert_charrefs=True)
+        self.html = html
+        self.line_starts = [0]
+        for i, char in enumerate(html):
+            if char == "\n":
+                self.line_starts.append(i + 1)
+        self.root = _Element("", {}, 0)
+        self.stack = [self.root]
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        start = self._offset()
+        element = _Element(tag, {name: value or "" for name, value in attrs}, start, self.stack[-1])
+        element.end = start + len(self.get_starttag_text())
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        start = self._offset()
+        element = _Element(tag, {name: value or "" for name, value in attrs}, start, self.stack[-1])
+        element.end = start + len(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not any(element.tag == tag for element in self.stack[1:]):
+            return # stray end tag
+        start = self._offset()
+        end = self.html.find(">", start) + 1 or len(self.html)
+        # close elements that were left open inside this one
+        while self.stack[-1].tag != tag:
+            self.stack.pop().end = start
+        self.stack.pop().end = end
+
+    def parse(self) -> _Element:
+        self.feed(self.html)
+        self.close()
+        while len(self.stack) > 1:
+            self.stack.pop().end = len(self.html)
+        self.root.end = len(self.html)
+        return self.root
+
+
+def get_dom_chunk_spans(html: str, chunk_size: int = CHUNK_SIZE) -> List[Tuple[int, int, Dict[str, str]]]:
+    '''
+    Split the HTML into (start, end, metadata) spans of at most chunk_size tokens that keep DOM subtrees intact.
+    Consecutive sibling subtrees are packed together as long as they fit, subtrees that do not fit are split
+    recursively along their children. The metadata holds the CSS and XPath paths of the root of the chunk
+    (the parent element when a chunk packs several siblings).
+    '''
+    if not html:
+        return []
+    boundaries, tokens, _ = _split_boundaries(html, chunk_size, ">")
+
+    def num_tokens(start: int, end: int) -> int:
+        # tokens of the tag-delimited pieces overlapping the span
+        first = bisect_right(boundaries, start) - 1
+        last = bisect_left(boundaries, end)
+        return tokens[min(last, len(tokens) - 1)] - tokens[first]
+
+    def metadata(element: _Element) -> Dict[str, str]:
+        return {"css_path": element.css_path(), "xpath": element.xpath()}
+
+    def split(element: _Element) -> List[Tuple[int, int, Dict[str, str]]]:
+        if not element.children:
+            # a leaf that is too large on its own, e.g. a long text: fall back to cutting on tag boundaries
+            return [(element.start + start, element.start + end, metadata(element))
+                    for start, end in get_html_chunk_spans(html[element.start:element.end], chunk_size, CHUNK_OVERLAP)]
+        spans = []
+        group = [] # consecutive children packed in the current chunk
+        group_start = element.start # the first chunk also covers the start tag of the element
+        for child in element.children:
+            if group and num_tokens(group_start, child.end) <= chunk_size:
+                group.append(child)
+                continue
+            if group:
+                spans.append((group_start, child.start, metadata(group[0] if len(group) == 1 else element)))
+                group_start = child.start
+            if num_tokens(group_start, child.end) <= chunk_size:
+                group = [child]
+            elif num_tokens(child.start, child.end) <= chunk_size:
+                # only the text in front of the child does not fit with it
+                spans.append((group_start, child.start, metadata(element)))
+                group_start = child.start
+                group = [child]
+            else:
+                child_spans = split(child)
+                _, end, meta = child_spans[0]
+                child_spans[0] = (group_start, end, meta)
+                spans.extend(child_spans)
+                group_start = child.end
+                group = []
+        if group:
+            # the last chunk also covers the end tag of the element
+            spans.append((group_start, element.end, metadata(group[0] if len(group) == 1 else element)))
+        else:
+            start, _, meta = spans[-1]
+            spans[-1] = (start, element.end, meta)
+        return spans
+
+    root = _DOMParser(html).parse()
+    if num_tokens(root.start, root.end) <= chunk_size:
+        return [(root.start, root.end, metadata(root))]
+    return split(root)
+
+
+def get_html_documents(html: str, chunking: str = "tokens", chunk_size: int = CHUNK_SIZE) -> List[Document]:
+    '''
+    Split the HTML into documents to index, using either the "tokens" or the "dom" chunking mode.
+    The "lines" mode cuts on line boundaries instead of tag boundaries, for page outlines that hold one element per line.
+    The metadata of every document holds the span of the document in the HTML.
+    '''
+    if chunking == "dom":
+        spans = get_dom_chunk_spans(html, chunk_size)
+    elif chunking == "tokens":
+        spans = [(start, end, {}) for start, end in get_html_chunk_spans(html, chunk_size)]
+    elif chunking == "lines":
+        spans = [(start, end, {}) for start, end in get_html_chunk_spans(html, chunk_size, separator="\n")]
+    else:
+        raise ValueError(f"Unknown chunking mode: {chunking}")
+    documents = []
+    for start, end, metadata in spans:
+        content = html[start:end].strip()
+        if content:
+            documents.append(Document(page_content=content, metadata={"start": start, "end": end, **metadata}))
+    return documents
+
+
+def update_html_documents(documents: List[Document], html: str, change: Tuple[int, int, int],
+                          chunk_size: int = CHUNK_SIZE, chunking: str = "tokens") -> List[Document]:
+    '''
+    Update documents chunked with the "tokens" (or "lines") mode after the HTML changed in a single region.
+    change is the changed character range (start, old_end, new_end): the text between start and old_end in the
+    old HTML was replaced by the text between start and new_end in the new one.
+    Documents before the change are kept, documents after it are kept with shifted offsets,
+    and only the region covered by the documents that overlap the change is chunked again.
+    '''
+    start, old_end, new_end = change
+    shift = new_end - old_end
+    before, affected, after = [], [], []
+    for document in documents:
+        if document.metadata["end"] <= start and document.metadata["end"] < old_end:
+            before.append(document)
+        elif document.metadata["start"] >= old_end and document.metadata["start"] > start:
+            after.append(Document(page_content=document.page_content, metadata={
+                **document.metadata,
+                "start": document.metadata["start"] + shift,
+                "end": document.metadata["end"] + shift,
+            }))
+        else:
+            affected.append(document)
+    region_start = min([start] + [document.metadata["start"] for document in affected])
+    region_end = max([old_end] + [document.metadata["end"] for document in affected]) + shift
+    region = get_html_documents(html[region_start:region_end], chunking, chunk_size)
+    for document in region:
+        document.metadata["start"] += region_start
+        document.metadata["end"] += region_start
+    return before + region + after
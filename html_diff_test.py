@@ -0,0 +1,135 @@
+import asyncio
+import glob
+import json
+import os
+import random
+import subprocess
+
+from retrieve_html_proxy_agent import RetrieveHTMLProxyAgent, apply_html_diff
+
+# checks that apply_html_diff applies the diffs made by diffLines of the browser console (browser-console/diff.js)
+# exactly, and the versioned protocol of RetrieveHTMLProxyAgent.fetch_html ("unchanged", "diff" or "full" replies)
+# usage: python html_diff_test.py (needs node, but not the dependencies of the browser console)
+
+BROWSER_CONSOLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser-console")
+
+
+def diff_lines(pairs):
+    '''
+    The diffs of (old, new) documents made by diffLines, as console.js makes them
+    '''
+    script = """
+const { diffLines } = require('./diff');
+let input = '';
+process.stdin.on('data', (data) => { input += data; });
+process.stdin.on('end', () => {
+  const pairs = JSON.parse(input);
+  process.stdout.write(JSON.stringify(pairs.map(([before, after]) => diffLines(before.split('\\n'), after.split('\\n')))));
+});
+"""
+    result = subprocess.run(["node", "-e", script], input=json.dumps(pairs), capture_output=True, text=True, cwd=BROWSER_CONSOLE_DIR, check=True)
+    return json.loads(result.stdout)
+
+
+def edited(html: str, rng: random.Random) -> str:
+    '''
+    The HTML with a few lines inserted, deleted or replaced
+    '''
+    lines = html.split("\n")
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randint(0, len(lines))
+        edit = rng.choice(["insert", "delete", "replace"])
+        if edit == "insert":
+            lines[position:position] = [f'<div class="banner-{rng.randint(0, 99)}">new</div>'] * rng.randint(1, 3)
+        elif edit == "delete":
+            del lines[position:position + rng.randint(1, 5)]
+        else:
+            lines[position:position + 1] = [f"<p>changed {rng.randint(0, 99)}</p>"]
+    return "\n".join(lines)
+
+
+def cases():
+    pairs = [
+        ("", ""),
+        ("", "<p>a</p>"),
+        ("<p>a</p>", ""),
+        ("<p>a</p>", "<p>a</p>"),
+        ("<p>a</p>\n<p>b</p>", "<p>a</p>\n<p>b</p>\n"), # a trailing newline appears
+        ("<p>a</p>\n<p>b</p>\n", "<p>a</p>\n<p>b</p>"), # and disappears
+        ("<p>a</p>\n<p>b</p>\n<p>c</p>", "<p>x</p>\n<p>b</p>\n<p>c</p>"), # first line
+        ("<p>a</p>\n<p>b</p>\n<p>c</p>", "<p>a</p>\n<p>b</p>\n<p>x</p>"), # last line
+        ("<p>a</p>\n<p>b</p>\n<p>c</p>", "<p>a</p>\n<p>c</p>"), # deleted line
+        ("<p>a</p>\n<p>b</p>", "<p>a</p>\n<p>x</p>\n<p>y</p>\n<p>b</p>"), # inserted lines
+        ("<p>a</p>\n<p>a</p>\n<p>a</p>", "<p>a</p>\n<p>a</p>"), # repeated lines
+        ("<ul>\n<li>é</li>\n</ul>", "<ul>\n<li>é</li>\n<li>日本</li>\n</ul>"), # non-ASCII text
+    ]
+    rng = random.Random(0)
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "*.html"))):
+        with open(filename, "r") as f:
+            html = f.read()
+        for _ in range(20):
+            pairs.append((html, edited(html, rng)))
+    return pairs
+
+
+def check_apply_html_diff():
+    pairs = cases()
+    for (before, after), diff in zip(pairs, diff_lines(pairs)):
+        html, (start, old_end, new_end) = apply_html_diff(before, diff)
+        assert html == after, (before, after, diff, html)
+        # the change range covers what changed, and only the lines of the diff
+        assert 0 <= start <= old_end <= len(before) and start <= new_end <= len(after), (before, after, diff, (start, old_end, new_end))
+        assert before[:start] + after[start:new_end] + before[old_end:] == after, (before, after, diff, (start, old_end, new_end))
+    print(f"apply_html_diff: {len(pairs)} diffs of diffLines applied exactly")
+
+
+class ScriptedConsole:
+    '''
+    Stands in for the browser console: replies to fetchHTML with the given replies in order, and records the versions asked for
+    '''
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.versions = []
+
+    def connect(self):
+        pass
+
+    async def request(self, action: str, timeout=None, **params):
+        assert action == "fetchHTML", action
+        self.versions.append(params.get("version"))
+        return self.replies.pop(0)
+
+
+def check_fetch_html():
+    first = "<html>\n<body>\n<p>a</p>\n</body>\n</html>"
+    second = "<html>\n<body>\n<p>a</p>\n<p>b</p>\n</body>\n</html>"
+    third = "<html>\n<body>\n<p>c</p>\n</body>\n</html>"
+    diff, = diff_lines([(first, second)])
+    console = ScriptedConsole([
+        {"success": True, "status": "full", "version": 1, "result": first},
+        {"success": True, "status": "unchanged", "version": 1},
+        {"success": True, "status": "diff", "base": 1, "version": 2, "diff": diff},
+        # a diff against a version the agent does not hold: it asks again for a full snapshot
+        {"success": True, "status": "diff", "base": 1, "version": 3, "diff": diff},
+        {"success": True, "status": "full", "version": 3, "result": third},
+    ])
+    proxy = RetrieveHTMLProxyAgent(name="html_user_proxy", human_input_mode="NEVER", browser_console=console, retrieval="bm25")
+
+    async def fetches():
+        assert await proxy.fetch_html() == first and proxy.page_html_change is None
+        assert await proxy.fetch_html() == first and proxy.page_html_change == (0, 0, 0)
+        assert await proxy.fetch_html() == second and proxy.previous_page_html == first
+        start, old_end, new_end = proxy.page_html_change
+        assert first[:start] + second[start:new_end] + first[old_end:] == second, proxy.page_html_change
+        assert await proxy.fetch_html() == third and proxy.page_html_change is None
+        assert proxy.page_html_version == 3
+
+    asyncio.run(fetches())
+    assert console.versions == [None, 1, 1, 2, None], console.versions
+    print("fetch_html: unchanged, diff and full replies, and a diff against an unknown version, handled")
+
+
+if __name__ == "__main__":
+    check_apply_html_diff()
+    check_fetch_html()
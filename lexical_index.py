@@ -0,0 +1,158 @@
+import functools
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from embedding_cache import CachedEmbeddings
+
+# attributes whose values name the element, e.g. <input id="searchInput" placeholder="Search">
+INDEXED_ATTRIBUTES = {"id", "name", "class", "placeholder", "type"}
+
+STOPWORDS = {"a", "an", "the", "of", "for", "to", "in", "on", "at", "and", "or", "is", "are", "be", "with", "from", "by",
+             "it", "its", "this", "that", "what", "which", "where", "how", "me", "my", "i", "you", "please", "can",
+             "page", "current", "html", "element", "elements", "find", "get", "extract", "return", "give", "show"}
+
+TAG_PATTERN = re.compile(r"<([a-zA-Z][\w-]*)")
+ATTRIBUTE_PATTERN = re.compile(r"""\s(?:%s)\s*=\s*(?:"([^"]*)"|'([^']*)')""" % "|".join(INDEXED_ATTRIBUTES), re.IGNORECASE)
+MARKUP_PATTERN = re.compile(r"<[^>]*>")
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[-_]?[A-Za-z0-9]+)*")
+# words, also splitting camelCase identifiers like searchInput
+WORD_PATTERN = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def _normalize(word: str) -> str:
+    word = word.lower()
+    # crude plural stripping so that "cookies" matches "cookie"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+@functools.lru_cache(maxsize=100_000)
+def _identifier_tokens(identifier: str) -> Tuple[str, ...]:
+    # pages repeat the same words and attribute values over and over, so this is cached
+    words = WORD_PATTERN.findall(identifier)
+    tokens = [_normalize(word) for word in words]
+    if len(words) > 1:
+        # compound identifiers also match their joined form, e.g. "sign-up" matches "signup"
+        tokens.append(_normalize("".join(words)))
+    return tuple(token for token in tokens if token not in STOPWORDS)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        tokens.extend(_identifier_tokens(identifier))
+    return tokens
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze_html(html: str) -> Tuple[List[str], List[str]]:
+    '''
+    Split HTML into the tokens of its text content and the tokens of its structure
+    (tag names and the values of the indexed attributes).
+    Cached, so that only the chunks that changed since the page was last indexed are analyzed again.
+    '''
+    structure = [tag.lower() for tag in TAG_PATTERN.findall(html)]
+    structure.extend(tokenize(" ".join(double + single for double, single in ATTRIBUTE_PATTERN.findall(html))))
+    text = tokenize(MARKUP_PATTERN.sub(" ", html))
+    return text, structure
+
+
+class _Field:
+    '''
+    BM25 statistics of one field (text or structure) of the indexed documents.
+    '''
+
+    def __init__(self, documents_tokens: List[List[str]]):
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths = [len(tokens) for tokens in documents_tokens]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        for i, tokens in enumerate(documents_tokens):
+            for term, frequency in Counter(tokens).items():
+                self.postings[term].append((i, frequency))
+
+    def score(self, terms: List[str], scores: Dict[int, float], weight: float, k1: float, b: float):
+        n = len(self.lengths)
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log((n - len(postings) + 0.5) / (len(postings) + 0.5) + 1)
+            for i, frequency in postings:
+                norm = k1 * (1 - b + b * self.lengths[i] / self.average_length) if self.average_length else k1
+                scores[i] += weight * idf * frequency * (k1 + 1) / (frequency + norm)
+
+
+class BM25Index:
+    '''
+    A local lexical/structural retrieval index over HTML chunks.
+    Chunks are indexed by the words of their text and by their tag names and id/name/class/placeholder/type
+    attribute values, and scored against the query with BM25. No network calls are needed to build or query it.
+    If embeddings are given, the best BM25 matches are re-ranked with the embeddings of the chunks that are
+    already in the embedding cache (hybrid retrieval).
+    Exposes the same similarity_search method as langchain's vectorstores.
+    '''
+
+    def __init__(self, documents: List[Document], embeddings: Optional[CachedEmbeddings] = None,
+                 structure_weight: float = 2.0, k1: float = 1.5, b: float = 0.75,
+                 rerank_top_n: int = 20, rerank_weight: float = 0.5):
+        self.documents = documents
+        self.embeddings = embeddings
+        self.structure_weight = structure_weight
+        self.k1 = k1
+        self.b = b
+        self.rerank_top_n = rerank_top_n
+        self.rerank_weight = rerank_weight
+        analyzed = [analyze_html(document.page_content) for document in documents]
+        self.text = _Field([text for text, _ in analyzed])
+        self.structure = _Field([structure for _, structure in analyzed])
+
+    def scores(self, query: str) -> Dict[int, float]:
+        terms = tokenize(query)
+        scores = defaultdict(float)
+        self.text.score(terms, scores, 1.0, self.k1, self.b)
+        self.structure.score(terms, scores, self.structure_weight, self.k1, self.b)
+        return scores
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        scores = self.scores(query)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if self.embeddings is not None:
+            ranked = self._rerank(query, ranked[:self.rerank_top_n]) + ranked[self.rerank_top_n:]
+        if not ranked:
+            # nothing matched, fall back to the first chunks of the page
+            ranked = [(i, 0.0) for i in range(min(k, len(self.documents)))]
+        return [(self.documents[i], score) for i, score in ranked[:k]]
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k)]
+
+    def _rerank(self, query: str, ranked: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        '''
+        Combine the BM25 scores with the cosine similarity of the query and the cached chunk embeddings.
+        Nothing is sent for embedding but the query, and only if some of the chunks have cached embeddings.
+        '''
+        vectors = {i: self.embeddings.cached_vector(self.documents[i].page_content) for i, _ in ranked}
+        vectors = {i: vector for i, vector in vectors.items() if vector is not None}
+        if not vectors:
+            return ranked
+        query_vector = self.embeddings.embed_query(query)
+        similarities = {i: _cosine(query_vector, vector) for i, vector in vectors.items()}
+        # chunks without a cached embedding get the average similarity
+        default_similarity = sum(similarities.values()) / len(similarities)
+        best = ranked[0][1] or 1.0
+        combined = [
+            (i, (1 - self.rerank_weight) * score / best + self.rerank_weight * similarities.get(i, default_similarity))
+            for i, score in ranked
+        ]
+        return sorted(combined, key=lambda item: item[1], reverse=True)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
@@ -0,0 +1,173 @@
+import re
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import autogen
+from autogen import ConversableAgent
+from autogen.agentchat.agent import Agent
+
+from token_count import num_tokens_from_string
+
+# kinds of step of the code generator, guessed from the request of the planner
+# (a request matching several kinds is "multi", one matching none is "other")
+STEP_TYPES = {
+    "navigate": re.compile(r"\b(go to|goto|navigate|open|visit)\b|https?://", re.IGNORECASE),
+    "click": re.compile(r"\b(click|press|tap|accept|agree|dismiss|close)\b", re.IGNORECASE),
+    "type": re.compile(r"\b(type|fill|enter|write|search for)\b", re.IGNORECASE),
+    "select": re.compile(r"\b(select|choose|pick|sort)\b", re.IGNORECASE),
+    "scroll": re.compile(r"\bscroll\b", re.IGNORECASE),
+}
+
+
+def step_type(message: str) -> str:
+    kinds = [kind for kind, pattern in STEP_TYPES.items() if pattern.search(message)]
+    if len(kinds) == 1:
+        return kinds[0]
+    return "multi" if kinds else "other"
+
+
+def is_failed_execution(message: Dict) -> bool:
+    '''
+    Whether the reply of the executor reports a failed execution, or no execution at all
+    (the code generator replied without code and without TERMINATE)
+    '''
+    return not (message.get("content") or "").startswith("exitcode: 0")
+
+
+class ModelCascade:
+    '''
+    Routes the LLM calls of an agent through a cascade of models, from the fastest to the strongest.
+    A request starts at the model routed to for its step type (the first model if its type has no route), skipping
+    the models whose max_prompt_tokens the prompt exceeds, and escalates to the next model of the cascade if it fails.
+    With escalate_on="execution" (the code generator) the chat stops after a failed execution so that the caller
+    retries the step with the next model (see use), with escalate_on="reply" an empty reply is generated again
+    by the next model.
+    Attempts, successes and latency are recorded per model and step type, to tune the cascade.
+    '''
+
+    def __init__(self, models: List[str], routes: Optional[Dict[str, str]] = None, max_prompt_tokens: Optional[Dict[str, int]] = None, escalate_on: str = "reply"):
+        if escalate_on not in ("execution", "reply"):
+            raise ValueError(f"Unknown escalation condition: {escalate_on}")
+        self.config_lists = {}
+        for model in models:
+            config_list = autogen.config_list_from_json(
+                "OAI_CONFIG_LIST",
+                file_location=".",
+                filter_dict={
+                    "model": {
+                        model,
+                    }
+                },
+            )
+            if config_list:
+                self.config_lists[model] = config_list
+        missing = [model for model in models if model not in self.config_lists]
+        if missing:
+            raise ValueError(f"Models of the cascade are not in OAI_CONFIG_LIST: {missing}. Add them to OAI_CONFIG_LIST or remove them from the cascade")
+        if not models:
+            raise ValueError("The cascade has no models")
+        self.models = list(models)
+        self.routes = routes or {}
+        self.max_prompt_tokens = max_prompt_tokens or {}
+        self.escalate_on = escalate_on
+        # model of the current attempt, and whether a failed attempt escalates (escalate_on="execution")
+        self.model = None
+        self.can_escalate = False
+        self.attempts = defaultdict(lambda: {"attempts": 0, "successes": 0, "total_s": 0.0})
+        self.escalations = defaultdict(int)
+
+    def register(self, agent: ConversableAgent, generate_reply: Callable):
+        '''
+        Route the LLM replies of the agent, generated by generate_reply (one of its async reply functions)
+        '''
+        self.generate_reply = generate_reply
+        functions = [reply_func_tuple["reply_func"] for reply_func_tuple in agent._reply_func_list]
+        position = functions.index(generate_reply) if generate_reply in functions else 0
+        agent.register_reply([Agent, None], self.a_generate_reply, position=position)
+
+    def route(self, kind: str, prompt_tokens: int) -> List[str]:
+        '''
+        Models to try in order for a request of the given step type and prompt size
+        '''
+        first = self.routes.get(kind, self.routes.get("default"))
+        start = self.models.index(first) if first in self.models else 0
+        models = [model for model in self.models[start:] if prompt_tokens <= self.max_prompt_tokens.get(model, prompt_tokens)]
+        return models or self.models[-1:]
+
+    def use(self, model: Optional[str], can_escalate: bool = False):
+        '''
+        Generate the replies of the next chat with model (None to leave the replies to the agent's own model).
+        If can_escalate, the chat stops after a failed execution, for the caller to retry with the next model.
+        '''
+        self.model = model
+        self.can_escalate = can_escalate
+
+    def llm_config(self, llm_config: Dict[str, Any], model: str) -> Dict[str, Any]:
+        return {**llm_config, "config_list": self.config_lists[model]}
+
+    async def a_generate_reply(
+        self,
+        recipient: ConversableAgent,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[Any] = None,
+    ) -> Tuple[bool, Union[str, Dict, None]]:
+        llm_config = recipient.llm_config if config is None else config
+        if llm_config is False:
+            return False, None
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        if self.escalate_on == "execution":
+            if self.model is None:
+                return False, None
+            if self.can_escalate and len(messages) > 1 and is_failed_execution(messages[-1]):
+                # ends the chat, the step is retried with the next model
+                return True, None
+            return await self.generate_reply(recipient, messages, sender, self.llm_config(llm_config, self.model))
+
+        prompt_tokens = sum(num_tokens_from_string(message.get("content") or "") for message in recipient._oai_system_message + messages)
+        models = self.route("default", prompt_tokens)
+        for i, model in enumerate(models):
+            started = time.perf_counter()
+            final, reply = await self.generate_reply(recipient, messages, sender, self.llm_config(llm_config, model))
+            succeeded = bool(reply.get("content") or reply.get("function_call")) if isinstance(reply, dict) else bool(reply and reply.strip())
+            self.record(model, "default", succeeded, time.perf_counter() - started)
+            if succeeded or i == len(models) - 1:
+                return final, reply
+            self.escalate(recipient.name, model, models[i + 1])
+        return False, None
+
+    def record(self, model: str, kind: str, succeeded: bool, duration: float):
+        for key in (model, (model, kind)):
+            attempts = self.attempts[key]
+            attempts["attempts"] += 1
+            attempts["successes"] += int(succeeded)
+            attempts["total_s"] += duration
+
+    def escalate(self, agent_name: str, model: str, next_model: str):
+        print(f"{agent_name}: {model} failed, escalating to {next_model}")
+        self.escalations[(model, next_model)] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        '''
+        Attempts, success rate and mean latency per model (and per step type of each model), and escalations
+        '''
+        def summary(attempts):
+            return {
+                "attempts": attempts["attempts"],
+                "successes": attempts["successes"],
+                "success_rate": round(attempts["successes"] / attempts["attempts"], 3),
+                "mean_latency_s": round(attempts["total_s"] / attempts["attempts"], 3),
+            }
+
+        models = {}
+        for model in self.models:
+            if model not in self.attempts:
+                continue
+            models[model] = summary(self.attempts[model])
+            models[model]["step_types"] = {key[1]: summary(attempts) for key, attempts in self.attempts.items() if isinstance(key, tuple) and key[0] == model}
+        return {
+            "models": models,
+            "escalations": {f"{model} -> {next_model}": count for (model, next_model), count in self.escalations.items()},
+        }
@@ -0,0 +1,122 @@
+import copy
+import json
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from autogen import ConversableAgent
+from autogen.agentchat.agent import Agent
+
+from async_replies import a_generate_oai_reply
+from token_count import num_tokens_from_message, num_tokens_from_string
+
+DEFAULT_TOKEN_BUDGET = 6_000 # tokens of the conversation sent to the planner (without the system message)
+DEFAULT_KEEP_RECENT_HTML = 1 # most recent HTML payloads sent in full
+
+
+message_tokens = num_tokens_from_message
+
+
+class PlannerMemory:
+    '''
+    Keeps the conversation sent to the planner within a token budget.
+    The HTML returned by ask_html_assistant (and ask_html_assistant_batch), and echoed back to ask_code_generator as context_html, is only useful
+    for the next steps: all but the most recent keep_recent_html payloads are replaced by short references.
+    If the conversation still exceeds token_budget tokens, the oldest turns (after the task) are left out.
+    The chat history itself is kept whole, only the prompts are compacted.
+    '''
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, keep_recent_html: int = DEFAULT_KEEP_RECENT_HTML):
+        self.token_budget = token_budget
+        self.keep_recent_html = keep_recent_html
+        # tokens of the conversation and of the prompt sent, per planner turn
+        self.conversation_tokens: List[int] = []
+        self.prompt_tokens: List[int] = []
+
+    def register(self, planner: ConversableAgent):
+        '''
+        Compact the prompts of the planner in async chats, before its LLM reply
+        '''
+        functions = [reply_func_tuple["reply_func"] for reply_func_tuple in planner._reply_func_list]
+        position = functions.index(a_generate_oai_reply) if a_generate_oai_reply in functions else 0
+        planner.register_reply([Agent, None], self.a_generate_reply, position=position)
+
+    async def a_generate_reply(
+        self,
+        recipient: ConversableAgent,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[Any] = None,
+    ) -> Tuple[bool, Union[str, Dict, None]]:
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        return await a_generate_oai_reply(recipient, self.compact(messages), sender, config)
+
+    def compact(self, messages: List[Dict]) -> List[Dict]:
+        conversation_tokens = [message_tokens(message) for message in messages]
+        messages = self._evict_html(messages)
+        tokens = [message_tokens(message) for message in messages]
+        messages, tokens = self._fit_budget(messages, tokens)
+        self.conversation_tokens.append(sum(conversation_tokens))
+        self.prompt_tokens.append(sum(tokens))
+        return messages
+
+    def _evict_html(self, messages: List[Dict]) -> List[Dict]:
+        # indices of the messages carrying HTML, most recent last
+        html_indices = [i for i, message in enumerate(messages) if self._html_payload(message) is not None]
+        stale = html_indices[:max(len(html_indices) - self.keep_recent_html, 0)]
+        if not stale:
+            return messages
+        messages = list(messages)
+        for i in stale:
+            message = copy.deepcopy(messages[i])
+            if message.get("role") == "function":
+                reference = f"[HTML returned by {message['name']} at step {i}, {message_tokens(message)} tokens, omitted]"
+                message["content"] = reference
+            else:
+                arguments = json.loads(message["function_call"]["arguments"])
+                reference = f"[HTML context at step {i}, {num_tokens_from_string(arguments['context_html'])} tokens, omitted]"
+                arguments["context_html"] = reference
+                message["function_call"]["arguments"] = json.dumps(arguments)
+            messages[i] = message
+        return messages
+
+    def _html_payload(self, message: Dict) -> Optional[str]:
+        if message.get("role") == "function" and message.get("name") in ("ask_html_assistant", "ask_html_assistant_batch"):
+            return message.get("content")
+        function_call = message.get("function_call")
+        if function_call and function_call.get("name") == "ask_code_generator":
+            try:
+                arguments = json.loads(function_call.get("arguments", "{}"))
+            except json.JSONDecodeError:
+                return None
+            return arguments.get("context_html") or None
+        return None
+
+    def _fit_budget(self, messages: List[Dict], tokens: List[int]) -> Tuple[List[Dict], List[int]]:
+        if sum(tokens) <= self.token_budget or len(messages) <= 2:
+            return messages, tokens
+        # the first message (the task) and the last turn are always sent
+        first, rest, rest_tokens = messages[0], messages[1:], tokens[1:]
+        omitted = 0
+        while len(rest) > 1 and tokens[0] + sum(rest_tokens) > self.token_budget:
+            rest, rest_tokens = rest[1:], rest_tokens[1:]
+            omitted += 1
+            # a function result is not sent without the function call it answers
+            while len(rest) > 1 and rest[0].get("role") == "function":
+                rest, rest_tokens = rest[1:], rest_tokens[1:]
+                omitted += 1
+        note = {"role": "user", "content": f"[{omitted} earlier messages of this task omitted]"}
+        return [first, note] + rest, [tokens[0], message_tokens(note)] + rest_tokens
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Prompt sizes of the planner per turn, and tokens saved compared to sending the whole conversation
+        '''
+        turns = len(self.prompt_tokens)
+        return {
+            "turns": turns,
+            "conversation_tokens": sum(self.conversation_tokens),
+            "prompt_tokens": sum(self.prompt_tokens),
+            "saved_tokens": sum(self.conversation_tokens) - sum(self.prompt_tokens),
+            "last_prompt_tokens": self.prompt_tokens[-1] if turns else 0,
+            "max_prompt_tokens": max(self.prompt_tokens) if turns else 0,
+        }
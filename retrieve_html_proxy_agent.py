@@ -1,35 +1,106 @@
 import asyncio
-import json
-from typing import Any, Callable, Dict, List, Optional, Union
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import autogen
 
 from dotenv import load_dotenv
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.embeddings import OpenAIEmbeddings
 from langchain.vectorstores import FAISS
+from langchain.docstore.document import Document
 from autogen.agentchat.agent import Agent
 from token_count import num_tokens_from_string
+from html_chunker import get_html_documents, update_html_documents
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from lexical_index import BM25Index
+from browser_console_client import BrowserConsoleClient
+from tracing import span
 
-import websockets
+def build_vectorstore(html_chunks: [str], embeddings: Optional[CachedEmbeddings] = None, metadatas: Optional[List[Dict]] = None):
+    '''
+    Build a FAISS index over the chunks. Vectors of chunks seen before come from the embedding cache,
+    so only new chunks are sent for embedding.
+    '''
+    if embeddings is None:
+        embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectors = embeddings.embed_documents(html_chunks)
+    vectorstore = FAISS.from_embeddings(text_embeddings=list(zip(html_chunks, vectors)), embedding=embeddings, metadatas=metadatas)
+    return vectorstore
 
-CHUNK_SIZE = 15_000 # use a chunk size of 15_000 tokens so that it comfortably fits in the OpenAI API limit of 16_000 tokens
 
-def get_html_chunks(html: str):
-    text_splitter = CharacterTextSplitter(
-        separator=">",
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=10,
-        length_function=num_tokens_from_string # use OpenAI's tokenizer to count tokens
-    )
-    chunks = text_splitter.split_text(html)
-    return chunks
+def apply_html_diff(html: str, diff: Dict) -> Tuple[str, Tuple[int, int, int]]:
+    '''
+    Apply a line-based diff from the browser console ({start, deleteCount, insert}) to the HTML.
+    Returns the new HTML and the changed character range (start, old_end, new_end).
+    '''
+    lines = html.split("\n")
+    start_line, delete_count = diff["start"], diff["deleteCount"]
+    start = sum(len(line) + 1 for line in lines[:start_line])
+    old_end = start + sum(len(line) + 1 for line in lines[start_line:start_line + delete_count])
+    reaches_end = start_line + delete_count >= len(lines)
+    lines[start_line:start_line + delete_count] = diff["insert"]
+    new_html = "\n".join(lines)
+    if reaches_end:
+        # the last line has no trailing newline: the change starts at the newline in front of the changed lines
+        return new_html, (max(start - 1, 0), len(html), len(new_html))
+    return new_html, (start, old_end, start + sum(len(line) + 1 for line in diff["insert"]))
 
 
-# TODO : avoid recomputing embeddings for html chunks that have not changes
-def build_vectorstore(html_chunks: [str]):
-    embeddings = OpenAIEmbeddings()
-    vectorstore = FAISS.from_texts(texts=html_chunks, embedding=embeddings)
-    return vectorstore
+def pack_context(html: str, fragments: List[Document], token_budget: int) -> List[Tuple[int, int, List[Dict]]]:
+    '''
+    Pack the highest ranked fragments of the HTML into the token budget.
+    Duplicate fragments are dropped, and fragments that overlap or are adjacent in the page are merged.
+    Returns the (start, end, metadatas) spans of the packed context, in page order.
+    '''
+    selected = []
+    used_tokens = 0
+    for fragment in fragments:
+        start, end = fragment.metadata["start"], fragment.metadata["end"]
+        if any(selected_start <= start and end <= selected_end for selected_start, selected_end, _ in selected):
+            continue # duplicate
+        tokens = num_tokens_from_string(fragment.page_content)
+        if used_tokens + tokens > token_budget:
+            continue # a lower ranked but smaller fragment may still fit
+        selected.append((start, end, fragment.metadata))
+        used_tokens += tokens
+    selected.sort(key=lambda span: span[0])
+    merged = []
+    for start, end, metadata in selected:
+        if merged and (start <= merged[-1][1] or not html[merged[-1][1]:start].strip()):
+            previous_start, previous_end, metadatas = merged[-1]
+            merged[-1] = (previous_start, max(previous_end, end), metadatas + [metadata])
+        else:
+            merged.append((start, end, [metadata]))
+    return merged
+
+
+# a CSS selector quoted in the question, e.g. `form.login`, or an id selector like #searchInput
+QUOTED_SELECTOR_PATTERN = re.compile(r"`([^`]+)`")
+ID_SELECTOR_PATTERN = re.compile(r"(?<![\w&])([a-z]*#[A-Za-z_][\w-]*)")
+# questions about elements the user interacts with
+INTERACTIVE_PATTERN = re.compile(
+    r"\b(input|button|link|field|form|text ?box|search ?box|select|dropdown|drop-down|checkbox|radio|textarea|"
+    r"submit|click|type|login|log in|sign in|sign up|menu|option|tab)s?\b", re.IGNORECASE)
+# questions about what is currently shown to the user
+VIEWPORT_PATTERN = re.compile(
+    r"\b(visible|on (the )?screen|viewport|popup|pop-up|banner|modal|dialog|overlay|cookie|notice)s?\b", re.IGNORECASE)
+
+
+def html_scopes_for_question(question: str, scopes: List[str]) -> List[Tuple[str, Optional[str]]]:
+    '''
+    The scoped parts of the page that may answer the question, narrowest first, as (scope, selector) pairs:
+    the subtree of a selector named in the question, the interactive elements, or the elements in the viewport.
+    '''
+    candidates = []
+    if "subtree" in scopes:
+        selectors = QUOTED_SELECTOR_PATTERN.findall(question) or ID_SELECTOR_PATTERN.findall(question)
+        candidates.extend(("subtree", selector) for selector in selectors)
+    if "interactive" in scopes and INTERACTIVE_PATTERN.search(question):
+        candidates.append(("interactive", None))
+    if "viewport" in scopes and VIEWPORT_PATTERN.search(question):
+        candidates.append(("viewport", None))
+    return candidates
+
 
 load_dotenv()
 
@@ -42,6 +113,43 @@ User's question is: {input_question}
 Context is: {input_context}
 """
 
+PROMPT_QA_OUTLINE = """You're a retrieve augmented chatbot. You answer user's questions based on the outline
+of a web page provided by the user. The outline lists one element of the page per line, with its role, name,
+value and a reference like [ref=12]. You must answer as concisely as possible, with the lines of the relevant elements.
+
+User's question is: {input_question}
+
+Context is: {input_context}
+"""
+
+PROMPT_QA_BATCH = """You're a retrieve augmented chatbot. You answer several questions of the user based on the contexts
+provided by the user: parts of the HTML of a web page, or of an outline of the page that lists one element per line
+with its role, name, value and a reference like [ref=12]. You must answer each question as concisely as possible,
+from the context it names, and start the answer to each question with a line "ANSWER <number of the question>:".
+
+{input_contexts}
+
+User's questions are:
+{input_questions}
+"""
+
+BATCH_ANSWER_PATTERN = re.compile(r"^\s*ANSWER (\d+):[ \t]*", re.MULTILINE)
+
+
+def parse_batch_answers(reply: str, n_questions: int) -> Dict[int, str]:
+    '''
+    The answers of a reply to a batch of questions, by number of the question (from 1). Missing or empty answers are left out.
+    '''
+    parts = BATCH_ANSWER_PATTERN.split(reply)
+    answers = {}
+    # parts are: text before the first answer, then the number and the text of each answer
+    for number, answer in zip(parts[1::2], parts[2::2]):
+        number = int(number)
+        if 1 <= number <= n_questions and answer.strip() and number not in answers:
+            answers[number] = answer.strip()
+    return answers
+
+
 class RetrieveHTMLProxyAgent(autogen.ConversableAgent):
     '''
     An agent that fetches the relevant HTML content from a user query based 
@@ -60,6 +168,17 @@ class RetrieveHTMLProxyAgent(autogen.ConversableAgent):
         llm_config: Optional[Union[Dict, bool]] = False,
         system_message: Optional[str] = "",
         browser_console_uri: Optional[str] = "ws://localhost:3000",
+        browser_console: Optional[BrowserConsoleClient] = None,
+        embedding_cache_config: Optional[Dict] = None,
+        chunking: Optional[str] = "tokens",
+        retrieval: Optional[str] = "faiss",
+        context_token_budget: Optional[int] = 4_000,
+        fragment_size: Optional[int] = 800,
+        html_extraction: Optional[str] = "inpage",
+        html_scopes: Optional[List[str]] = None,
+        page_format: Optional[str] = "html",
+        prefetch_config: Optional[Dict] = None,
+        batch_config: Optional[Dict] = None,
     ):
         super().__init__(
             name=name,
@@ -73,62 +192,405 @@ class RetrieveHTMLProxyAgent(autogen.ConversableAgent):
             system_message=system_message,
         )
         self.browser_console_uri = browser_console_uri
-        self.connect_websocket()
+        # the connection to the browser console, shared with the other agents if it is given
+        self.browser_console = browser_console if browser_console is not None else BrowserConsoleClient(browser_console_uri)
+        self.browser_console.connect()
         self.html = ""
         self.vectorstore = None
+        self.html_chunks = []
+        # latest HTML received from the browser console and its version there,
+        # with the character range (start, old_end, new_end) changed since the previous one
+        self.page_html = ""
+        self.page_html_version = None
+        self.page_html_change = None
+        self.previous_page_html = None
+        # how the browser console extracts the HTML: "inpage" (single traversal inside the page) or "jsdom"
+        self.html_extraction = html_extraction
+        # "html" or "outline", a compact outline of the page with one element per line and a reference to it
+        self.page_format = page_format
+        # "tokens" cuts the HTML on tag boundaries, "dom" keeps whole subtrees together
+        self.chunking = chunking
+        # "faiss" retrieves chunks with OpenAI embeddings, "bm25" with a local lexical index,
+        # and "hybrid" re-ranks the BM25 results with the embeddings that are already cached
+        self.retrieval = retrieval
+        # pages larger than the budget are split into fragments of fragment_size tokens,
+        # and the most relevant fragments are packed into the budget
+        self.context_token_budget = context_token_budget
+        self.fragment_size = fragment_size
+        # scoped parts of the page ("subtree", "interactive", "viewport") tried before retrieving from the full page
+        self.html_scopes = html_scopes if html_scopes is not None else []
+        # number of tokens of the context sent with each question, and the part of the page it came from
+        self.context_tokens = []
+        self.context_scopes = Counter()
+        self.embedding_cache = EmbeddingCache(**(embedding_cache_config or {}))
+        self.embeddings = None
+        # after the browser executed code, the new page is fetched and indexed in the background once it stops changing
+        # (its version is the same settle_delay seconds apart, or max_settle_time seconds have passed)
+        prefetch_config = prefetch_config or {}
+        self.prefetch_enabled = prefetch_config.get("enabled", False)
+        self.prefetch_settle_delay = prefetch_config.get("settle_delay", 0.5)
+        self.prefetch_max_settle_time = prefetch_config.get("max_settle_time", 5.0)
+        self.prefetch_task = None
+        self.prefetch_settling = False
+        # version of the page HTML indexed by the last prefetch
+        self.prefetched_version = None
+        self.prefetch_counts = Counter()
+        # the page HTML and its index are updated by one task at a time (created on the event loop the agents run on)
+        self.page_lock = None
+        # questions asked together are packed into prompts of at most max_questions questions and token_budget context tokens
+        batch_config = batch_config or {}
+        self.batch_max_questions = batch_config.get("max_questions", 8)
+        self.batch_token_budget = batch_config.get("token_budget", 8_000)
+
+    def _get_embeddings(self) -> CachedEmbeddings:
+        # created lazily since OpenAIEmbeddings requires the OpenAI API key to be set
+        if self.embeddings is None:
+            self.embeddings = CachedEmbeddings(OpenAIEmbeddings(), self.embedding_cache)
+        return self.embeddings
+
+    def embedding_cache_stats(self) -> Dict[str, float]:
+        '''
+        Hit rate of the embedding cache and the number of embedding calls saved
+        '''
+        return self.embedding_cache.stats()
 
-    def connect_websocket(self):
-        self.websocket = asyncio.get_event_loop().run_until_complete(websockets.connect(self.browser_console_uri))
+    def prefetch_stats(self) -> Dict[str, int]:
+        '''
+        Number of background prefetches started, completed, cancelled while the page was settling, and used by a question
+        '''
+        return dict(self.prefetch_counts)
+
+    def context_token_stats(self) -> Dict[str, float]:
+        '''
+        Number of context tokens sent to the html assistant per question
+        '''
+        n_questions = len(self.context_tokens)
+        return {
+            "questions": n_questions,
+            "total": sum(self.context_tokens),
+            "mean": sum(self.context_tokens) / n_questions if n_questions else 0.0,
+            "last": self.context_tokens[-1] if n_questions else 0,
+            "scopes": dict(self.context_scopes),
+        }
 
     async def fetch_html(self, **kwargs) -> str:
         '''
-        Fetch the HTML of the current page from the browser console
+        Fetch the HTML of the current page from the browser console.
+        The console is told which version of the HTML we hold, and replies with "unchanged",
+        a diff against that version, or a full snapshot.
         '''
-        if not self.websocket:
-            self.websocket = websockets.connect(self.browser_console_uri)
         print(f"Fetching HTML of current page...")
-        message = json.dumps({
-            'action': "fetchHTML",
-        })
-        
-        await self.websocket.send(message)
-        response_data = json.loads(await self.websocket.recv())
+        with span("fetch_html") as fetch_span:
+            response_data = await self.browser_console.request(
+                "fetchHTML",
+                version=self.page_html_version,
+                extraction="outline" if self.page_format == "outline" else self.html_extraction,
+            )
+            if fetch_span is not None:
+                fetch_span.set(status=response_data.get("status"))
         if not response_data.get('success'):
             raise Exception("Failed to fetch HTML")
-        return response_data["result"]
+        self.previous_page_html = self.page_html
+        status = response_data.get("status", "full")
+        if status == "unchanged":
+            self.page_html_change = (0, 0, 0)
+        elif status == "diff" and response_data["base"] == self.page_html_version:
+            self.page_html, self.page_html_change = apply_html_diff(self.page_html, response_data["diff"])
+            print(f"HTML diff received ({len(response_data['diff']['insert'])} lines changed)")
+        elif status == "full":
+            self.page_html = response_data["result"]
+            self.page_html_change = None
+        else:
+            # a diff against a version we do not hold, ask for a full snapshot
+            self.page_html_version = None
+            return await self.fetch_html()
+        self.page_html_version = response_data.get("version")
+        return self.page_html
     
-    def _retrieve_context(self,  vectorstore,  query: str) -> str:
+    async def fetch_scoped_html(self, action: str, **params) -> str:
+        '''
+        Fetch a scoped part of the HTML of the current page from the browser console
+        '''
+        response_data = await self.browser_console.request(action, **params)
+        if not response_data.get('success'):
+            raise Exception(f"Failed to fetch HTML ({action}): {response_data.get('error')}")
+        return response_data["result"]
+
+    async def fetch_subtree_html(self, selector: str) -> str:
+        '''
+        Fetch the HTML (or outline) of the subtrees of the elements matching a CSS selector (empty if nothing matches)
         '''
-        Get the  most relevant chunk using the user's question as a query
+        return await self.fetch_scoped_html("fetchSubtreeHTML", selector=selector, format=self.page_format)
+
+    async def fetch_viewport_html(self) -> str:
+        '''
+        Fetch the HTML (or outline) of the elements that intersect the viewport
+        '''
+        return await self.fetch_scoped_html("fetchViewportHTML", format=self.page_format)
+
+    async def fetch_interactive_html(self) -> str:
         '''
-        relevant_chunks = vectorstore.similarity_search(query, k = 1)
+        Fetch the interactive elements of the page (inputs, buttons, links, selects, ...) with their labels
+        '''
+        return await self.fetch_scoped_html("fetchInteractiveHTML")
+
+    async def fetch_page_version(self) -> Optional[Dict[str, str]]:
+        '''
+        Fetch the URL and DOM version of the current page from the browser console.
+        Returns None if the browser console could not report them.
+        '''
+        try:
+            response_data = await self.browser_console.request("pageVersion")
+        except Exception as e:
+            print(f"Failed to get page version: {e}")
+            return None
+        if not response_data.get('success'):
+            return None
+        return response_data["result"]
+
+    async def fetch_page_fingerprint(self) -> Optional[str]:
+        result = await self.fetch_page_version()
+        if result is None:
+            return None
+        return f"{result['url']}#{result['version']}"
+
+    def _retrieve_context(self, html: str, vectorstore, query: str) -> str:
+        '''
+        Get the most relevant fragments using the user's question as a query, and pack them into the context token budget.
+        html must be the HTML vectorstore was built from (self.html and self.vectorstore read together, under the page lock).
+        '''
+        # retrieve more fragments than fit in the budget, so that duplicates and oversized ones can be skipped
+        k = 2 * self.context_token_budget // self.fragment_size + 1
+        with span("similarity_search", retrieval=self.retrieval, k=k):
+            relevant_chunks = vectorstore.similarity_search(query, k = k)
         print("Relevant chunks retrieved")
-        relevant_chunks = [chunk.page_content for chunk in relevant_chunks]
-        return "\n\n".join(relevant_chunks)
+        spans = pack_context(html, relevant_chunks, self.context_token_budget)
+        print(f"{len(spans)} context fragments packed from {len(relevant_chunks)} retrieved")
+        return "\n\n".join(self._format_chunk(html[start:end].strip(), metadatas) for start, end, metadatas in spans)
 
     
-    def _build_message_with_context(self, question: str) -> str:
+    def _chunk_html(self, html: str) -> List[Document]:
+        '''
+        Chunk the HTML. If the HTML is a known change of the HTML that was last chunked,
+        only the changed region is chunked again.
+        '''
+        # outlines have one element per line and no tags to cut on
+        chunking = "lines" if self.page_format == "outline" else self.chunking
+        if (self.page_html_change is not None and self.previous_page_html is self.html and self.html_chunks
+                and chunking in ("tokens", "lines")):
+            return update_html_documents(self.html_chunks, html, self.page_html_change, self.fragment_size, chunking)
+        return get_html_documents(html, chunking, self.fragment_size)
+
+    def _build_index(self, html_chunks):
+        '''
+        Build the index used to retrieve the chunks relevant to a question
+        '''
+        if self.retrieval == "faiss":
+            return build_vectorstore([chunk.page_content for chunk in html_chunks], self._get_embeddings(), [chunk.metadata for chunk in html_chunks])
+        elif self.retrieval == "bm25":
+            return BM25Index(html_chunks)
+        elif self.retrieval == "hybrid":
+            return BM25Index(html_chunks, embeddings=self._get_embeddings())
+        raise ValueError(f"Unknown retrieval mode: {self.retrieval}")
+
+    def _format_chunk(self, content: str, metadatas: List[Dict]) -> str:
+        '''
+        Prefix a chunk with the paths of the root elements of the fragments it was merged from, if they are known
+        '''
+        paths = [f"{metadata['css_path']} ({metadata['xpath']})" for metadata in metadatas if metadata.get("css_path")]
+        if not paths:
+            return content
+        return f"<!-- {', '.join(paths)} -->\n{content}"
+
+    async def _fetch_scoped_context(self, question: str, fetched: Optional[Dict] = None) -> Optional[Tuple[str, str]]:
         '''
-        Build a message with the context retrieved from the HTML using RAG
+        Try the scoped parts of the page that may answer the question, narrowest first.
+        Returns the first one that is not empty and fits in the context token budget, with its format, or None.
+        The parts already fetched for other questions of a batch are taken from fetched, by scope and selector.
         '''
-        html = ""
+        fetchers = {
+            "subtree": self.fetch_subtree_html,
+            "interactive": lambda _: self.fetch_interactive_html(),
+            "viewport": lambda _: self.fetch_viewport_html(),
+        }
+        fetched = {} if fetched is None else fetched
+        for scope, selector in html_scopes_for_question(question, self.html_scopes):
+            try:
+                if (scope, selector) not in fetched:
+                    fetched[(scope, selector)] = await fetchers[scope](selector)
+                html = fetched[(scope, selector)]
+            except Exception as e:
+                # e.g. an invalid selector
+                print(f"Scoped HTML fetch failed ({scope}): {e}")
+                continue
+            if html.strip() and num_tokens_from_string(html) <= self.context_token_budget:
+                print(f"Context from the {scope} HTML" + (f" of {selector}" if selector else ""))
+                self.context_scopes[scope] += 1
+                # the interactive elements are always listed as HTML
+                return html, ("html" if scope == "interactive" else self.page_format)
+        return None
+
+    def _index_html(self, html: str):
+        '''
+        Chunk the HTML and build the index to retrieve chunks from (this makes the embedding calls)
+        '''
+        with span("chunk_html") as chunk_span:
+            html_chunks = self._chunk_html(html)
+            if chunk_span is not None:
+                chunk_span.set(chunks=len(html_chunks))
+        print("HTML chunked")
+        print("n_chunks = ", len(html_chunks))
+        # a FAISS vectorstore or a BM25Index, depending on the retrieval mode
+        with span("build_index", retrieval=self.retrieval):
+            vectorstore = self._build_index(html_chunks)
+        # the HTML, its chunks and its index are updated together
+        self.html = html
+        self.html_chunks = html_chunks
+        self.vectorstore = vectorstore
+        print(f"Index built (retrieval = {self.retrieval})")
+        print("embedding cache stats = ", self.embedding_cache_stats())
+
+    def _get_page_lock(self) -> asyncio.Lock:
+        if self.page_lock is None:
+            self.page_lock = asyncio.Lock()
+        return self.page_lock
+
+    async def _fetch_and_index_page(self) -> Tuple[str, str, Any]:
+        '''
+        Fetch the HTML of the page and, if it does not fit in the context token budget, index it (in a worker thread).
+        Returns the fetched HTML, with the indexed HTML and its index as they are under the page lock:
+        a prefetch may replace self.html and self.vectorstore as soon as the lock is released.
+        '''
+        async with self._get_page_lock():
+            html = await self.fetch_html()
+            if num_tokens_from_string(html) > self.context_token_budget and html != self.html: # html has changed
+                await asyncio.to_thread(self._index_html, html)
+            return html, self.html, self.vectorstore
+
+    def start_prefetch(self):
+        '''
+        Fetch and index the page in the background, e.g. after code was executed in the browser,
+        so that the next question does not wait for it. Must be called on the event loop the agents run on.
+        '''
+        if not self.prefetch_enabled:
+            return
+        self.cancel_prefetch()
+        self.prefetch_task = asyncio.ensure_future(self._prefetch())
+
+    def cancel_prefetch(self):
+        '''
+        Cancel the pending prefetch if the page is still settling, e.g. before more code is executed.
+        A prefetch that is already fetching or indexing completes, so that the HTML and its index stay consistent.
+        '''
+        if self.prefetch_task is not None and not self.prefetch_task.done() and self.prefetch_settling:
+            self.prefetch_task.cancel()
+            self.prefetch_counts["cancelled"] += 1
+        self.prefetch_task = None
+
+    async def _prefetch(self):
+        self.prefetch_counts["started"] += 1
+        self.prefetch_settling = True
         try:
-            html =  asyncio.get_event_loop().run_until_complete(self.fetch_html())
+            await self._wait_for_page_to_settle()
+        finally:
+            self.prefetch_settling = False
+        try:
+            await self._fetch_and_index_page()
         except Exception as e:
-           raise e
-        if num_tokens_from_string(html) < CHUNK_SIZE :
-            context = html
+            # the question will fetch the page again
+            print(f"Prefetching the page failed: {e}")
+            return
+        self.prefetched_version = self.page_html_version
+        self.prefetch_counts["completed"] += 1
+
+    async def _wait_for_page_to_settle(self):
+        # e.g. a navigation, or results loading after a search
+        previous_version = None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.prefetch_max_settle_time
+        while loop.time() < deadline:
+            await asyncio.sleep(self.prefetch_settle_delay)
+            version = await self.fetch_page_version()
+            if version is not None and version == previous_version:
+                return
+            previous_version = version
+
+    async def a_fetch_contexts(self, questions: List[str]) -> List[Tuple[str, str]]:
+        '''
+        The context of each question, with its format: from the narrowest part of the page that may answer it,
+        or retrieved from the HTML of the full page using RAG. The page is fetched and indexed at most once,
+        and each scoped part of the page is fetched once, whatever the number of questions.
+        Chunking, indexing and retrieval (which make blocking embedding calls) run in a worker thread.
+        If the page was prefetched and has not changed since, its index is used as is.
+        '''
+        fetched = {}
+        contexts = [await self._fetch_scoped_context(question, fetched) for question in questions]
+        page_questions = [i for i, context in enumerate(contexts) if context is None]
+        if not page_questions:
+            return contexts
+        # a prefetch still waiting for the page to settle is not needed anymore,
+        # one that is fetching or indexing has done part of the work and is waited for
+        self.cancel_prefetch()
+        html, indexed_html, vectorstore = await self._fetch_and_index_page()
+        if self.prefetched_version is not None and self.page_html_version == self.prefetched_version:
+            self.prefetch_counts["used"] += 1
+            self.prefetched_version = None
+        if num_tokens_from_string(html) <= self.context_token_budget :
+            page_contexts = [html] * len(page_questions)
         else :
-            if html != self.html: # html has changed
-                self.html = html # update html
-                html_chunks = get_html_chunks(html)
-                print("HTML chunked")
-                print("n_chunks = ", len(html_chunks))
-                vectorstore = build_vectorstore(html_chunks)
-                self.vectorstore = vectorstore
-                print("Vectorstore built")
-            context = self._retrieve_context(self.vectorstore, question)
-        message = PROMPT_QA.format(input_question=question, input_context=context)
+            page_contexts = await asyncio.to_thread(lambda: [self._retrieve_context(indexed_html, vectorstore, questions[i]) for i in page_questions])
+        for i, context in zip(page_questions, page_contexts):
+            contexts[i] = (context, self.page_format)
+        self.context_scopes["page"] += len(page_questions)
+        return contexts
+
+    async def a_build_message_with_context(self, question: str) -> str:
+        '''
+        Build a message with the context from the narrowest part of the page that may answer the question,
+        or retrieved from the HTML of the full page using RAG (see a_fetch_contexts).
+        '''
+        (context, page_format), = await self.a_fetch_contexts([question])
+        return self._build_message(question, context, page_format)
+
+    async def a_build_batch_messages(self, questions: List[str]) -> List[Tuple[List[int], str]]:
+        '''
+        Build the messages asking a batch of questions about the current page, each with the questions it asks
+        (as indices in questions). Questions are packed in order, up to batch_max_questions per message and
+        batch_token_budget tokens of context, and a context shared by several questions of a message is sent once.
+        '''
+        contexts = await self.a_fetch_contexts(questions)
+        groups = []
+        for i, (context, _) in enumerate(contexts):
+            group = groups[-1] if groups else None
+            new_tokens = num_tokens_from_string(context)
+            if (group is None or len(group["questions"]) >= self.batch_max_questions
+                    or (context not in group["contexts"] and group["tokens"] + new_tokens > self.batch_token_budget)):
+                group = {"questions": [], "contexts": [], "tokens": 0}
+                groups.append(group)
+            if context not in group["contexts"]:
+                group["contexts"].append(context)
+                group["tokens"] += new_tokens
+            group["questions"].append(i)
+        return [(group["questions"], self._build_batch_message(questions, contexts, group)) for group in groups]
+
+    def _build_batch_message(self, questions: List[str], contexts: List[Tuple[str, str]], group: Dict[str, Any]) -> str:
+        self.context_tokens.append(group["tokens"])
+        print(f"batch of {len(group['questions'])} questions, context tokens = ", group["tokens"])
+        input_contexts = "\n\n".join(f"Context {n} is: {context}" for n, context in enumerate(group["contexts"], 1))
+        input_questions = "\n".join(
+            f"{n}. {questions[i]} (from context {group['contexts'].index(contexts[i][0]) + 1})"
+            for n, i in enumerate(group["questions"], 1)
+        )
+        return PROMPT_QA_BATCH.format(input_contexts=input_contexts, input_questions=input_questions)
+
+    def _build_message_with_context(self, question: str) -> str:
+        return self.browser_console.run(self.a_build_message_with_context(question))
+
+    def _build_message(self, question: str, context: str, page_format: str = "html") -> str:
+        self.context_tokens.append(num_tokens_from_string(context))
+        print("context tokens = ", self.context_tokens[-1])
+        prompt = PROMPT_QA_OUTLINE if page_format == "outline" else PROMPT_QA
+        message = prompt.format(input_question=question, input_context=context)
         return message
 
     def send(
@@ -178,4 +640,23 @@ class RetrieveHTMLProxyAgent(autogen.ConversableAgent):
         else:
             raise ValueError(
                 "Message can't be converted into a valid ChatCompletion message. Either content or function_call must be provided."
-            )
\ No newline at end of file
+            )
+
+    async def a_send(
+        self,
+        message: Union[Dict, str],
+        recipient: Agent,
+        request_reply: Optional[bool] = None,
+        silent: Optional[bool] = False,
+    ) -> bool:
+        '''
+        (async) Send a message to another agent, with the relevant HTML context added to it
+        '''
+        message = await self.a_build_message_with_context(message)
+        valid = self._append_oai_message(message, "assistant", recipient)
+        if valid:
+            await recipient.a_receive(message, self, request_reply, silent)
+        else:
+            raise ValueError(
+                "Message can't be converted into a valid ChatCompletion message. Either content or function_call must be provided."
+            )
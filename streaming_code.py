@@ -0,0 +1,191 @@
+import asyncio
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import openai
+from autogen import ConversableAgent, oai
+from autogen.agentchat.agent import Agent
+from autogen.code_utils import CODE_BLOCK_PATTERN
+
+from async_replies import a_generate_oai_reply
+from browser_proxy_agent import BrowserProxyAgent
+from completion_cache import completion_key
+from token_count import num_tokens_from_messages, num_tokens_from_string
+from tracing import span
+
+CODE_BLOCK_REGEX = re.compile(CODE_BLOCK_PATTERN, flags=re.DOTALL)
+# parameters of a config of the config list that are passed to openai
+OPENAI_CONFIG_KEYS = ["model", "api_key", "api_base", "api_type", "api_version"]
+
+
+def stream_chat_completion(llm_config: Dict[str, Any], messages: List[Dict], cancelled: threading.Event) -> Iterator[str]:
+    '''
+    Stream the text of a chat completion, trying the configs of the config list in order until one accepts the request.
+    Stops early when cancelled is set.
+    '''
+    params = {name: value for name, value in llm_config.items() if name not in ("config_list", "seed")}
+    config_list = llm_config.get("config_list") or [{}]
+    for i, config in enumerate(config_list):
+        try:
+            # the model of the config overrides the default model of the agent
+            request = {**params, **{key: config[key] for key in OPENAI_CONFIG_KEYS if key in config}}
+            response = openai.ChatCompletion.create(messages=messages, stream=True, **request)
+            break
+        except openai.error.OpenAIError as e:
+            if i == len(config_list) - 1:
+                raise
+            print(f"Streaming completion with config {i} failed ({e}), trying the next one")
+    for chunk in response:
+        if cancelled.is_set():
+            response.close()
+            return
+        if chunk["choices"]:
+            text = chunk["choices"][0]["delta"].get("content")
+            if text:
+                yield text
+
+
+class StreamingCodeGenerator:
+    '''
+    Streams the completions of the code generator, and sends each fenced code block to the browser as soon as it is closed,
+    so that the browser executes the code while the model is still generating the rest of its reply (e.g. an explanation).
+    Blocks are executed in order; if one fails the stream is cancelled, and the reply is cut after the failed block,
+    so that the code generator is told about the failure and retries as when the code is executed after the reply.
+    The execution results are handed to the executor, which reports them instead of executing the reply again.
+    '''
+
+    def __init__(self, executor: BrowserProxyAgent):
+        self.executor = executor
+        self.streamed_replies = 0
+        self.cancelled_streams = 0
+
+    def register(self, code_generator: ConversableAgent):
+        functions = [reply_func_tuple["reply_func"] for reply_func_tuple in code_generator._reply_func_list]
+        position = functions.index(a_generate_oai_reply) if a_generate_oai_reply in functions else 0
+        code_generator.register_reply([Agent, None], self.a_generate_reply, position=position)
+
+    async def a_generate_reply(
+        self,
+        recipient: ConversableAgent,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[Agent] = None,
+        config: Optional[Any] = None,
+    ) -> Tuple[bool, Union[str, Dict, None]]:
+        llm_config = recipient.llm_config if config is None else config
+        if llm_config is False:
+            return False, None
+        if messages is None:
+            messages = recipient._oai_messages[sender]
+        if self.executor._consecutive_auto_reply_counter[recipient] >= self.executor.max_consecutive_auto_reply(recipient):
+            # the executor will not reply to (and execute) this reply, so its code must not be executed early either
+            return await a_generate_oai_reply(recipient, messages, sender, config)
+        conversation = messages
+        messages = recipient._oai_system_message + messages
+        completion_cache = getattr(recipient, "completion_cache", None)
+        if completion_cache is not None:
+            key = completion_key(llm_config, messages)
+            response = completion_cache.get(key)
+            if response is not None:
+                # the executor executes the code blocks of the cached reply as usual
+                return True, response["choices"][0]["message"]["content"]
+
+        models = [config.get("model") for config in llm_config.get("config_list", [])]
+        model = models[0] if models else llm_config.get("model")
+        with span("llm", agent=recipient.name, model=model, streaming=True) as llm_span:
+            loop = asyncio.get_running_loop()
+            cancelled = threading.Event()
+            # text of the stream, and None when the stream ends (or the exception that ended it)
+            texts: asyncio.Queue = asyncio.Queue()
+            blocks: asyncio.Queue = asyncio.Queue()
+
+            def read_stream():
+                try:
+                    for text in stream_chat_completion(llm_config, messages, cancelled):
+                        loop.call_soon_threadsafe(texts.put_nowait, text)
+                    loop.call_soon_threadsafe(texts.put_nowait, None)
+                except Exception as e:
+                    loop.call_soon_threadsafe(texts.put_nowait, e)
+
+            # results of the blocks executed so far, and where the block that failed ends in the reply
+            results: List[Tuple[int, str]] = []
+            failed_block_end = None
+
+            async def execute_blocks():
+                nonlocal failed_block_end
+                while True:
+                    block = await blocks.get()
+                    if block is None:
+                        return
+                    lang, code, end = block
+                    exitcode, logs = await self.executor.a_execute_code_blocks([(lang, code)])
+                    results.append((exitcode, logs))
+                    if exitcode != 0:
+                        failed_block_end = end
+                        cancelled.set()
+                        # wake up the reader of the stream
+                        texts.put_nowait(None)
+                        return
+
+            asyncio.ensure_future(asyncio.to_thread(read_stream))
+            executor = asyncio.ensure_future(execute_blocks())
+            content = ""
+            scanned = 0
+            try:
+                while not cancelled.is_set():
+                    text = await texts.get()
+                    if isinstance(text, Exception):
+                        if scanned:
+                            # a block was dispatched, and may be running or have run in the browser (even if it has no
+                            # result yet), so the reply can not be generated again without repeating its actions
+                            raise text
+                        print(f"Streaming the code generator reply failed ({text}), generating it without streaming")
+                        if llm_span is not None:
+                            llm_span.set(fallback=True)
+                        return await a_generate_oai_reply(recipient, conversation, sender, config)
+                    if text is None:
+                        break
+                    content += text
+                    for match in CODE_BLOCK_REGEX.finditer(content, scanned):
+                        blocks.put_nowait((match.group(1), match.group(2), match.end()))
+                        scanned = match.end()
+                blocks.put_nowait(None)
+                await executor
+            finally:
+                # the thread reading the stream stops at the next chunk, it is not waited for
+                cancelled.set()
+                executor.cancel()
+
+            self.streamed_replies += 1
+            if failed_block_end is not None:
+                self.cancelled_streams += 1
+                content = content[:failed_block_end]
+            if results:
+                exitcode, _ = results[-1]
+                self.executor.streamed_executions[content] = (exitcode, "".join(logs for _, logs in results))
+            self.record_usage(recipient, model, messages, content, llm_span)
+            if completion_cache is not None:
+                completion_cache.put(key, {"choices": [{"message": {"role": "assistant", "content": content}}]})
+            return True, content
+
+    def record_usage(self, recipient: ConversableAgent, model: str, messages: List[Dict], content: str, llm_span=None):
+        # streamed completions do not report their usage, so it is counted here, and priced as autogen prices a response
+        prompt_tokens = num_tokens_from_messages(messages)
+        completion_tokens = num_tokens_from_string(content)
+        cost = oai.ChatCompletion.cost({"model": model, "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}})
+        if llm_span is not None:
+            llm_span.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cost=cost)
+        token_usage = getattr(recipient, "token_usage", None)
+        if token_usage is None:
+            return
+        token_usage["calls"] += 1
+        token_usage["prompt_tokens"] += prompt_tokens
+        token_usage["completion_tokens"] += completion_tokens
+        token_usage["total_tokens"] += prompt_tokens + completion_tokens
+        token_usage["cost"] += cost
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "streamed_replies": self.streamed_replies,
+            "cancelled_streams": self.cancelled_streams,
+        }
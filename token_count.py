@@ -1,17 +1,78 @@
+import functools
+from typing import Dict, List
+
 import tiktoken
 import sys
 
+
+# encodings used in place of tiktoken's, by name (e.g. the offline stand-in of benchmark.py)
+local_encodings: Dict[str, tiktoken.Encoding] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(encoding_name = "cl100k_base") -> tiktoken.Encoding:
+    """Returns the tokenizer for the given encoding, loading it only once."""
+    if encoding_name in local_encodings:
+        return local_encodings[encoding_name]
+    return tiktoken.get_encoding(encoding_name)
+
+
+def use_local_encoding(encoding_name: str, encoding: tiktoken.Encoding):
+    """Counts the tokens of encoding_name with encoding from now on, e.g. where tiktoken can not download encoding_name."""
+    local_encodings[encoding_name] = encoding
+    get_encoding.cache_clear()
+
 # count number of tokens for OpenAI's models
 def num_tokens_from_string(string: str, encoding_name = "cl100k_base") -> int:
     """Returns the number of tokens in a text string."""
-    encoding = tiktoken.get_encoding(encoding_name)
-    num_tokens = len(encoding.encode(string))
+    encoding = get_encoding(encoding_name)
+    num_tokens = len(encoding.encode(string, disallowed_special=()))
     return num_tokens
 
 
+def num_tokens_from_strings(strings: List[str], encoding_name = "cl100k_base") -> List[int]:
+    """Returns the number of tokens of each text string."""
+    # tiktoken's encode_batch submits every string to a thread pool, which costs more than
+    # encoding the many short strings (e.g. HTML tags) this is called with
+    encode = get_encoding(encoding_name).encode_ordinary
+    return [len(encode(string)) for string in strings]
+
+
+def token_offsets(string: str, encoding_name = "cl100k_base") -> List[int]:
+    """Returns the character offset at which each token of a text string starts."""
+    encoding = get_encoding(encoding_name)
+    _, offsets = encoding.decode_with_offsets(encoding.encode(string, disallowed_special=()))
+    return offsets
+
+
+# tokens OpenAI adds to a chat prompt for every message, for the name of a message, and to prime the reply
+# (as counted in the OpenAI cookbook for the gpt-3.5-turbo and gpt-4 models)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+
+def num_tokens_from_message(message: Dict) -> int:
+    """Returns the number of tokens of the content and function call of a chat message."""
+    tokens = num_tokens_from_string(message.get("content") or "")
+    function_call = message.get("function_call")
+    if function_call:
+        tokens += num_tokens_from_string(function_call.get("name", "") + function_call.get("arguments", ""))
+    return tokens
+
+
+def num_tokens_from_messages(messages: List[Dict]) -> int:
+    """Returns the number of prompt tokens of a list of chat messages, with the overhead of each message."""
+    return TOKENS_PER_REPLY + sum(
+        TOKENS_PER_MESSAGE + num_tokens_from_message(message) + (TOKENS_PER_NAME + num_tokens_from_string(message["name"]) if message.get("name") else 0)
+        for message in messages
+    )
+
+
 if __name__ == "__main__":
-    filename  = sys.argv[1]
-    with open(filename, "r") as f:
-        s = f.read()
-        token_count = num_tokens_from_string(s)
-        print(f"Token count is {token_count}")
\ No newline at end of file
+    # e.g. python token_count.py page.html page.outline.txt
+    for filename in sys.argv[1:]:
+        with open(filename, "r") as f:
+            s = f.read()
+            token_count = num_tokens_from_string(s)
+            print(f"Token count of {filename} is {token_count}")
@@ -0,0 +1,132 @@
+import contextvars
+import itertools
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# the trace of the task being run and the span being measured, in the context of the current asyncio task
+# (worker threads started with asyncio.to_thread inherit them)
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+span_ids = itertools.count(1)
+
+
+class Span:
+    '''
+    A timed step of a task, e.g. an LLM call, an HTML fetch or a code execution, with attributes
+    such as the agent and model, token counts, cost, or the timings reported by the browser console.
+    '''
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = next(span_ids)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration_ms = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            **self.attributes,
+        }
+
+
+class Trace:
+    '''
+    The spans of one task. Spans are exported as JSONL, one span per line, if a path is given.
+    '''
+
+    def __init__(self, trace_id: str, task: str, path: Optional[str] = None):
+        self.trace_id = trace_id
+        self.task = task
+        self.path = path
+        self.spans: List[Span] = []
+
+    def export(self):
+        if not self.path:
+            return
+        with open(self.path, "a") as f:
+            for span in self.spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        '''
+        Where the time of the task went: count and total duration of the spans by name, the time executed code
+        spent waiting for the page, and the tokens and cost of the LLM calls by model
+        '''
+        steps = defaultdict(lambda: {"count": 0, "total_ms": 0.0})
+        models = defaultdict(lambda: {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+        for span in self.spans:
+            steps[span.name]["count"] += 1
+            steps[span.name]["total_ms"] += span.duration_ms or 0.0
+            # cached completions cost nothing, and a stream that fell back to a regular completion is counted by the latter
+            if span.name == "llm" and not span.attributes.get("cached") and not span.attributes.get("fallback"):
+                usage = models[span.attributes.get("model", "unknown")]
+                usage["calls"] += 1
+                usage["prompt_tokens"] += span.attributes.get("prompt_tokens", 0)
+                usage["completion_tokens"] += span.attributes.get("completion_tokens", 0)
+                usage["cost"] += span.attributes.get("cost", 0.0)
+        # time the executed code spent waiting for the page (navigations, waitUntilReady...), as reported by the console
+        browser_wait_ms = sum(span.attributes.get("server_timing", {}).get("waitMs", 0.0) for span in self.spans if span.name == "console.executeCode")
+        root = next((span for span in self.spans if span.parent_id is None), None)
+        return {
+            "trace_id": self.trace_id,
+            "duration_ms": root.duration_ms if root is not None else None,
+            "steps": {name: {"count": step["count"], "total_ms": round(step["total_ms"], 1)} for name, step in steps.items()},
+            "models": dict(models),
+            "browser_wait_ms": round(browser_wait_ms, 1),
+            "cost": sum(usage["cost"] for usage in models.values()),
+        }
+
+
+@contextmanager
+def start_trace(task: str, path: Optional[str] = None) -> Iterator[Trace]:
+    '''
+    Trace a task: the spans measured until the block exits (in this asyncio task, and the tasks and threads it starts)
+    are collected in the trace, under a root span "task"
+    '''
+    trace = Trace(f"{time.time():.0f}-{next(span_ids)}", task, path)
+    token = current_trace.set(trace)
+    try:
+        with span("task", task=task):
+            yield trace
+    finally:
+        current_trace.reset(token)
+        trace.export()
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    '''
+    Measure a step of the current task. Yields None (and measures nothing) outside of a trace.
+    '''
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = current_span.get()
+    measured = Span(name, trace.trace_id, parent.span_id if parent is not None else None, attributes)
+    token = current_span.set(measured)
+    started = time.perf_counter()
+    try:
+        yield measured
+    except BaseException as e:
+        measured.set(error=repr(e))
+        raise
+    finally:
+        measured.duration_ms = round((time.perf_counter() - started) * 1000, 3)
+        current_span.reset(token)
+        trace.spans.append(measured)
@@ -0,0 +1,132 @@
+import re
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+from answer_cache import normalize_question
+
+# a navigation of puppeteer code to a literal URL, e.g. page.goto("https://example.com")
+NAVIGATION_PATTERN = re.compile(r"""\.goto\(\s*(['"`])(.+?)\1""")
+PAGE_CALL_PATTERN = re.compile(r"\bpage\.(\w+)\(")
+
+
+def page_domain(url: Optional[str]) -> str:
+    '''
+    Domain of the page at url ("" for a blank page, e.g. a new browser session).
+    '''
+    if not url:
+        return ""
+    return urlparse(url).hostname or ""
+
+
+def starts_with_navigation(steps: List[str]) -> bool:
+    '''
+    Whether the first thing the code steps do with the page is navigating, so that they do not depend on the page they start on
+    '''
+    match = PAGE_CALL_PATTERN.search(steps[0]) if steps else None
+    return match is not None and match.group(1) == "goto"
+
+
+def trajectory_domain(steps: List[str], start_domain: str) -> str:
+    '''
+    Domain of the site the code steps act on: that of their first navigation if they start by navigating
+    (or start on a blank page), the domain of the page they start on otherwise.
+    '''
+    if start_domain and not starts_with_navigation(steps):
+        return start_domain
+    for step in steps:
+        for match in NAVIGATION_PATTERN.finditer(step):
+            # URLs built at run time (template literals) are not known
+            domain = page_domain(match.group(2)) if "${" not in match.group(2) else ""
+            if domain:
+                return domain
+    return start_domain
+
+
+class TrajectoryCache:
+    '''
+    A store of the code steps that completed tasks, keyed by the normalized task and the domain of the site the steps
+    act on (see trajectory_domain), so that a repeated task can be replayed in the browser without asking the planner.
+    A task is served the trajectory for the domain of the page it starts on, or else one that starts by navigating
+    to its site, e.g. in a new browser session.
+    If a path is given, trajectories are persisted to disk and shared between runs.
+    '''
+
+    def __init__(self, path: Optional[str] = None, size_limit: int = 2**28):
+        # trajectories of a normalized task by domain, the most recently stored last
+        self.trajectories: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.disk = None
+        if path:
+            # diskcache is a dependency of autogen, so it is always available
+            import diskcache
+            self.disk = diskcache.Cache(path, size_limit=size_limit)
+        self.hits = 0 # tasks completed by replaying their trajectory, without any LLM call
+        self.verified_hits = 0 # tasks whose trajectory was fully replayed, then checked by the planner (verify)
+        self.fallbacks = 0 # tasks whose replay failed at some step, and were handed to the planner
+        self.misses = 0
+        self.steps_replayed = 0
+
+    def key(self, task: str) -> str:
+        return normalize_question(task)
+
+    def _load(self, key: str) -> Dict[str, Dict[str, Any]]:
+        trajectories = self.trajectories.get(key)
+        if trajectories is None and self.disk is not None:
+            trajectories = self.disk.get(key)
+        return trajectories or {}
+
+    def get(self, task: str, domain: str) -> Optional[List[str]]:
+        '''
+        Steps of the trajectory of task for a page of domain, or None
+        '''
+        trajectories = self._load(self.key(task))
+        trajectory = trajectories.get(domain)
+        if trajectory is None:
+            trajectory = next((trajectory for trajectory in reversed(list(trajectories.values())) if starts_with_navigation(trajectory["steps"])), None)
+        if trajectory is None:
+            self.misses += 1
+            return None
+        return trajectory["steps"]
+
+    def put(self, task: str, start_domain: str, steps: List[str]):
+        '''
+        Store the steps that completed task, started on a page of start_domain
+        '''
+        if not steps:
+            return
+        key = self.key(task)
+        domain = trajectory_domain(steps, start_domain)
+        trajectories = {name: trajectory for name, trajectory in self._load(key).items() if name != domain}
+        trajectories[domain] = {"task": task, "domain": domain, "steps": list(steps)}
+        self.trajectories[key] = trajectories
+        if self.disk is not None:
+            self.disk.set(key, trajectories)
+
+    def record_replay(self, steps_replayed: int, completed: bool, verified: bool = False):
+        self.steps_replayed += steps_replayed
+        if not completed:
+            self.fallbacks += 1
+        elif verified:
+            self.verified_hits += 1
+        else:
+            self.hits += 1
+
+    def stats(self) -> Dict[str, float]:
+        '''
+        Lookups by outcome: hit_rate counts only the tasks completed without any LLM call, verified_hit_rate
+        those that were fully replayed and then checked by the planner
+        '''
+        lookups = self.hits + self.verified_hits + self.fallbacks + self.misses
+        return {
+            "entries": len(self.disk) if self.disk is not None else len(self.trajectories),
+            "hits": self.hits,
+            "verified_hits": self.verified_hits,
+            "fallbacks": self.fallbacks,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "verified_hit_rate": self.verified_hits / lookups if lookups else 0.0,
+            "steps_replayed": self.steps_replayed,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()